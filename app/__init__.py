@@ -1,5 +1,15 @@
 """Primary Classes Course/Student Management System backend package."""
 
-from .main import create_app
+from typing import Any
 
 __all__ = ["create_app"]
+
+
+def __getattr__(name: str) -> Any:
+    # Imported lazily so worker processes that unpickle a function from a
+    # leaf module (see ``services.thumbnail_render``) do not build the app.
+    if name == "create_app":
+        from .main import create_app
+
+        return create_app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
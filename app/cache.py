@@ -0,0 +1,495 @@
+"""Shared cache with TTLs, tag invalidation and hit/miss statistics.
+
+``cache_url`` picks the backend: ``memory://`` (per-process LRU), a
+``sqlite:///path`` file shared by the workers of one host, or
+``redis://host:port/db`` for a Redis-protocol server shared by every host.
+
+Entries are tagged with the tables they were built from. Every session commit
+bumps the version of each table it wrote, which invalidates the matching
+entries on all workers at once; a delete also counts as a write to the tables
+its foreign keys cascade to. Values must be JSON-serializable.
+
+Command-line jobs (archiving, packing, rebuilds) cannot reach the per-process
+``memory://`` cache, so they call ``bump_cache_generation`` and memory caches
+drop a school's entries when they see its ``cache.generation`` setting change.
+"""
+
+import json
+import logging
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from datetime import datetime
+from functools import lru_cache
+from typing import Any, Callable, Iterable
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from sqlalchemy import Table, event, select, update
+from sqlalchemy.orm import Session as OrmSession
+from sqlmodel import SQLModel
+
+from .config import get_settings
+from .models import Setting
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_ENTRIES = 10_000
+PURGE_EVERY_SETS = 500
+CACHE_GENERATION_KEY = "cache.generation"
+GENERATION_CHECK_SECONDS = 5
+
+
+class Cache(ABC):
+    """Tag-aware operations shared by every backend.
+
+    An entry stores the versions its tags had when it was built; it is a miss
+    once any of those tags has been bumped since.
+    """
+
+    backend = "none"
+
+    def __init__(self, default_ttl: int | None = None) -> None:
+        self.default_ttl = default_ttl
+        self._stats = {"hits": 0, "misses": 0, "sets": 0, "invalidations": 0, "errors": 0}
+        self._stats_lock = threading.Lock()
+
+    # Backend primitives.
+    @abstractmethod
+    def _get(self, key: str) -> bytes | None: ...
+
+    @abstractmethod
+    def _set(self, key: str, value: bytes, ttl: int | None) -> None: ...
+
+    @abstractmethod
+    def _delete(self, key: str) -> None: ...
+
+    @abstractmethod
+    def _tag_versions(self, tags: list[str]) -> list[int]: ...
+
+    @abstractmethod
+    def _bump_tags(self, tags: list[str]) -> None: ...
+
+    def _count(self, name: str, amount: int = 1) -> None:
+        with self._stats_lock:
+            self._stats[name] += amount
+
+    def get(self, key: str, default: Any = None) -> Any:
+        try:
+            raw = self._get(key)
+            if raw is not None:
+                entry = json.loads(raw)
+                tags = list(entry["t"])
+                if not tags or self._tag_versions(tags) == [entry["t"][tag] for tag in tags]:
+                    self._count("hits")
+                    return entry["v"]
+        except Exception as exc:
+            self._count("errors")
+            logger.warning("Cache read failed for %s: %s", key, exc)
+        self._count("misses")
+        return default
+
+    def set(
+        self, key: str, value: Any, ttl: int | None = None, tags: Iterable[str] = (), versions: list[int] | None = None
+    ) -> None:
+        tags = list(tags)
+        try:
+            if versions is None:
+                versions = self._tag_versions(tags) if tags else []
+            payload = json.dumps({"v": value, "t": dict(zip(tags, versions))}, default=str).encode()
+            self._set(key, payload, ttl if ttl is not None else self.default_ttl)
+            self._count("sets")
+        except Exception as exc:
+            self._count("errors")
+            logger.warning("Cache write failed for %s: %s", key, exc)
+
+    def get_or_set(
+        self, key: str, loader: Callable[[], Any], ttl: int | None = None, tags: Iterable[str] = (), store: bool = True
+    ) -> Any:
+        """Return the cached value, or build it with ``loader`` and, if ``store``, cache it.
+
+        Tag versions are read before ``loader`` runs, so a write committed while
+        the value is being built leaves the new entry already stale.
+        """
+
+        missing = object()
+        value = self.get(key, missing)
+        if value is not missing:
+            return value
+        if not store:
+            return loader()
+        tags = list(tags)
+        try:
+            versions = self._tag_versions(tags) if tags else []
+        except Exception:
+            versions = None
+        value = loader()
+        if versions is not None:
+            self.set(key, value, ttl, tags, versions)
+        return value
+
+    def delete(self, key: str) -> None:
+        try:
+            self._delete(key)
+        except Exception as exc:
+            self._count("errors")
+            logger.warning("Cache delete failed for %s: %s", key, exc)
+
+    def invalidate_tags(self, tags: Iterable[str]) -> None:
+        tags = sorted(set(tags))
+        if not tags:
+            return
+        try:
+            self._bump_tags(tags)
+            self._count("invalidations", len(tags))
+        except Exception as exc:
+            self._count("errors")
+            logger.warning("Cache invalidation failed for %s: %s", tags, exc)
+
+    def stats(self) -> dict[str, Any]:
+        with self._stats_lock:
+            stats: dict[str, Any] = dict(self._stats)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 4) if lookups else None
+        stats["backend"] = self.backend
+        return stats
+
+
+class MemoryCache(Cache):
+    """Per-process LRU; tag versions are kept apart so eviction never revives stale entries."""
+
+    backend = "memory"
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES, default_ttl: int | None = None) -> None:
+        super().__init__(default_ttl)
+        self.max_entries = max_entries
+        self._entries: OrderedDict[str, tuple[float | None, bytes]] = OrderedDict()
+        self._tags: dict[str, int] = {}
+        self._lock = threading.Lock()
+        self.generations: dict[str | None, tuple[float, str | None]] = {}  # tenant -> (checked at, generation)
+
+    def _get(self, key: str) -> bytes | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def _set(self, key: str, value: bytes, ttl: int | None) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl if ttl else None, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _delete(self, key: str) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def _tag_versions(self, tags: list[str]) -> list[int]:
+        with self._lock:
+            return [self._tags.get(tag, 0) for tag in tags]
+
+    def _bump_tags(self, tags: list[str]) -> None:
+        with self._lock:
+            for tag in tags:
+                self._tags[tag] = self._tags.get(tag, 0) + 1
+
+
+class SQLiteCache(Cache):
+    """A SQLite file in WAL mode, shared by every worker process on one host."""
+
+    backend = "sqlite"
+
+    def __init__(self, path: str, max_entries: int = DEFAULT_MAX_ENTRIES, default_ttl: int | None = None) -> None:
+        super().__init__(default_ttl)
+        self.path = path
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._sets = 0
+        with self._connection() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS cache_entries (key TEXT PRIMARY KEY, value BLOB NOT NULL, expires_at REAL)"
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS ix_cache_entries_expires_at ON cache_entries (expires_at)")
+            connection.execute("CREATE TABLE IF NOT EXISTS cache_tags (tag TEXT PRIMARY KEY, version INTEGER NOT NULL)")
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def _get(self, key: str) -> bytes | None:
+        row = self._connection().execute(
+            "SELECT value FROM cache_entries WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)", (key, time.time())
+        ).fetchone()
+        return row[0] if row else None
+
+    def _set(self, key: str, value: bytes, ttl: int | None) -> None:
+        connection = self._connection()
+        connection.execute(
+            "INSERT INTO cache_entries (key, value, expires_at) VALUES (?, ?, ?) "
+            "ON CONFLICT (key) DO UPDATE SET value = excluded.value, expires_at = excluded.expires_at",
+            (key, value, time.time() + ttl if ttl else None),
+        )
+        self._sets += 1
+        if self._sets % PURGE_EVERY_SETS == 0:
+            self._purge(connection)
+
+    def _purge(self, connection: sqlite3.Connection) -> None:
+        """Drop expired entries, then the soonest-expiring ones beyond ``max_entries``."""
+
+        connection.execute("DELETE FROM cache_entries WHERE expires_at <= ?", (time.time(),))
+        excess = connection.execute("SELECT COUNT(*) FROM cache_entries").fetchone()[0] - self.max_entries
+        if excess > 0:
+            connection.execute(
+                "DELETE FROM cache_entries WHERE key IN "
+                "(SELECT key FROM cache_entries ORDER BY expires_at IS NULL, expires_at LIMIT ?)",
+                (excess,),
+            )
+
+    def _delete(self, key: str) -> None:
+        self._connection().execute("DELETE FROM cache_entries WHERE key = ?", (key,))
+
+    def _tag_versions(self, tags: list[str]) -> list[int]:
+        placeholders = ", ".join("?" for _ in tags)
+        rows = dict(
+            self._connection().execute(f"SELECT tag, version FROM cache_tags WHERE tag IN ({placeholders})", tags).fetchall()
+        )
+        return [rows.get(tag, 0) for tag in tags]
+
+    def _bump_tags(self, tags: list[str]) -> None:
+        self._connection().executemany(
+            "INSERT INTO cache_tags (tag, version) VALUES (?, 1) ON CONFLICT (tag) DO UPDATE SET version = version + 1",
+            [(tag,) for tag in tags],
+        )
+
+
+class RedisError(Exception):
+    """An error reply from the Redis server."""
+
+
+class RedisCache(Cache):
+    """Minimal RESP2 client; tag versions are plain keys without a TTL."""
+
+    backend = "redis"
+
+    def __init__(self, url: str, default_ttl: int | None = None, timeout: float = 2.0) -> None:
+        super().__init__(default_ttl)
+        parts = urlsplit(url)
+        self.host = parts.hostname or "localhost"
+        self.port = parts.port or 6379
+        self.password = unquote(parts.password) if parts.password else None
+        self.db = int(parts.path.strip("/") or 0)
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connect(self) -> Any:
+        sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        stream = sock.makefile("rwb")
+        self._local.stream = stream
+        if self.password:
+            self._roundtrip(stream, ("AUTH", self.password))
+        if self.db:
+            self._roundtrip(stream, ("SELECT", self.db))
+        return stream
+
+    def command(self, *args: Any) -> Any:
+        stream = getattr(self._local, "stream", None)
+        for attempt in range(2):
+            try:
+                return self._roundtrip(stream or self._connect(), args)
+            except (OSError, EOFError):
+                self._local.stream = stream = None
+                if attempt:
+                    raise
+        raise AssertionError("unreachable")
+
+    def _roundtrip(self, stream: Any, args: tuple[Any, ...]) -> Any:
+        encoded = [arg if isinstance(arg, bytes) else str(arg).encode() for arg in args]
+        stream.write(b"*%d\r\n" % len(encoded) + b"".join(b"$%d\r\n%s\r\n" % (len(arg), arg) for arg in encoded))
+        stream.flush()
+        return self._read(stream)
+
+    def _read(self, stream: Any) -> Any:
+        line = stream.readline()
+        if not line:
+            raise EOFError("connection closed")
+        kind, body = line[:1], line[1:-2]
+        if kind == b"+":
+            return body.decode()
+        if kind == b"-":
+            raise RedisError(body.decode())
+        if kind == b":":
+            return int(body)
+        if kind == b"$":
+            length = int(body)
+            if length < 0:
+                return None
+            data = stream.read(length + 2)
+            return data[:-2]
+        if kind == b"*":
+            length = int(body)
+            return None if length < 0 else [self._read(stream) for _ in range(length)]
+        raise RedisError(f"unexpected reply {line!r}")
+
+    def _get(self, key: str) -> bytes | None:
+        return self.command("GET", key)
+
+    def _set(self, key: str, value: bytes, ttl: int | None) -> None:
+        if ttl:
+            self.command("SET", key, value, "EX", ttl)
+        else:
+            self.command("SET", key, value)
+
+    def _delete(self, key: str) -> None:
+        self.command("DEL", key)
+
+    def _tag_versions(self, tags: list[str]) -> list[int]:
+        return [int(value) if value is not None else 0 for value in self.command("MGET", *[f"tag:{tag}" for tag in tags])]
+
+    def _bump_tags(self, tags: list[str]) -> None:
+        for tag in tags:
+            self.command("INCR", f"tag:{tag}")
+
+
+def create_cache(url: str, default_ttl: int | None = None) -> Cache:
+    parts = urlsplit(url)
+    options = parse_qs(parts.query)
+    max_entries = int(options.get("max_entries", [DEFAULT_MAX_ENTRIES])[0])
+    if parts.scheme == "memory":
+        return MemoryCache(max_entries, default_ttl)
+    if parts.scheme == "sqlite":
+        # Like SQLAlchemy URLs: sqlite:///relative.db or sqlite:////absolute.db
+        return SQLiteCache(unquote(parts.path[1:]), max_entries, default_ttl)
+    if parts.scheme in {"redis", "tcp"}:
+        return RedisCache(url, default_ttl)
+    raise ValueError(f"Unsupported cache_url scheme: {parts.scheme!r}")
+
+
+@lru_cache
+def get_cache() -> Cache:
+    settings = get_settings()
+    return create_cache(settings.cache_url, settings.cache_default_ttl)
+
+
+def scoped(tenant: str | None, name: str) -> str:
+    """Prefix a key or tag with the school it belongs to."""
+
+    return f"{tenant or '_'}:{name}"
+
+
+def table_tags(tenant: str | None, *tables: str) -> list[str]:
+    return [scoped(tenant, f"table:{table}") for table in tables]
+
+
+def cached(session: OrmSession, key: str, loader: Callable[[], Any], tables: Iterable[str], ttl: int | None = None) -> Any:
+    """Cache ``loader()`` for the session's school, invalidated by writes to ``tables``.
+
+    Sessions with ``info["use_cache"] = False`` always call ``loader``. Sessions
+    on a replica (``info["replica"]``) use cached values but never store one: a
+    lagging replica would cache stale rows under the current tag versions.
+    """
+
+    if session.info.get("use_cache") is False:
+        return loader()
+    tenant = session.info.get("tenant")
+    cache = get_cache()
+    if isinstance(cache, MemoryCache):
+        _check_generation(session, cache, tenant)
+    store = not session.info.get("replica")
+    return cache.get_or_set(scoped(tenant, key), loader, ttl, table_tags(tenant, *tables), store)
+
+
+def _check_generation(session: OrmSession, cache: MemoryCache, tenant: str | None) -> None:
+    """Invalidate the school's entries when a command-line job has bumped its generation since the last look."""
+
+    checked_at, seen = cache.generations.get(tenant, (None, None))
+    now = time.monotonic()
+    if checked_at is not None and now - checked_at < GENERATION_CHECK_SECONDS:
+        return
+    generation = session.execute(select(Setting.value).where(Setting.key == CACHE_GENERATION_KEY)).scalar()
+    cache.generations[tenant] = (now, generation)
+    if checked_at is not None and generation != seen:
+        cache.invalidate_tags(table_tags(tenant, *SQLModel.metadata.tables))
+
+
+def bump_cache_generation(session: OrmSession) -> None:
+    """Tell per-process memory caches that this session's school changed outside the app."""
+
+    generation, now = uuid.uuid4().hex, datetime.utcnow()
+    changed = session.execute(
+        update(Setting).where(Setting.key == CACHE_GENERATION_KEY).values(value=generation, updated_at=now)
+    ).rowcount
+    if not changed:
+        session.add(Setting(key=CACHE_GENERATION_KEY, value=generation, created_at=now, updated_at=now))
+
+
+@lru_cache(maxsize=None)
+def cascaded_tables(table: Table) -> frozenset[str]:
+    """Names of the tables the database changes when rows of ``table`` are deleted, through ``ON DELETE`` rules."""
+
+    names: set[str] = set()
+    for child in table.metadata.sorted_tables:
+        if any(key.ondelete and key.column.table is table for key in child.foreign_keys):
+            names.add(child.name)
+            if child is not table:
+                names |= cascaded_tables(child)
+    return frozenset(names)
+
+
+def _track_statement_writes(state: Any) -> None:
+    if state.is_insert or state.is_update or state.is_delete:
+        table = getattr(state.statement, "table", None)
+        if table is not None:
+            tables = state.session.info.setdefault("written_tables", set())
+            tables.add(table.name)
+            if state.is_delete:
+                tables.update(cascaded_tables(table))
+
+
+def _track_flushed_writes(session: OrmSession, flush_context: Any) -> None:
+    tables = {getattr(obj, "__tablename__", None) for obj in (*session.new, *session.dirty, *session.deleted)}
+    tables.discard(None)
+    for obj in session.deleted:
+        table = getattr(obj, "__table__", None)
+        if table is not None:
+            tables.update(cascaded_tables(table))
+    if tables:
+        session.info.setdefault("written_tables", set()).update(tables)
+
+
+def _invalidate_written_tables(session: OrmSession) -> None:
+    tables = session.info.pop("written_tables", None)
+    if tables and session.info.get("use_cache") is not False:
+        get_cache().invalidate_tags(table_tags(session.info.get("tenant"), *tables))
+
+
+def _forget_written_tables(session: OrmSession) -> None:
+    session.info.pop("written_tables", None)
+
+
+def track_writes(session_class: type[OrmSession]) -> None:
+    """Invalidate the tags of every table written by a committed ``session_class`` transaction."""
+
+    for name, listener in (
+        ("do_orm_execute", _track_statement_writes),
+        ("after_flush", _track_flushed_writes),
+        ("after_commit", _invalidate_written_tables),
+        ("after_rollback", _forget_written_tables),
+    ):
+        if not event.contains(session_class, name, listener):
+            event.listen(session_class, name, listener)
@@ -9,6 +9,8 @@ class Settings(BaseSettings):
 
     app_name: str = "Primary Classes Manager"
     database_url: str = "sqlite:///./data.db"
+    database_replica_urls: tuple[str, ...] = ()
+    replica_sticky_seconds: int = 10
     secret_key: str = "change-me"
     access_token_expire_minutes: int = 60 * 24
     smtp_host: str = "localhost"
@@ -17,9 +19,40 @@ class Settings(BaseSettings):
     smtp_password: str | None = None
     smtp_from: str = "teacher@example.com"
     timezone: str = "Asia/Colombo"
+    highest_grade: str = "5"
     file_upload_limit_mb: int = 10
     allowed_file_types: tuple[str, ...] = ("pdf", "docx", "jpg", "jpeg", "png", "mp4")
+    file_storage_url: str = "./uploads"
+    file_storage_access_key: str | None = None
+    file_storage_secret_key: str | None = None
+    file_storage_region: str = "us-east-1"
+    thumbnail_cache_dir: str = "./uploads/.thumbnails"
+    thumbnail_cache_mb: int = 512
+    thumbnail_workers: int = 2
+    export_workers: int = 2
+    export_ttl_hours: int = 24
+    export_timeout_minutes: int = 60
     backup_bucket: AnyHttpUrl | None = None
+    backup_access_key: str | None = None
+    backup_secret_key: str | None = None
+    backup_region: str = "us-east-1"
+    backup_retention_days: int = 7
+    backup_compression: str = "zstd"
+    backup_part_size_mb: int = 8
+    backup_pages_per_step: int = 1024
+    change_log_client_ttl_days: int = 30
+    change_log_retention_days: int = 7
+    change_log_visibility_lag_seconds: int = 5
+    idempotency_ttl_hours: int = 24
+    cache_url: str = "memory://"
+    cache_default_ttl: int = 300
+    tenant_database_url: str | None = None
+    tenant_isolation: str = "database"
+    tenant_domain: str | None = None
+    tenant_max_engines: int = 200
+    tenant_pool_size: int = 2
+    tenant_max_overflow: int = 3
+    tenant_idle_seconds: int = 15 * 60
 
     class Config:
         env_file = ".env"
@@ -31,6 +64,12 @@ class Settings(BaseSettings):
             return tuple(ext.strip() for ext in value.split(",") if ext.strip())
         return value
 
+    @validator("database_replica_urls", pre=True)
+    def _split_database_replica_urls(cls, value: str | tuple[str, ...]) -> tuple[str, ...]:
+        if isinstance(value, str):
+            return tuple(url.strip() for url in value.split(",") if url.strip())
+        return value
+
 
 @lru_cache
 def get_settings() -> Settings:
@@ -1,33 +1,315 @@
 """Database engine and session utilities."""
 
+import itertools
+import logging
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
 from contextlib import contextmanager
-from typing import Iterator
+from pathlib import Path
+from typing import Any, Iterator
 
+from sqlalchemy import Table, event, inspect, text
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.schema import AddConstraint, CreateIndex
 from sqlmodel import Session, SQLModel, create_engine
 
+from .cache import track_writes
 from .config import get_settings
 
 
+logger = logging.getLogger(__name__)
+
+
+@event.listens_for(Engine, "connect")
+def _enable_sqlite_foreign_keys(dbapi_connection: Any, connection_record: Any) -> None:
+    """SQLite ignores foreign keys, and so their ON DELETE rules, unless each connection opts in."""
+
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        dbapi_connection.execute("PRAGMA foreign_keys=ON")
+
+
 settings = get_settings()
 engine = create_engine(settings.database_url, echo=False, pool_pre_ping=True)
+track_writes(Session)
+
+TENANT_NAME = re.compile(r"^[a-z0-9][a-z0-9_-]{0,62}$")
+
+
+class EngineRegistry:
+    """Lazily created per-tenant engines with bounded pools and LRU eviction.
+
+    ``url_template`` either contains a ``{tenant}`` placeholder (one database per
+    school, e.g. ``sqlite:///./tenants/{tenant}.db``) or, with ``isolation`` set to
+    ``"schema"``, points at a single PostgreSQL database in which every school owns
+    a schema of the same name.
+    """
+
+    def __init__(
+        self,
+        url_template: str,
+        isolation: str = "database",
+        max_engines: int = 200,
+        pool_size: int = 2,
+        max_overflow: int = 3,
+        idle_seconds: int = 15 * 60,
+    ) -> None:
+        if isolation not in {"database", "schema"}:
+            raise ValueError(f"Unknown tenant isolation {isolation!r}")
+        if isolation == "database" and "{tenant}" not in url_template:
+            raise ValueError("Per-tenant database URLs need a {tenant} placeholder")
+        self.url_template = url_template
+        self.isolation = isolation
+        self.max_engines = max_engines
+        self.pool_size = pool_size
+        self.max_overflow = max_overflow
+        self.idle_seconds = idle_seconds
+        self._engines: OrderedDict[str, tuple[Engine, float]] = OrderedDict()
+        self._creating: dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    def get(self, tenant: str) -> Engine:
+        """Return the engine for ``tenant``, creating and initialising it on first use.
+
+        Creation runs outside the registry lock, so a school being set up does
+        not hold up requests for the others; concurrent first requests for the
+        same school wait for a single creation.
+        """
+
+        if not TENANT_NAME.match(tenant):
+            raise ValueError(f"Invalid tenant name {tenant!r}")
+        tenant_engine = self._touch(tenant)
+        if tenant_engine is not None:
+            return tenant_engine
+        with self._lock:
+            creating = self._creating.setdefault(tenant, threading.Lock())
+        with creating:
+            tenant_engine = self._touch(tenant)
+            if tenant_engine is not None:
+                return tenant_engine
+            try:
+                tenant_engine = self._create(tenant)
+            finally:
+                with self._lock:
+                    self._creating.pop(tenant, None)
+            with self._lock:
+                self._engines[tenant] = (tenant_engine, time.monotonic())
+                self._evict()
+        return tenant_engine
+
+    def _touch(self, tenant: str) -> Engine | None:
+        with self._lock:
+            entry = self._engines.pop(tenant, None)
+            if entry is None:
+                return None
+            self._engines[tenant] = (entry[0], time.monotonic())
+            self._evict()
+            return entry[0]
+
+    def dispose(self) -> None:
+        """Close every pooled connection and forget all tenants."""
+
+        with self._lock:
+            while self._engines:
+                _, (tenant_engine, _) = self._engines.popitem(last=False)
+                tenant_engine.dispose()
+
+    def __len__(self) -> int:
+        return len(self._engines)
+
+    def _create(self, tenant: str) -> Engine:
+        options: dict[str, Any] = {"pool_pre_ping": True}
+        if self.isolation == "schema":
+            url = make_url(self.url_template)
+            # Quoted: tenant names may contain "-", which an unquoted search_path rejects.
+            options["connect_args"] = {"options": f'-csearch_path="{tenant}"'}
+        else:
+            url = make_url(self.url_template.format(tenant=tenant))
+        in_memory = url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:")
+        if not in_memory:
+            options.update(pool_size=self.pool_size, max_overflow=self.max_overflow)
+            if url.get_backend_name() == "sqlite":
+                Path(url.database).parent.mkdir(parents=True, exist_ok=True)
+        tenant_engine = create_engine(url, echo=False, **options)
+        if self.isolation == "schema":
+            with tenant_engine.begin() as connection:
+                connection.execute(text(f'CREATE SCHEMA IF NOT EXISTS "{tenant}"'))
+        init_db(tenant_engine)
+        return tenant_engine
+
+    def _evict(self) -> None:
+        now = time.monotonic()
+        while self._engines:
+            tenant, (tenant_engine, last_used) = next(iter(self._engines.items()))
+            if len(self._engines) <= self.max_engines and now - last_used < self.idle_seconds:
+                break
+            del self._engines[tenant]
+            tenant_engine.dispose()
+
+
+tenant_engines = (
+    EngineRegistry(
+        settings.tenant_database_url,
+        isolation=settings.tenant_isolation,
+        max_engines=settings.tenant_max_engines,
+        pool_size=settings.tenant_pool_size,
+        max_overflow=settings.tenant_max_overflow,
+        idle_seconds=settings.tenant_idle_seconds,
+    )
+    if settings.tenant_database_url
+    else None
+)
+
+
+class ReplicaSet:
+    """Round-robin read replicas with read-your-writes stickiness per client.
+
+    A client that has just written is pinned to the primary for
+    ``sticky_seconds`` so it never reads a replica that has not caught up yet.
+    Stickiness is tracked per process.
+    """
 
+    def __init__(self, urls: tuple[str, ...], sticky_seconds: int = 10) -> None:
+        self.engines = [create_engine(url, echo=False, pool_pre_ping=True) for url in urls]
+        self.sticky_seconds = sticky_seconds
+        self._cycle = itertools.cycle(self.engines)
+        self._pinned: dict[str, float] = {}
+        self._lock = threading.Lock()
 
-def init_db() -> None:
-    """Create database tables."""
+    def record_write(self, client: str) -> None:
+        """Pin ``client`` to the primary for the stickiness window."""
 
-    SQLModel.metadata.create_all(engine)
+        if not self.engines:
+            return
+        now = time.monotonic()
+        with self._lock:
+            self._pinned[client] = now + self.sticky_seconds
+            if len(self._pinned) > 10_000:
+                self._pinned = {key: until for key, until in self._pinned.items() if until > now}
+
+    def read_engine(self, client: str | None) -> Engine | None:
+        """Return a replica for ``client``, or ``None`` when it should read the primary."""
+
+        if not self.engines:
+            return None
+        with self._lock:
+            if client is not None and self._pinned.get(client, 0.0) > time.monotonic():
+                return None
+            return next(self._cycle)
+
+
+replicas = ReplicaSet(settings.database_replica_urls, settings.replica_sticky_seconds)
+
+
+def engine_for(tenant: str | None = None) -> Engine:
+    """Return the engine serving ``tenant``, or the default engine."""
+
+    if tenant and tenant_engines is not None:
+        return tenant_engines.get(tenant)
+    return engine
+
+
+def init_db(bind: Engine | None = None) -> None:
+    """Create database tables, any indexes added to tables that already exist, and missing match keys."""
+
+    bind = bind or engine
+    SQLModel.metadata.create_all(bind)
+    add_foreign_keys(bind)
+    for table in SQLModel.metadata.sorted_tables:
+        for index in table.indexes:
+            try:
+                with bind.begin() as connection:
+                    connection.execute(CreateIndex(index, if_not_exists=True))
+            except DBAPIError as exc:  # e.g. duplicate rows blocking a unique index
+                hint = "; run python -m app.services.unique_indexes" if index.info.get("keep_latest") else ""
+                logger.warning("Could not create index %s: %s%s", index.name, exc.orig, hint)
+    from .services.dedup import backfill_match_keys  # imports this module
+
+    indexed = backfill_match_keys(bind)
+    if indexed:
+        logger.info("Added duplicate-detection keys for %s existing students", indexed)
+
+
+def missing_foreign_keys(bind: Engine) -> dict[Table, list[Any]]:
+    """Map each table to the declared foreign keys the database does not have yet."""
+
+    inspector = inspect(bind)
+    missing: dict[Table, list[Any]] = {}
+    for table in SQLModel.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {
+            (tuple(key["constrained_columns"]), key["referred_table"]) for key in inspector.get_foreign_keys(table.name)
+        }
+        for constraint in table.foreign_key_constraints:
+            if (tuple(constraint.column_keys), constraint.referred_table.name) not in existing:
+                missing.setdefault(table, []).append(constraint)
+    return missing
+
+
+def add_foreign_keys(bind: Engine) -> None:
+    """Add the foreign keys declared since a table was created.
+
+    PostgreSQL gets ``ALTER TABLE ... ADD CONSTRAINT``; rows that break one
+    leave it out with a warning, as with indexes. SQLite cannot add
+    constraints and its tables must be rebuilt, which is left to the
+    ``python -m app.services.foreign_keys`` command; startup only warns.
+    """
+
+    missing = missing_foreign_keys(bind)
+    if not missing:
+        return
+    if bind.dialect.name == "sqlite":
+        logger.warning(
+            "Tables %s lack foreign keys; run python -m app.services.foreign_keys to rebuild them",
+            ", ".join(table.name for table in missing),
+        )
+        return
+    for constraints in missing.values():
+        for constraint in constraints:
+            try:
+                with bind.begin() as connection:
+                    connection.execute(AddConstraint(constraint))
+            except DBAPIError as exc:  # e.g. rows left behind by deleted parents
+                logger.warning("Could not add foreign key %s: %s", constraint.name, exc.orig)
+
+
+def upsert_insert(session: Session, table: Any) -> Any:
+    """Return a dialect-specific INSERT that supports ``ON CONFLICT`` clauses."""
+
+    if session.get_bind().dialect.name == "postgresql":
+        return postgresql.insert(table)
+    return sqlite.insert(table)
 
 
 @contextmanager
-def get_session() -> Iterator[Session]:
-    """Provide a transactional scope around a series of operations."""
+def get_session(tenant: str | None = None, bind: Engine | None = None, read_only: bool = False) -> Iterator[Session]:
+    """Provide a transactional scope around a series of operations.
 
-    session = Session(engine)
+    Objects stay loaded after commit (``expire_on_commit=False``), so handlers
+    can return what they wrote without refreshing it. A ``read_only`` session
+    never commits; on PostgreSQL its transactions are also opened read-only.
+    """
+
+    session = Session(bind or engine_for(tenant), expire_on_commit=False)
+    session.info["tenant"] = tenant
+    if read_only:
+        event.listen(session, "after_begin", _begin_read_only)
     try:
         yield session
-        session.commit()
+        if not read_only:
+            session.commit()
     except Exception:
         session.rollback()
         raise
     finally:
         session.close()
+
+
+def _begin_read_only(session: Session, transaction: Any, connection: Any) -> None:
+    if connection.dialect.name == "postgresql":
+        connection.exec_driver_sql("SET TRANSACTION READ ONLY")
@@ -1,28 +1,102 @@
 """Reusable FastAPI dependencies."""
 
-from fastapi import Depends, HTTPException, status
+import hashlib
+
+from fastapi import Depends, HTTPException, Request, status
 from fastapi.security import OAuth2PasswordBearer
+from jose import JWTError, jwt
 from sqlmodel import Session, select
 
-from .database import get_session
+from .config import get_settings
+from .database import TENANT_NAME, get_session, replicas, tenant_engines
 from .models import User
-from .security import verify_token
+from .security import ALGORITHM, verify_token
 
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/v1/auth/token")
 
 
-def get_db() -> Session:
-    with get_session() as session:
+def get_tenant(request: Request) -> str | None:
+    """Resolve the school for this request from the JWT ``tenant`` claim or the host.
+
+    Returns ``None`` when multi-tenancy is disabled, in which case the default
+    database is used. A bearer token that fails to decode, e.g. an expired one,
+    is rejected with 401 rather than falling back to the host.
+    """
+
+    if tenant_engines is None:
+        return None
+    settings = get_settings()
+    tenant = None
+    scheme, _, token = request.headers.get("Authorization", "").partition(" ")
+    if scheme.lower() == "bearer" and token:
+        try:
+            tenant = jwt.decode(token, settings.secret_key, algorithms=[ALGORITHM]).get("tenant")
+        except JWTError as exc:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Invalid token",
+                headers={"WWW-Authenticate": "Bearer"},
+            ) from exc
+    if tenant is None and settings.tenant_domain:
+        host = request.headers.get("host", "").split(":", 1)[0].lower()
+        suffix = f".{settings.tenant_domain.lower()}"
+        if host.endswith(suffix):
+            tenant = host[: -len(suffix)]
+    if not tenant or not TENANT_NAME.match(tenant):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Unknown school")
+    return tenant
+
+
+def client_key(request: Request) -> str:
+    """Identify the caller for read-your-writes stickiness."""
+
+    credentials = request.headers.get("Authorization") or (request.client.host if request.client else "")
+    return hashlib.sha256(credentials.encode()).hexdigest()
+
+
+def get_db(request: Request, tenant: str | None = Depends(get_tenant)) -> Session:
+    """Read-write session on the primary database."""
+
+    with get_session(tenant) as session:
+        request.state.session = session
         yield session
+    replicas.record_write(client_key(request))
+
+
+def get_read_db(request: Request, tenant: str | None = Depends(get_tenant)) -> Session:
+    """Read-only session, served by a replica when one is configured."""
+
+    replica = replicas.read_engine(client_key(request)) if tenant is None else None
+    with get_session(tenant, bind=replica, read_only=True) as session:
+        session.info["replica"] = replica is not None
+        request.state.session = session
+        yield session
+
+
+def get_current_user(
+    request: Request,
+    token: str = Depends(oauth2_scheme),
+    tenant: str | None = Depends(get_tenant),
+) -> User:
+    """Load the token's user with the session the handler already opened.
 
+    Handlers declare their session before ``user``, so a write endpoint looks
+    the user up on its primary session and a read endpoint on its replica
+    session. Handlers without one get a short-lived read-only session.
+    """
 
-def get_current_user(token: str = Depends(oauth2_scheme), session: Session = Depends(get_db)) -> User:
     payload = verify_token(token)
     user_id = payload.get("sub")
-    if user_id is None:
+    if user_id is None or payload.get("tenant") != tenant:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid credentials")
-    user = session.exec(select(User).where(User.id == int(user_id))).first()
+    statement = select(User).where(User.id == int(user_id))
+    session = getattr(request.state, "session", None)
+    if session is not None:
+        user = session.exec(statement).first()
+    else:
+        with get_session(tenant, read_only=True) as lookup:
+            user = lookup.exec(statement).first()
     if user is None:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="User not found")
     return user
@@ -0,0 +1,283 @@
+"""``Idempotency-Key`` support for retried mutating requests."""
+
+import asyncio
+import hashlib
+import re
+import time
+from datetime import datetime, timedelta
+from typing import Any, Iterable
+
+from fastapi import HTTPException, Request
+from sqlalchemy import delete, update
+from starlette.concurrency import run_in_threadpool
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from .config import get_settings
+from .database import get_session, upsert_insert
+from .dependencies import get_tenant
+from .models import IdempotencyRecord
+from .security import verify_token
+
+IDEMPOTENT_PATHS = (
+    r"^/api/v1/attendance/bulk/?$",
+    r"^/api/v1/students/import/?$",
+    r"^/api/v1/birthdays/run/?$",
+    r"^/api/v1/assignments/\d+/submissions(/bulk)?/?$",
+    r"^/api/v1/batch/?$",
+)
+MAX_KEY_LENGTH = 200
+LEASE_SECONDS = 60  # an in-progress claim is abandoned once its lease runs out
+HEARTBEAT_SECONDS = 15
+WAIT_SECONDS = 30
+POLL_SECONDS = 0.2
+PURGE_INTERVAL_SECONDS = 300
+
+_last_purge = 0.0
+
+
+def claim_key(
+    tenant: str | None, key: str, fingerprint: str, ttl: timedelta, now: datetime
+) -> tuple[str, IdempotencyRecord | None]:
+    """Try to take ownership of ``key``, stamping the claim with ``now``.
+
+    Returns ``("new", None)`` when the caller should execute the request,
+    ``("replay", record)`` for a completed request, ``("mismatch", None)`` when
+    the key was used for a different request, and ``("in_progress", None)``
+    while another execution holds it. While in progress, ``expires_at`` is the
+    claim's lease, which the owner renews with :func:`renew_key`; a claim whose
+    lease ran out was abandoned and can be taken over.
+    """
+
+    global _last_purge
+    with get_session(tenant) as session:
+        if time.monotonic() - _last_purge > PURGE_INTERVAL_SECONDS:
+            _last_purge = time.monotonic()
+            session.execute(delete(IdempotencyRecord).where(IdempotencyRecord.expires_at < now))
+        claim = upsert_insert(session, IdempotencyRecord.__table__).values(
+            key=key,
+            fingerprint=fingerprint,
+            status="in_progress",
+            created_at=now,
+            expires_at=now + timedelta(seconds=LEASE_SECONDS),
+        )
+        if session.execute(claim.on_conflict_do_nothing(index_elements=["key"])).rowcount == 1:
+            return "new", None
+        record = session.get(IdempotencyRecord, key)
+        if record is None:
+            return "in_progress", None
+        if record.expires_at < now:
+            taken = session.execute(
+                update(IdempotencyRecord)
+                .where(IdempotencyRecord.key == key, IdempotencyRecord.created_at == record.created_at)
+                .values(fingerprint=fingerprint, status="in_progress", response_status=None, content_type=None,
+                        response_body=None, created_at=now, expires_at=now + timedelta(seconds=LEASE_SECONDS))
+            )
+            return ("new", None) if taken.rowcount == 1 else ("in_progress", None)
+        if record.fingerprint != fingerprint:
+            return "mismatch", None
+        if record.status == "completed":
+            session.expunge(record)
+            return "replay", record
+        return "in_progress", None
+
+
+def renew_key(tenant: str | None, key: str, claimed_at: datetime) -> None:
+    """Extend the lease of the in-progress claim made at ``claimed_at``."""
+
+    with get_session(tenant) as session:
+        session.execute(
+            update(IdempotencyRecord)
+            .where(IdempotencyRecord.key == key, IdempotencyRecord.created_at == claimed_at)
+            .values(expires_at=datetime.utcnow() + timedelta(seconds=LEASE_SECONDS))
+        )
+
+
+def complete_key(
+    tenant: str | None,
+    key: str,
+    claimed_at: datetime,
+    ttl: timedelta,
+    status_code: int,
+    content_type: str | None,
+    body: bytes,
+) -> None:
+    with get_session(tenant) as session:
+        session.execute(
+            update(IdempotencyRecord)
+            .where(IdempotencyRecord.key == key, IdempotencyRecord.created_at == claimed_at)
+            .values(
+                status="completed",
+                response_status=status_code,
+                content_type=content_type,
+                response_body=body,
+                expires_at=datetime.utcnow() + ttl,
+            )
+        )
+
+
+def release_key(tenant: str | None, key: str, claimed_at: datetime) -> None:
+    with get_session(tenant) as session:
+        session.execute(
+            delete(IdempotencyRecord).where(IdempotencyRecord.key == key, IdempotencyRecord.created_at == claimed_at)
+        )
+
+
+def key_owner(request: Request, tenant: str | None) -> str | None:
+    """The user the key belongs to, so a refreshed token keeps its keys; ``None`` without valid credentials."""
+
+    scheme, _, token = request.headers.get("authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return None
+    try:
+        user_id = verify_token(token).get("sub")
+    except HTTPException:
+        return None
+    return None if user_id is None else f"{tenant or ''}:{user_id}"
+
+
+class IdempotencyMiddleware:
+    """Replay stored responses for POSTs that repeat an ``Idempotency-Key``.
+
+    Keys are scoped to the school and user of the caller's token. The first
+    request executes normally and its response is persisted for
+    ``idempotency_ttl_hours``. Retries get the stored response without
+    re-executing. A retry that arrives while the first is still running waits
+    for it rather than racing it, for up to ``WAIT_SECONDS``, and then gets a
+    409; meanwhile the first keeps its claim alive with a heartbeat, so the
+    claim is not taken over. Server errors are not stored, so they can be
+    retried.
+    """
+
+    def __init__(self, app: ASGIApp, paths: Iterable[str] = IDEMPOTENT_PATHS) -> None:
+        self.app = app
+        self.paths = [re.compile(pattern) for pattern in paths]
+        self._in_flight: dict[str, tuple[asyncio.AbstractEventLoop, asyncio.Event]] = {}
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope["method"] != "POST" or not any(p.match(scope["path"]) for p in self.paths):
+            await self.app(scope, receive, send)
+            return
+        request = Request(scope)
+        key = request.headers.get("idempotency-key")
+        if not key:
+            await self.app(scope, receive, send)
+            return
+        if len(key) > MAX_KEY_LENGTH:
+            await _send_json(send, 400, b'{"detail":"Idempotency-Key is too long"}')
+            return
+        try:
+            tenant = get_tenant(request)
+        except HTTPException:
+            await self.app(scope, receive, send)
+            return
+        owner = key_owner(request, tenant)
+        if owner is None:  # rejected by the endpoint's authentication anyway
+            await self.app(scope, receive, send)
+            return
+
+        body = await _read_body(receive)
+        scoped_key = f"{hashlib.sha256(owner.encode()).hexdigest()}:{key}"
+        fingerprint = hashlib.sha256(
+            b"\n".join([scope["path"].encode(), scope.get("query_string", b""), body])
+        ).hexdigest()
+        ttl = timedelta(hours=get_settings().idempotency_ttl_hours)
+
+        deadline = time.monotonic() + WAIT_SECONDS
+        while True:
+            claimed_at = datetime.utcnow()
+            outcome, record = await run_in_threadpool(claim_key, tenant, scoped_key, fingerprint, ttl, claimed_at)
+            if outcome != "in_progress":
+                break
+            if time.monotonic() >= deadline:
+                await _send_json(send, 409, b'{"detail":"A request with this Idempotency-Key is still in progress"}')
+                return
+            loop, in_flight = self._in_flight.get(scoped_key, (None, None))
+            if in_flight is not None and loop is asyncio.get_running_loop():
+                try:
+                    await asyncio.wait_for(in_flight.wait(), deadline - time.monotonic())
+                except asyncio.TimeoutError:
+                    pass
+            else:
+                await asyncio.sleep(POLL_SECONDS)
+
+        if outcome == "mismatch":
+            await _send_json(send, 422, b'{"detail":"Idempotency-Key was already used for a different request"}')
+            return
+        if outcome == "replay":
+            assert record is not None
+            headers = [(b"content-length", str(len(record.response_body or b"")).encode()), (b"idempotent-replayed", b"true")]
+            if record.content_type:
+                headers.append((b"content-type", record.content_type.encode()))
+            await send({"type": "http.response.start", "status": record.response_status, "headers": headers})
+            await send({"type": "http.response.body", "body": record.response_body or b""})
+            return
+
+        flight = self._in_flight[scoped_key] = (asyncio.get_running_loop(), asyncio.Event())
+        captured: dict[str, Any] = {"status": 500, "content_type": None, "body": bytearray()}
+
+        delivered = False
+
+        async def replay_body() -> Message:
+            # The buffered body once, then the client's own messages, e.g. ``http.disconnect``.
+            nonlocal delivered
+            if delivered:
+                return await receive()
+            delivered = True
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        async def capture(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                captured["status"] = message["status"]
+                for name, value in message.get("headers", []):
+                    if name.lower() == b"content-type":
+                        captured["content_type"] = value.decode()
+            elif message["type"] == "http.response.body":
+                captured["body"].extend(message.get("body", b""))
+            await send(message)
+
+        async def heartbeat() -> None:
+            while True:
+                await asyncio.sleep(HEARTBEAT_SECONDS)
+                await run_in_threadpool(renew_key, tenant, scoped_key, claimed_at)
+
+        renewing = asyncio.create_task(heartbeat())
+        try:
+            await self.app(scope, replay_body, capture)
+        finally:
+            renewing.cancel()
+            if captured["status"] < 500:
+                await run_in_threadpool(
+                    complete_key,
+                    tenant,
+                    scoped_key,
+                    claimed_at,
+                    ttl,
+                    captured["status"],
+                    captured["content_type"],
+                    bytes(captured["body"]),
+                )
+            else:
+                await run_in_threadpool(release_key, tenant, scoped_key, claimed_at)
+            if self._in_flight.get(scoped_key) is flight:
+                del self._in_flight[scoped_key]
+            flight[1].set()
+
+
+async def _read_body(receive: Receive) -> bytes:
+    chunks = []
+    while True:
+        message = await receive()
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body", False):
+            return b"".join(chunks)
+
+
+async def _send_json(send: Send, status_code: int, body: bytes) -> None:
+    await send(
+        {
+            "type": "http.response.start",
+            "status": status_code,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+        }
+    )
+    await send({"type": "http.response.body", "body": body})
@@ -4,14 +4,18 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
 from .database import init_db
-from .routers import assignments, attendance, auth, birthdays, classes, dashboard, students
+from .idempotency import IdempotencyMiddleware
+from .routers import assignments, attendance, auth, batch, birthdays, changes, classes, dashboard, events, exports, files, reports, students
 from .seed import seed
+from .services.export_jobs import resume_exports
 
 
 def create_app() -> FastAPI:
     init_db()
     seed()
     app = FastAPI(title="Primary Classes Manager", version="1.0.0")
+    app.add_event_handler("startup", resume_exports)
+    app.add_middleware(IdempotencyMiddleware)
     app.add_middleware(
         CORSMiddleware,
         allow_origins=["*"],
@@ -26,6 +30,12 @@ def create_app() -> FastAPI:
     app.include_router(assignments.router)
     app.include_router(birthdays.router)
     app.include_router(dashboard.router)
+    app.include_router(reports.router)
+    app.include_router(changes.router)
+    app.include_router(events.router)
+    app.include_router(batch.router)
+    app.include_router(files.router)
+    app.include_router(exports.router)
     return app
 
 
@@ -4,8 +4,9 @@ from __future__ import annotations
 
 from datetime import date, datetime
 from enum import Enum
-from typing import Optional
+from typing import Any, Literal, Optional
 
+from sqlalchemy import Column, ForeignKeyConstraint, Index, LargeBinary, PrimaryKeyConstraint, UniqueConstraint, func
 from sqlmodel import Field, Relationship, SQLModel
 
 
@@ -16,6 +17,36 @@ class AttendanceStatus(str, Enum):
     excused = "excused"
 
 
+class BatchOperationType(str, Enum):
+    attendance = "attendance"
+    submission = "submission"
+    student = "student"
+
+
+class BatchResultStatus(str, Enum):
+    applied = "applied"
+    conflict = "conflict"
+    superseded = "superseded"
+    error = "error"
+
+
+class ChangeOperation(str, Enum):
+    upsert = "upsert"
+    delete = "delete"
+
+
+class ExportJobStatus(str, Enum):
+    pending = "pending"
+    running = "running"
+    done = "done"
+    failed = "failed"
+
+
+class ExportKind(str, Enum):
+    attendance = "attendance"
+    gradebooks = "gradebooks"
+
+
 class SubmissionStatus(str, Enum):
     not_submitted = "not_submitted"
     submitted = "submitted"
@@ -23,6 +54,20 @@ class SubmissionStatus(str, Enum):
     exempt = "exempt"
 
 
+# Unique index that python -m app.services.unique_indexes adds to an existing table, keeping the latest duplicate.
+KEEP_LATEST = {"keep_latest": "updated_at"}
+
+
+def references(table: str, column: str, target: str, ondelete: str = "CASCADE") -> ForeignKeyConstraint:
+    """Foreign key from ``table.column`` to ``target`` that the database enforces and follows on delete."""
+
+    return ForeignKeyConstraint([column], [target], name=f"fk_{table}_{column}", ondelete=ondelete)
+
+
+# Child collections are cleared by ON DELETE rules, so the ORM never loads or nulls them.
+PASSIVE_DELETES = {"passive_deletes": "all"}
+
+
 class TimestampMixin(SQLModel):
     created_at: datetime = Field(default_factory=datetime.utcnow, nullable=False)
     updated_at: datetime = Field(default_factory=datetime.utcnow, nullable=False)
@@ -36,6 +81,7 @@ class UserBase(SQLModel):
 
 class User(UserBase, TimestampMixin, table=True):
     __tablename__ = "users"
+    __table_args__ = (Index("uq_users_email", "email", unique=True),)
 
     id: Optional[int] = Field(default=None, primary_key=True)
     hashed_password: str
@@ -61,8 +107,8 @@ class Classroom(ClassroomBase, TimestampMixin, table=True):
 
     id: Optional[int] = Field(default=None, primary_key=True)
 
-    students: list[ClassStudent] = Relationship(back_populates="classroom")  # type: ignore[name-defined]
-    assignments: list[Assignment] = Relationship(back_populates="classroom")  # type: ignore[name-defined]
+    students: list[ClassStudent] = Relationship(back_populates="classroom", sa_relationship_kwargs=PASSIVE_DELETES)  # type: ignore[name-defined]
+    assignments: list[Assignment] = Relationship(back_populates="classroom", sa_relationship_kwargs=PASSIVE_DELETES)  # type: ignore[name-defined]
 
 
 class ClassroomCreate(ClassroomBase):
@@ -97,8 +143,16 @@ class Student(StudentBase, TimestampMixin, table=True):
 
     id: Optional[int] = Field(default=None, primary_key=True)
 
-    enrollments: list[ClassStudent] = Relationship(back_populates="student")  # type: ignore[name-defined]
-    submissions: list[Submission] = Relationship(back_populates="student")  # type: ignore[name-defined]
+    enrollments: list[ClassStudent] = Relationship(back_populates="student", sa_relationship_kwargs=PASSIVE_DELETES)  # type: ignore[name-defined]
+    submissions: list[Submission] = Relationship(back_populates="student", sa_relationship_kwargs=PASSIVE_DELETES)  # type: ignore[name-defined]
+
+
+# Matches the month/day filters of the birthday queries, so they search instead of scanning students.
+Index(
+    "ix_students_birthday",
+    func.extract("month", Student.date_of_birth),
+    func.extract("day", Student.date_of_birth),
+)
 
 
 class StudentCreate(StudentBase):
@@ -121,6 +175,33 @@ class StudentRead(StudentBase):
     id: int
 
 
+class StudentMatchKey(SQLModel, table=True):
+    """A blocking key; students sharing one are compared as possible duplicates."""
+
+    __tablename__ = "student_match_keys"
+    __table_args__ = (references("student_match_keys", "student_id", "students.id"),)
+
+    student_id: int = Field(primary_key=True)
+    key: str = Field(primary_key=True, index=True)
+
+
+class DuplicateMatch(SQLModel):
+    student_id: int
+    name: str
+    date_of_birth: date
+    score: float
+
+
+class DuplicatePair(SQLModel):
+    student_id: int
+    duplicate_id: int
+    score: float
+
+
+class RosterStudentRead(StudentRead):
+    photo_thumbnail_url: Optional[str] = None
+
+
 class ClassStudentBase(SQLModel):
     class_id: int
     student_id: int
@@ -131,6 +212,12 @@ class ClassStudentBase(SQLModel):
 
 class ClassStudent(ClassStudentBase, TimestampMixin, table=True):
     __tablename__ = "class_students"
+    __table_args__ = (
+        Index("ix_class_students_class_archived", "class_id", "archived"),
+        Index("ix_class_students_student", "student_id"),
+        references("class_students", "class_id", "classes.id"),
+        references("class_students", "student_id", "students.id"),
+    )
 
     id: Optional[int] = Field(default=None, primary_key=True)
 
@@ -148,6 +235,13 @@ class AttendanceBase(SQLModel):
 
 class Attendance(AttendanceBase, TimestampMixin, table=True):
     __tablename__ = "attendance"
+    __table_args__ = (
+        Index("uq_attendance_class_date_student", "class_id", "date", "student_id", unique=True, info=KEEP_LATEST),
+        Index("ix_attendance_date", "date"),
+        Index("ix_attendance_student", "student_id", "status"),
+        references("attendance", "class_id", "classes.id"),
+        references("attendance", "student_id", "students.id"),
+    )
 
     id: Optional[int] = Field(default=None, primary_key=True)
 
@@ -166,11 +260,16 @@ class AssignmentBase(SQLModel):
 
 class Assignment(AssignmentBase, TimestampMixin, table=True):
     __tablename__ = "assignments"
+    __table_args__ = (
+        Index("ix_assignments_class_due", "class_id", "due_date"),
+        Index("ix_assignments_due_date", "due_date"),
+        references("assignments", "class_id", "classes.id"),
+    )
 
     id: Optional[int] = Field(default=None, primary_key=True)
 
     classroom: Optional[Classroom] = Relationship(back_populates="assignments")
-    submissions: list[Submission] = Relationship(back_populates="assignment")  # type: ignore[name-defined]
+    submissions: list[Submission] = Relationship(back_populates="assignment", sa_relationship_kwargs=PASSIVE_DELETES)  # type: ignore[name-defined]
 
 
 class AssignmentCreate(AssignmentBase):
@@ -200,6 +299,12 @@ class SubmissionBase(SQLModel):
 
 class Submission(SubmissionBase, TimestampMixin, table=True):
     __tablename__ = "submissions"
+    __table_args__ = (
+        Index("uq_submissions_assignment_student", "assignment_id", "student_id", unique=True, info=KEEP_LATEST),
+        Index("ix_submissions_student", "student_id"),
+        references("submissions", "assignment_id", "assignments.id"),
+        references("submissions", "student_id", "students.id"),
+    )
 
     id: Optional[int] = Field(default=None, primary_key=True)
 
@@ -211,6 +316,114 @@ class SubmissionRead(SubmissionBase):
     id: int
 
 
+class SubmissionCell(SQLModel):
+    """A single gradebook cell as sent by the spreadsheet-style grid."""
+
+    student_id: int
+    status: SubmissionStatus = Field(default=SubmissionStatus.not_submitted)
+    submitted_at: Optional[datetime] = None
+    score: Optional[int] = Field(default=None, ge=0, le=100)
+    feedback: Optional[str] = None
+    file_url: Optional[str] = None
+
+
+class WorkspaceStudent(RosterStudentRead):
+    attendance: Optional[AttendanceRead] = None
+    submissions: list[SubmissionStatus]  # aligned with ClassWorkspace.assignments
+
+
+class ClassWorkspace(SQLModel):
+    """Everything the class screen shows for one day, returned by a single request."""
+
+    classroom: ClassroomRead
+    attendance_date: date
+    assignments: list[AssignmentRead]
+    students: list[WorkspaceStudent]
+
+
+class BatchOperation(SQLModel):
+    """One queued offline edit; ``updated_at`` is when the client made it."""
+
+    op_id: str
+    type: BatchOperationType
+    updated_at: datetime
+    payload: dict[str, Any]
+
+
+class BatchResult(SQLModel):
+    op_id: str
+    status: BatchResultStatus
+    detail: Optional[str] = None
+    data: Optional[dict[str, Any]] = None
+
+
+class PromotionRequest(SQLModel):
+    """Options for year-end promotion; omitted values are derived from the source class."""
+
+    target_academic_year: Optional[str] = None
+    class_map: dict[int, int] = Field(default_factory=dict)
+    grade_map: dict[str, str] = Field(default_factory=dict)
+    promotion_date: date = Field(default_factory=date.today)
+    highest_grade: Optional[str] = None
+
+
+class ClassPromotion(SQLModel):
+    """Outcome for one source class; a graduating class has no target."""
+
+    source_class_id: int
+    target_class_id: Optional[int] = None
+    created: bool = False
+    promoted: int = 0
+    graduated: int = 0
+
+
+class PromotionSummary(SQLModel):
+    academic_year: str
+    classes_created: int
+    students_promoted: int
+    students_graduated: int = 0
+    classes: list[ClassPromotion]
+
+
+class StudentProgressBase(SQLModel):
+    student_id: int = Field(primary_key=True)
+    submissions_outstanding: int = 0
+    late_count: int = 0
+    graded_count: int = 0
+    average_score: Optional[float] = Field(default=None, index=True)
+    attendance_marked: int = 0
+    attendance_attended: int = 0
+    attendance_rate: Optional[float] = Field(default=None, index=True)
+    updated_at: datetime = Field(default_factory=datetime.utcnow, nullable=False)
+
+
+class StudentProgress(StudentProgressBase, table=True):
+    """Per-student counters kept current by the writes that affect them."""
+
+    __tablename__ = "student_progress"
+    __table_args__ = (references("student_progress", "student_id", "students.id"),)
+
+
+class StudentPackedAttendance(SQLModel, table=True):
+    """Per-student totals of packed attendance marks, which SQL cannot count inside the bitmaps."""
+
+    __tablename__ = "student_packed_attendance"
+    __table_args__ = (references("student_packed_attendance", "student_id", "students.id"),)
+
+    student_id: int = Field(primary_key=True)
+    marked: int = 0
+    attended: int = 0
+
+
+class StudentProgressRead(StudentProgressBase):
+    pass
+
+
+class ClassProgressRow(StudentProgressBase):
+    first_name: str
+    last_name: str
+
+
 class EmailJobBase(SQLModel):
     student_id: int
     scheduled_for: datetime
@@ -222,8 +435,120 @@ class EmailJobBase(SQLModel):
 
 class EmailJob(EmailJobBase, TimestampMixin, table=True):
     __tablename__ = "email_jobs"
+    __table_args__ = (
+        Index("ix_email_jobs_student", "student_id"),
+        references("email_jobs", "student_id", "students.id"),
+    )
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+
+
+class AttendanceArchive(AttendanceBase, TimestampMixin, table=True):
+    """Attendance rows of closed academic years, moved out of the hot table."""
+
+    __tablename__ = "attendance_archive"
+    __table_args__ = (
+        Index("ix_attendance_archive_class_date", "class_id", "date"),
+        Index("ix_attendance_archive_student", "student_id"),
+        references("attendance_archive", "class_id", "classes.id"),
+        references("attendance_archive", "student_id", "students.id"),
+    )
+
+    archive_id: Optional[int] = Field(default=None, primary_key=True)
+    id: int = Field(index=True)
+
+
+class AttendanceRoster(SQLModel, table=True):
+    """Sorted student ids shared by every packed attendance day that marked exactly those students."""
+
+    __tablename__ = "attendance_rosters"
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    digest: str = Field(unique=True, max_length=64)
+    student_ids: bytes = Field(sa_column=Column(LargeBinary, nullable=False))
+
+
+class AttendanceDay(TimestampMixin, table=True):
+    """One packed class-day: two status bits per roster student, in roster order."""
+
+    __tablename__ = "attendance_days"
+    __table_args__ = (
+        PrimaryKeyConstraint("class_id", "date"),
+        Index("ix_attendance_days_date", "date"),
+        references("attendance_days", "class_id", "classes.id"),
+    )
+
+    class_id: int
+    date: date
+    roster_id: int
+    statuses: bytes = Field(sa_column=Column(LargeBinary, nullable=False))
+    ids: bytes = Field(sa_column=Column(LargeBinary, nullable=False))
+
+
+class AttendanceNote(SQLModel, table=True):
+    """Note of a packed attendance mark; most marks have none."""
+
+    __tablename__ = "attendance_notes"
+    __table_args__ = (
+        PrimaryKeyConstraint("class_id", "date", "student_id"),
+        Index("ix_attendance_notes_student", "student_id"),
+        references("attendance_notes", "class_id", "classes.id"),
+        references("attendance_notes", "student_id", "students.id"),
+    )
+
+    class_id: int
+    date: date
+    student_id: int
+    note: str
+
+
+class SubmissionArchive(SubmissionBase, TimestampMixin, table=True):
+    __tablename__ = "submissions_archive"
+    __table_args__ = (
+        Index("ix_submissions_archive_assignment", "assignment_id"),
+        Index("ix_submissions_archive_student", "student_id"),
+        references("submissions_archive", "assignment_id", "assignments.id"),
+        references("submissions_archive", "student_id", "students.id"),
+    )
+
+    archive_id: Optional[int] = Field(default=None, primary_key=True)
+    id: int = Field(index=True)
+
+
+class EmailJobArchive(EmailJobBase, TimestampMixin, table=True):
+    """Sent email jobs of closed years; kept, without the student, when the student is deleted."""
+
+    __tablename__ = "email_jobs_archive"
+    __table_args__ = (
+        Index("ix_email_jobs_archive_student", "student_id"),
+        references("email_jobs_archive", "student_id", "students.id", ondelete="SET NULL"),
+    )
+
+    archive_id: Optional[int] = Field(default=None, primary_key=True)
+    student_id: Optional[int] = None
+    id: int = Field(index=True)
+
+
+class StoredFileBase(SQLModel):
+    sha256: str
+    size: int
+    content_type: str
+    filename: Optional[str] = None
+
+
+class StoredFile(StoredFileBase, TimestampMixin, table=True):
+    """An uploaded blob; identical content is stored once under its SHA-256."""
+
+    __tablename__ = "files"
+    __table_args__ = (UniqueConstraint("sha256", name="uq_files_sha256"),)
 
     id: Optional[int] = Field(default=None, primary_key=True)
+    storage_key: str
+
+
+class StoredFileRead(StoredFileBase):
+    id: int
+    url: str
 
 
 class SettingBase(SQLModel):
@@ -233,9 +558,90 @@ class SettingBase(SQLModel):
 
 class Setting(SettingBase, TimestampMixin, table=True):
     __tablename__ = "settings"
+    __table_args__ = (Index("uq_settings_key", "key", unique=True),)
 
     id: Optional[int] = Field(default=None, primary_key=True)
 
 
 class SettingRead(SettingBase):
     id: int
+
+
+class ChangeLog(SQLModel, table=True):
+    """Append-only record of row changes, read by delta-syncing clients."""
+
+    __tablename__ = "change_log"
+    __table_args__ = {"sqlite_autoincrement": True}
+
+    seq: Optional[int] = Field(default=None, primary_key=True)
+    table_name: str
+    row_id: int
+    operation: ChangeOperation
+    changed_at: datetime = Field(default_factory=datetime.utcnow, nullable=False)
+
+
+class SyncClient(SQLModel, table=True):
+    """High-water mark of the change log acknowledged by one client."""
+
+    __tablename__ = "sync_clients"
+
+    client_id: str = Field(primary_key=True)
+    last_seq: int
+    updated_at: datetime = Field(default_factory=datetime.utcnow, nullable=False)
+
+
+class IdempotencyRecord(SQLModel, table=True):
+    """Stored outcome of a mutating request, keyed by its ``Idempotency-Key``."""
+
+    __tablename__ = "idempotency_keys"
+
+    key: str = Field(primary_key=True, max_length=300)
+    fingerprint: str
+    status: str = Field(default="in_progress")
+    response_status: Optional[int] = None
+    content_type: Optional[str] = None
+    response_body: Optional[bytes] = Field(default=None, sa_column=Column(LargeBinary))
+    created_at: datetime = Field(default_factory=datetime.utcnow, nullable=False)
+    expires_at: datetime = Field(index=True)
+
+
+class ExportRequest(SQLModel):
+    kind: ExportKind
+    format: Literal["csv", "parquet", "arrow", "xlsx"] = "csv"
+    class_id: Optional[int] = None
+    academic_year: Optional[str] = None
+    start_date: Optional[date] = None
+    end_date: Optional[date] = None
+
+
+class ExportJobBase(SQLModel):
+    kind: ExportKind
+    format: str
+    class_id: Optional[int] = None
+    academic_year: Optional[str] = None
+    start_date: Optional[date] = None
+    end_date: Optional[date] = None
+    status: ExportJobStatus = Field(default=ExportJobStatus.pending)
+    size: Optional[int] = None
+    error: Optional[str] = None
+    created_at: datetime = Field(default_factory=datetime.utcnow, nullable=False)
+    finished_at: Optional[datetime] = None
+    expires_at: datetime = Field(index=True)
+
+
+class ExportJob(ExportJobBase, table=True):
+    """A background export; ``active_key`` holds the fingerprint while it is pending or running."""
+
+    __tablename__ = "export_jobs"
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    fingerprint: str = Field(index=True)
+    active_key: Optional[str] = Field(default=None, unique=True)
+    storage_key: Optional[str] = None
+    started_at: Optional[datetime] = None
+
+
+class ExportJobRead(ExportJobBase):
+    id: int
+    url: str
+    download_url: Optional[str] = None
@@ -1,13 +1,18 @@
 """Expose API routers."""
 
-from . import assignments, attendance, auth, birthdays, classes, dashboard, students
+from . import assignments, attendance, auth, batch, birthdays, changes, classes, dashboard, events, files, reports, students
 
 __all__ = [
     "assignments",
     "attendance",
     "auth",
+    "batch",
     "birthdays",
+    "changes",
     "classes",
     "dashboard",
+    "events",
+    "files",
+    "reports",
     "students",
 ]
@@ -1,13 +1,14 @@
 """Assignment and submission management endpoints."""
 
-import csv
-import io
 from datetime import datetime
 
-from fastapi import APIRouter, Depends, HTTPException, Response, status
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from fastapi.responses import StreamingResponse
+from sqlalchemy import delete
+from sqlalchemy.exc import IntegrityError
 from sqlmodel import Session, select
 
-from ..dependencies import get_current_user, get_db
+from ..dependencies import get_current_user, get_db, get_read_db
 from ..models import (
     Assignment,
     AssignmentCreate,
@@ -15,9 +16,15 @@ from ..models import (
     AssignmentUpdate,
     Submission,
     SubmissionBase,
+    SubmissionCell,
     SubmissionRead,
     SubmissionStatus,
 )
+from ..services.archive import ArchivedYearError, assignment_is_archived, submission_source
+from ..services.changes import record_deletes
+from ..services.exports import ExportFormat, export_response, iter_batches
+from ..services.progress import class_roster_ids, refresh_student_progress
+from ..services.submissions import publish_submission_updates, upsert_submissions
 
 router = APIRouter(prefix="/api/v1/assignments", tags=["assignments"])
 
@@ -31,8 +38,9 @@ def create_assignment(
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Due date must be in the future")
     assignment = Assignment(**payload.dict())
     session.add(assignment)
+    session.flush()
+    refresh_student_progress(session, class_roster_ids(assignment.class_id))
     session.commit()
-    session.refresh(assignment)
     return assignment
 
 
@@ -54,13 +62,12 @@ def update_assignment(
         setattr(assignment, key, value)
     session.add(assignment)
     session.commit()
-    session.refresh(assignment)
     return assignment
 
 @router.get("/", response_model=list[AssignmentRead])
 def list_assignments(
     class_id: int | None = None,
-    session: Session = Depends(get_db),
+    session: Session = Depends(get_read_db),
     user=Depends(get_current_user),
 ) -> list[Assignment]:
     del user
@@ -76,59 +83,79 @@ def upsert_submission(
     payload: SubmissionBase,
     session: Session = Depends(get_db),
     user=Depends(get_current_user),
-) -> Submission:
+) -> dict[str, object]:
     del user
-    submission = session.exec(
-        select(Submission).where(Submission.assignment_id == assignment_id, Submission.student_id == payload.student_id)
-    ).first()
-    if submission:
-        for key, value in payload.dict(exclude_unset=True).items():
-            setattr(submission, key, value)
-        if payload.status in {SubmissionStatus.submitted, SubmissionStatus.submitted_late}:
-            submission.submitted_at = submission.submitted_at or datetime.utcnow()
-    else:
-        submission = Submission(assignment_id=assignment_id, **payload.dict())
-        if payload.status in {SubmissionStatus.submitted, SubmissionStatus.submitted_late}:
-            submission.submitted_at = datetime.utcnow()
-        session.add(submission)
+    assignment = session.get(Assignment, assignment_id)
+    if not assignment:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Assignment not found")
+    cell = SubmissionCell(**payload.dict(exclude_unset=True, exclude={"assignment_id"}))
+    try:
+        (submission,) = upsert_submissions(session, assignment_id, [cell])
+    except IntegrityError as exc:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="Student not found") from exc
+    except ArchivedYearError as exc:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(exc)) from exc
+    publish_submission_updates(session, assignment, [submission])
     session.commit()
-    session.refresh(submission)
     return submission
 
 
+@router.post("/{assignment_id}/submissions/bulk", response_model=list[SubmissionRead])
+def bulk_upsert_submissions(
+    assignment_id: int,
+    cells: list[SubmissionCell],
+    session: Session = Depends(get_db),
+    user=Depends(get_current_user),
+) -> list[dict[str, object]]:
+    """Save a whole gradebook grid for one assignment in a single transaction."""
+
+    del user
+    assignment = session.get(Assignment, assignment_id)
+    if not assignment:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Assignment not found")
+    try:
+        submissions = upsert_submissions(session, assignment_id, cells)
+    except IntegrityError as exc:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="Student not found") from exc
+    except ArchivedYearError as exc:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(exc)) from exc
+    publish_submission_updates(session, assignment, submissions)
+    session.commit()
+    return submissions
+
+
 @router.get("/{assignment_id}/submissions", response_model=list[SubmissionRead])
 def list_submissions(
     assignment_id: int,
-    session: Session = Depends(get_db),
+    session: Session = Depends(get_read_db),
     user=Depends(get_current_user),
 ) -> list[Submission]:
     del user
-    return session.exec(select(Submission).where(Submission.assignment_id == assignment_id)).all()
+    source = submission_source(session, assignment_is_archived(session, assignment_id))
+    return session.exec(select(source).where(source.assignment_id == assignment_id)).all()
 
 
 @router.get("/{assignment_id}/export")
 def export_gradebook(
     assignment_id: int,
-    session: Session = Depends(get_db),
+    format: ExportFormat = Query(default="csv"),
+    session: Session = Depends(get_read_db),
     user=Depends(get_current_user),
-) -> Response:
+) -> StreamingResponse:
     del user
-    records = session.exec(
-        select(Submission).where(Submission.assignment_id == assignment_id)
-    ).all()
-    output = io.StringIO()
-    writer = csv.writer(output)
-    writer.writerow(["student_id", "status", "score", "submitted_at"])
-    for submission in records:
-        writer.writerow(
-            [
-                submission.student_id,
-                submission.status.value,
-                submission.score if submission.score is not None else "",
-                submission.submitted_at.isoformat() if submission.submitted_at else "",
-            ]
-        )
-    return Response(content=output.getvalue(), media_type="text/csv")
+    source = submission_source(session, assignment_is_archived(session, assignment_id))
+    statement = select(source.student_id, source.status, source.score, source.submitted_at).where(
+        source.assignment_id == assignment_id
+    )
+    batches = (
+        [
+            (student_id, SubmissionStatus(state).value, score, submitted_at)
+            for student_id, state, score, submitted_at in batch
+        ]
+        for batch in iter_batches(session, statement)
+    )
+    columns = [("student_id", "int"), ("status", "string"), ("score", "int"), ("submitted_at", "timestamp")]
+    return export_response(batches, columns, format, f"gradebook-assignment-{assignment_id}")
 
 
 @router.delete("/{assignment_id}", status_code=status.HTTP_204_NO_CONTENT)
@@ -141,5 +168,9 @@ def delete_assignment(
     assignment = session.get(Assignment, assignment_id)
     if not assignment:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Assignment not found")
-    session.delete(assignment)
+    affected = set(session.exec(class_roster_ids(assignment.class_id)).all())
+    affected.update(session.exec(select(Submission.student_id).where(Submission.assignment_id == assignment_id)).all())
+    record_deletes(session, Assignment.__table__, Assignment.id == assignment_id)
+    session.execute(delete(Assignment).where(Assignment.id == assignment_id))
+    refresh_student_progress(session, affected)
     session.commit()
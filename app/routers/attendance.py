@@ -1,50 +1,38 @@
 """Attendance endpoints for per-class tracking and exports."""
 
-import csv
-import io
 from datetime import date
 
-from fastapi import APIRouter, Depends, Query, Response
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from fastapi.responses import JSONResponse, StreamingResponse
+from sqlalchemy.exc import IntegrityError
 from sqlmodel import Session, select
 
-from ..dependencies import get_current_user, get_db
-from ..models import Attendance, AttendanceRead, AttendanceStatus, Classroom, Student
+from ..dependencies import get_current_user, get_db, get_read_db
+from ..models import Attendance, AttendanceBase, AttendanceRead, AttendanceStatus
+from ..services.archive import ArchivedYearError, attendance_source
+from ..services.attendance import ATTENDANCE_EXPORT_COLUMNS, attendance_export_batches, upsert_attendance
+from ..services.exports import ExportFormat, export_response
+from ..services.packed_attendance import load_packed, packed_through, reads_packed
+from ..services.projection import FIELDS_DESCRIPTION, columns, parse_fields, projected_response
 
 router = APIRouter(prefix="/api/v1/attendance", tags=["attendance"])
 
 
 @router.post("/bulk", response_model=list[AttendanceRead])
 def mark_attendance(
-    records: list[Attendance],
+    records: list[AttendanceBase],
     session: Session = Depends(get_db),
     user=Depends(get_current_user),
-) -> list[Attendance]:
+) -> list[dict[str, object]]:
     del user
-    for record in records:
-        existing = session.exec(
-            select(Attendance).where(
-                Attendance.class_id == record.class_id,
-                Attendance.student_id == record.student_id,
-                Attendance.date == record.date,
-            )
-        ).first()
-        if existing:
-            for key, value in record.dict(exclude_unset=True).items():
-                setattr(existing, key, value)
-        else:
-            session.add(record)
+    try:
+        stored = upsert_attendance(session, records)
+    except IntegrityError as exc:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="Class or student not found") from exc
+    except ArchivedYearError as exc:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(exc)) from exc
     session.commit()
-    ids = {(r.class_id, r.student_id, r.date) for r in records}
-    refreshed: list[Attendance] = []
-    for class_id, student_id, day in ids:
-        refreshed.append(
-            session.exec(
-                select(Attendance).where(
-                    Attendance.class_id == class_id, Attendance.student_id == student_id, Attendance.date == day
-                )
-            ).one()
-        )
-    return refreshed
+    return stored
 
 
 @router.get("/", response_model=list[AttendanceRead])
@@ -52,18 +40,34 @@ def list_attendance(
     class_id: int | None = None,
     start_date: date | None = None,
     end_date: date | None = None,
-    session: Session = Depends(get_db),
+    include_archived: bool = Query(default=False, description="Also read closed academic years"),
+    fields: str | None = Query(default=None, description=FIELDS_DESCRIPTION),
+    session: Session = Depends(get_read_db),
     user=Depends(get_current_user),
-) -> list[Attendance]:
+) -> list[Attendance] | JSONResponse:
     del user
-    statement = select(Attendance)
+    names = parse_fields(fields, AttendanceRead)
+    source = attendance_source(session, start_date, end_date, include_archived)
+    packed = reads_packed(session, start_date, end_date, include_archived)
+    selected = list(AttendanceRead.__fields__) if packed else names
+    statement = select(*columns(source, selected)) if selected else select(source)
     if class_id:
-        statement = statement.where(Attendance.class_id == class_id)
+        statement = statement.where(source.class_id == class_id)
     if start_date:
-        statement = statement.where(Attendance.date >= start_date)
+        statement = statement.where(source.date >= start_date)
     if end_date:
-        statement = statement.where(Attendance.date <= end_date)
-    return session.exec(statement.order_by(Attendance.date.desc())).all()
+        statement = statement.where(source.date <= end_date)
+    statement = statement.order_by(source.date.desc())
+    if packed:
+        # Packed marks are decoded in Python, so both are merged as plain rows.
+        rows = [dict(zip(selected, row)) for row in session.execute(statement)]
+        rows.extend(load_packed(session, start_date, end_date, class_id).rows())
+        rows.sort(key=lambda row: row["date"], reverse=True)
+        names = names or selected
+        return projected_response(names, ([row[name] for name in names] for row in rows))
+    if names:
+        return projected_response(names, session.execute(statement))
+    return session.exec(statement).all()
 
 
 @router.get("/export")
@@ -71,53 +75,38 @@ def export_attendance(
     class_id: int,
     start_date: date,
     end_date: date,
-    session: Session = Depends(get_db),
+    format: ExportFormat = Query(default="csv"),
+    session: Session = Depends(get_read_db),
     user=Depends(get_current_user),
-) -> Response:
+) -> StreamingResponse:
     del user
-    records = session.exec(
-        select(Attendance, Student, Classroom)
-        .where(Attendance.class_id == class_id)
-        .where(Attendance.date.between(start_date, end_date))
-        .join(Student, Attendance.student_id == Student.id)
-        .join(Classroom, Attendance.class_id == Classroom.id)
-    ).all()
-    output = io.StringIO()
-    writer = csv.writer(output)
-    writer.writerow(["class", "student", "date", "status", "note"])
-    for attendance, student, classroom in records:
-        writer.writerow(
-            [
-                classroom.name,
-                f"{student.first_name} {student.last_name}",
-                attendance.date.isoformat(),
-                attendance.status.value,
-                attendance.note or "",
-            ]
-        )
-    return Response(content=output.getvalue(), media_type="text/csv")
+    batches = attendance_export_batches(session, start_date, end_date, class_id)
+    return export_response(batches, ATTENDANCE_EXPORT_COLUMNS, format, f"attendance-class-{class_id}")
 
 
 @router.get("/stats")
 def attendance_stats(
     class_id: int,
     days: int = Query(default=7, le=30),
-    session: Session = Depends(get_db),
+    session: Session = Depends(get_read_db),
     user=Depends(get_current_user),
 ) -> dict[str, float | list[dict[str, str]]]:
     del user
-    records = session.exec(
-        select(Attendance)
-        .where(Attendance.class_id == class_id)
-        .order_by(Attendance.date.desc())
-        .limit(days)
-    ).all()
+    records = [
+        (r.date, AttendanceStatus(r.status))
+        for r in session.exec(
+            select(Attendance)
+            .where(Attendance.class_id == class_id)
+            .order_by(Attendance.date.desc())
+            .limit(days)
+        )
+    ]
+    if packed_through(session) is not None:
+        marks = load_packed(session, class_id=class_id, latest_days=days).rows()
+        records = sorted(records + [(m["date"], m["status"]) for m in marks], key=lambda r: r[0], reverse=True)[:days]
     if not records:
         return {"present_pct": 0.0, "trend": []}
     total = len(records)
-    present = sum(1 for r in records if r.status == AttendanceStatus.present)
-    trend = [
-        {"date": r.date.isoformat(), "status": r.status.value}
-        for r in sorted(records, key=lambda r: r.date, reverse=False)
-    ]
+    present = sum(1 for _, state in records if state == AttendanceStatus.present)
+    trend = [{"date": day.isoformat(), "status": state.value} for day, state in sorted(records, key=lambda r: r[0])]
     return {"present_pct": round((present / total) * 100, 2), "trend": trend}
@@ -6,7 +6,7 @@ from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlmodel import Session, select
 
-from ..database import get_session
+from ..dependencies import get_db, get_tenant
 from ..models import User
 from ..security import create_access_token, hash_password, verify_password
 
@@ -14,16 +14,23 @@ router = APIRouter(prefix="/api/v1/auth", tags=["auth"])
 
 
 @router.post("/token")
-def login(form_data: OAuth2PasswordRequestForm = Depends(), session: Session = Depends(get_session)) -> dict[str, str]:
+def login(
+    form_data: OAuth2PasswordRequestForm = Depends(),
+    session: Session = Depends(get_db),
+    tenant: str | None = Depends(get_tenant),
+) -> dict[str, str]:
     user = session.exec(select(User).where(User.email == form_data.username)).first()
     if not user or not verify_password(form_data.password, user.hashed_password):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Incorrect username or password")
-    access_token = create_access_token({"sub": str(user.id)}, expires_delta=timedelta(minutes=60))
+    claims = {"sub": str(user.id)}
+    if tenant:
+        claims["tenant"] = tenant
+    access_token = create_access_token(claims, expires_delta=timedelta(minutes=60))
     return {"access_token": access_token, "token_type": "bearer"}
 
 
 @router.post("/register", status_code=status.HTTP_201_CREATED)
-def register_user(payload: dict[str, str], session: Session = Depends(get_session)) -> dict[str, str]:
+def register_user(payload: dict[str, str], session: Session = Depends(get_db)) -> dict[str, str]:
     required = {"email", "password", "full_name"}
     if not required.issubset(payload):
         missing = required - payload.keys()
@@ -33,5 +40,4 @@ def register_user(payload: dict[str, str], session: Session = Depends(get_sessio
     user = User(email=payload["email"], full_name=payload["full_name"], hashed_password=hash_password(payload["password"]))
     session.add(user)
     session.commit()
-    session.refresh(user)
     return {"id": str(user.id), "email": user.email, "full_name": user.full_name}
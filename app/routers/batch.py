@@ -0,0 +1,24 @@
+"""Batched mutation endpoint for clients syncing offline edits."""
+
+from fastapi import APIRouter, Depends
+from sqlmodel import Session
+
+from ..dependencies import get_current_user, get_db
+from ..models import BatchOperation, BatchResult
+from ..services.batch import apply_batch
+
+router = APIRouter(prefix="/api/v1/batch", tags=["batch"])
+
+
+@router.post("/", response_model=list[BatchResult])
+def run_batch(
+    operations: list[BatchOperation],
+    session: Session = Depends(get_db),
+    user=Depends(get_current_user),
+) -> list[dict[str, object]]:
+    """Apply an ordered log of attendance, submission and student edits in one transaction."""
+
+    del user
+    results = apply_batch(session, operations)
+    session.commit()
+    return results
@@ -3,7 +3,7 @@
 from fastapi import APIRouter, Depends, status
 from sqlmodel import Session, select
 
-from ..dependencies import get_current_user, get_db
+from ..dependencies import get_current_user, get_db, get_read_db
 from ..models import EmailJob, Setting, SettingBase, SettingRead
 from ..services.birthdays import get_template, schedule_birthday_emails
 
@@ -19,13 +19,13 @@ def run_birthday_job(
 
 
 @router.get("/jobs", response_model=list[EmailJob])
-def list_email_jobs(session: Session = Depends(get_db), user=Depends(get_current_user)) -> list[EmailJob]:
+def list_email_jobs(session: Session = Depends(get_read_db), user=Depends(get_current_user)) -> list[EmailJob]:
     del user
     return session.exec(select(EmailJob).order_by(EmailJob.scheduled_for.desc())).all()
 
 
 @router.get("/settings/template")
-def get_birthday_template(session: Session = Depends(get_db), user=Depends(get_current_user)) -> dict[str, str]:
+def get_birthday_template(session: Session = Depends(get_read_db), user=Depends(get_current_user)) -> dict[str, str]:
     """Return the active birthday template, falling back to the default copy."""
 
     del user
@@ -41,10 +41,8 @@ def upsert_setting(setting: SettingBase, session: Session = Depends(get_db), use
         existing.value = setting.value
         session.add(existing)
         session.commit()
-        session.refresh(existing)
         return existing
     new_setting = Setting(**setting.dict())
     session.add(new_setting)
     session.commit()
-    session.refresh(new_setting)
     return new_setting
@@ -0,0 +1,35 @@
+"""Delta-sync endpoint backed by the change log."""
+
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from sqlmodel import Session
+
+from ..config import get_settings
+from ..dependencies import get_current_user, get_db
+from ..services.changes import ChangeLogExpired, acknowledge, changes_since, latest_seq, maybe_prune_change_log
+
+router = APIRouter(prefix="/api/v1/changes", tags=["changes"])
+
+
+@router.get("/")
+def list_changes(
+    since: int = Query(default=0, ge=0, description="Last sequence number the client has applied"),
+    client_id: str | None = Query(default=None, max_length=64, description="Stable id used to track the client's high-water mark"),
+    limit: int = Query(default=1000, ge=1, le=5000),
+    session: Session = Depends(get_db),
+    user=Depends(get_current_user),
+) -> dict[str, object]:
+    """Return compacted changes after ``since``; 410 means the client must resync."""
+
+    del user
+    if client_id:
+        acknowledge(session, client_id, since)
+    settings = get_settings()
+    maybe_prune_change_log(session, settings.change_log_client_ttl_days, settings.change_log_retention_days)
+    session.commit()
+    try:
+        return changes_since(session, since, limit, settings.change_log_visibility_lag_seconds)
+    except ChangeLogExpired as exc:
+        raise HTTPException(
+            status_code=status.HTTP_410_GONE,
+            detail={"message": "Changes have been pruned; resync and continue from latest_seq", "latest_seq": latest_seq(session)},
+        ) from exc
@@ -1,10 +1,36 @@
 """Classroom management endpoints."""
 
+from datetime import date
+from typing import Literal
+
 from fastapi import APIRouter, Depends, HTTPException, Query, status
+from fastapi.responses import StreamingResponse
+from sqlalchemy import delete, func
 from sqlmodel import Session, select
 
-from ..dependencies import get_current_user, get_db
-from ..models import Classroom, ClassroomCreate, ClassroomRead, ClassroomUpdate, ClassStudent, Student, StudentRead
+from ..dependencies import get_current_user, get_db, get_read_db
+from ..models import (
+    Classroom,
+    ClassroomCreate,
+    ClassroomRead,
+    ClassroomUpdate,
+    ClassProgressRow,
+    ClassStudent,
+    ClassWorkspace,
+    PromotionRequest,
+    PromotionSummary,
+    RosterStudentRead,
+    Student,
+    StudentProgress,
+)
+from ..services.changes import record_deletes
+from ..services.exports import export_response
+from ..services.gradebook import build_gradebook, gradebook_columns, gradebook_rows
+from ..services.packed_attendance import collect_rosters, count_packed
+from ..services.progress import refresh_student_progress
+from ..services.promotion import PromotionError, promote_classes
+from ..services.thumbnails import thumbnail_url
+from ..services.workspace import build_workspace
 
 router = APIRouter(prefix="/api/v1/classes", tags=["classes"])
 
@@ -17,14 +43,13 @@ def create_classroom(
     classroom = Classroom(**payload.dict())
     session.add(classroom)
     session.commit()
-    session.refresh(classroom)
     return classroom
 
 
 @router.get("/", response_model=list[ClassroomRead])
 def list_classrooms(
     search: str | None = Query(default=None, description="Search by name or grade"),
-    session: Session = Depends(get_db),
+    session: Session = Depends(get_read_db),
     user=Depends(get_current_user),
 ) -> list[Classroom]:
     del user
@@ -36,7 +61,7 @@ def list_classrooms(
 
 
 @router.get("/{class_id}", response_model=ClassroomRead)
-def get_classroom(class_id: int, session: Session = Depends(get_db), user=Depends(get_current_user)) -> Classroom:
+def get_classroom(class_id: int, session: Session = Depends(get_read_db), user=Depends(get_current_user)) -> Classroom:
     del user
     classroom = session.get(Classroom, class_id)
     if not classroom:
@@ -44,8 +69,10 @@ def get_classroom(class_id: int, session: Session = Depends(get_db), user=Depend
     return classroom
 
 
-@router.get("/{class_id}/students", response_model=list[StudentRead])
-def list_class_students(class_id: int, session: Session = Depends(get_db), user=Depends(get_current_user)) -> list[Student]:
+@router.get("/{class_id}/students", response_model=list[RosterStudentRead])
+def list_class_students(
+    class_id: int, session: Session = Depends(get_read_db), user=Depends(get_current_user)
+) -> list[RosterStudentRead]:
     del user
     if not session.get(Classroom, class_id):
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Class not found")
@@ -55,7 +82,129 @@ def list_class_students(class_id: int, session: Session = Depends(get_db), user=
         .where(ClassStudent.class_id == class_id)
         .where(ClassStudent.archived.is_(False))
     )
-    return session.exec(statement.order_by(Student.last_name, Student.first_name)).all()
+    return [
+        RosterStudentRead(**student.dict(), photo_thumbnail_url=thumbnail_url(student.photo_url))
+        for student in session.exec(statement.order_by(Student.last_name, Student.first_name)).all()
+    ]
+
+
+@router.get("/{class_id}/workspace", response_model=ClassWorkspace)
+def class_workspace(
+    class_id: int,
+    day: date | None = Query(default=None, alias="date", description="Attendance day (default: today)"),
+    session: Session = Depends(get_read_db),
+    user=Depends(get_current_user),
+) -> ClassWorkspace:
+    """The class, its roster, the day's attendance and open assignments' submission states in one call."""
+
+    del user
+    workspace = build_workspace(session, class_id, day or date.today())
+    if workspace is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Class not found")
+    return workspace
+
+
+@router.get("/{class_id}/gradebook", response_model=None)
+def class_gradebook(
+    class_id: int,
+    format: Literal["json", "csv", "parquet", "arrow", "xlsx"] = Query(default="json"),
+    session: Session = Depends(get_read_db),
+    user=Depends(get_current_user),
+) -> dict[str, object] | StreamingResponse:
+    del user
+    classroom = session.get(Classroom, class_id)
+    if not classroom:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Class not found")
+    gradebook = build_gradebook(session, classroom)
+    if format == "json":
+        return gradebook
+    rows = list(gradebook_rows(gradebook))
+    return export_response([rows], gradebook_columns(gradebook), format, f"gradebook-class-{class_id}")
+
+
+@router.post("/promote", response_model=PromotionSummary)
+def promote_school(
+    academic_year: str = Query(description="Academic year whose classes are promoted"),
+    payload: PromotionRequest | None = None,
+    session: Session = Depends(get_db),
+    user=Depends(get_current_user),
+) -> PromotionSummary:
+    """Promote every class of ``academic_year`` in a single transaction."""
+
+    del user
+    sources = session.exec(select(Classroom).where(Classroom.academic_year == academic_year).order_by(Classroom.id)).all()
+    if not sources:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No classes in that academic year")
+    return _promote(session, sources, payload or PromotionRequest())
+
+
+@router.post("/{class_id}/promote", response_model=PromotionSummary)
+def promote_classroom(
+    class_id: int,
+    payload: PromotionRequest | None = None,
+    session: Session = Depends(get_db),
+    user=Depends(get_current_user),
+) -> PromotionSummary:
+    del user
+    classroom = session.get(Classroom, class_id)
+    if not classroom:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Class not found")
+    return _promote(session, [classroom], payload or PromotionRequest())
+
+
+def _promote(session: Session, sources: list[Classroom], payload: PromotionRequest) -> PromotionSummary:
+    try:
+        summary = promote_classes(
+            session,
+            sources,
+            target_year=payload.target_academic_year,
+            class_map=payload.class_map,
+            grade_map=payload.grade_map,
+            promotion_date=payload.promotion_date,
+            highest_grade=payload.highest_grade,
+        )
+    except PromotionError as exc:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=str(exc)) from exc
+    session.commit()
+    return summary
+
+
+@router.get("/{class_id}/progress", response_model=list[ClassProgressRow])
+def class_progress(
+    class_id: int,
+    sort: Literal["name", "submissions_outstanding", "late_count", "average_score", "attendance_rate"] = Query(default="name"),
+    descending: bool = Query(default=False),
+    session: Session = Depends(get_read_db),
+    user=Depends(get_current_user),
+) -> list[dict[str, object]]:
+    """List the roster with each student's stored progress counters, sorted in SQL."""
+
+    del user
+    if not session.get(Classroom, class_id):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Class not found")
+    counters = {
+        column.name: column if column.nullable else func.coalesce(column, 0).label(column.name)
+        for column in StudentProgress.__table__.c
+        if column.name not in {"student_id", "updated_at"}
+    }
+    statement = (
+        select(
+            Student.id.label("student_id"),
+            Student.first_name,
+            Student.last_name,
+            *counters.values(),
+            func.coalesce(StudentProgress.updated_at, func.current_timestamp()).label("updated_at"),
+        )
+        .join(ClassStudent, ClassStudent.student_id == Student.id)
+        .outerjoin(StudentProgress, StudentProgress.student_id == Student.id)
+        .where(ClassStudent.class_id == class_id, ClassStudent.archived.is_(False))
+    )
+    if sort == "name":
+        order = [Student.last_name, Student.first_name]
+    else:
+        column = StudentProgress.__table__.c[sort]
+        order = [column.is_(None), column.desc() if descending else column, Student.last_name]
+    return [dict(row) for row in session.execute(statement.order_by(*order)).mappings()]
 
 
 @router.put("/{class_id}", response_model=ClassroomRead)
@@ -70,15 +219,19 @@ def update_classroom(
         setattr(classroom, key, value)
     session.add(classroom)
     session.commit()
-    session.refresh(classroom)
     return classroom
 
 
 @router.delete("/{class_id}", status_code=status.HTTP_204_NO_CONTENT)
 def delete_classroom(class_id: int, session: Session = Depends(get_db), user=Depends(get_current_user)) -> None:
     del user
-    classroom = session.get(Classroom, class_id)
-    if not classroom:
+    enrolled = set(session.exec(select(ClassStudent.student_id).where(ClassStudent.class_id == class_id)).all())
+    record_deletes(session, Classroom.__table__, Classroom.id == class_id)
+    # The database cascades to the roster, attendance and assignments; nothing is loaded here.
+    if not session.execute(delete(Classroom).where(Classroom.id == class_id)).rowcount:
+        session.rollback()
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Class not found")
-    session.delete(classroom)
+    collect_rosters(session)
+    count_packed(session, enrolled)
+    refresh_student_progress(session, enrolled)
     session.commit()
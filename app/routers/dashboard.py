@@ -2,19 +2,33 @@
 
 from datetime import date, datetime
 
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Query
 from sqlmodel import Session, func, select
 
-from ..dependencies import get_current_user, get_db
-from ..models import Attendance, AttendanceStatus, Assignment, Student, Submission, SubmissionStatus
+from ..cache import cached, get_cache
+from ..dependencies import get_current_user, get_read_db
+from ..models import Attendance, AttendanceStatus, Assignment, Student, SubmissionStatus
+from ..services.archive import attendance_source, submission_source
 
 router = APIRouter(prefix="/api/v1/dashboard", tags=["dashboard"])
 
+TODAY_CACHE_TTL = 60
+
 
 @router.get("/today")
-def today_view(session: Session = Depends(get_db), user=Depends(get_current_user)) -> dict[str, object]:
+def today_view(session: Session = Depends(get_read_db), user=Depends(get_current_user)) -> dict[str, object]:
     del user
     today = date.today()
+    return cached(
+        session,
+        f"dashboard_today:{today}",
+        lambda: _today_summary(session, today),
+        ["attendance", "assignments", "students"],
+        ttl=TODAY_CACHE_TTL,
+    )
+
+
+def _today_summary(session: Session, today: date) -> dict[str, object]:
     attendance_summary = session.exec(
         select(Attendance.status, func.count()).where(Attendance.date == today).group_by(Attendance.status)
     ).all()
@@ -36,19 +50,22 @@ def today_view(session: Session = Depends(get_db), user=Depends(get_current_user
 
 @router.get("/reports")
 def reports(
-    session: Session = Depends(get_db),
+    include_archived: bool = Query(default=False, description="Also count closed academic years"),
+    session: Session = Depends(get_read_db),
     user=Depends(get_current_user),
 ) -> dict[str, object]:
     del user
+    attendance = attendance_source(session, include_archived=include_archived)
+    submissions = submission_source(session, include_archived)
     attendance_summary = session.exec(
-        select(Attendance.class_id, Attendance.status, func.count()).group_by(Attendance.class_id, Attendance.status)
+        select(attendance.class_id, attendance.status, func.count()).group_by(attendance.class_id, attendance.status)
     ).all()
     submission_summary = session.exec(
-        select(Submission.assignment_id, Submission.status, func.count()).group_by(
-            Submission.assignment_id, Submission.status
+        select(submissions.assignment_id, submissions.status, func.count()).group_by(
+            submissions.assignment_id, submissions.status
         )
     ).all()
-    late_list = session.exec(select(Submission).where(Submission.status == SubmissionStatus.submitted_late)).all()
+    late_list = session.exec(select(submissions).where(submissions.status == SubmissionStatus.submitted_late)).all()
     birthday_calendar = session.exec(select(Student.first_name, Student.last_name, Student.date_of_birth)).all()
     return {
         "attendance_summary": [
@@ -76,3 +93,11 @@ def reports(
             for today in [date.today()]
         ],
     }
+
+
+@router.get("/cache-stats")
+def cache_stats(user=Depends(get_current_user)) -> dict[str, object]:
+    """Hit/miss counters of this worker's view of the shared cache."""
+
+    del user
+    return get_cache().stats()
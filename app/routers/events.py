@@ -0,0 +1,42 @@
+"""Server-sent event stream of live attendance, gradebook and dashboard updates."""
+
+import json
+
+from fastapi import APIRouter, Depends, Query, Request
+from fastapi.responses import StreamingResponse
+
+from ..dependencies import get_current_user, get_tenant
+from ..services.events import channel_name, hub
+
+router = APIRouter(prefix="/api/v1/events", tags=["events"])
+
+HEARTBEAT_SECONDS = 15.0
+COALESCE_SECONDS = 0.25
+
+
+@router.get("/stream")
+async def stream_events(
+    request: Request,
+    class_id: list[int] = Query(default=[], description="Classes to follow; the dashboard channel is always included"),
+    tenant: str | None = Depends(get_tenant),
+    user=Depends(get_current_user),
+) -> StreamingResponse:
+    del user
+    channels = [channel_name(tenant, "dashboard"), *(channel_name(tenant, f"class:{cid}") for cid in class_id)]
+
+    async def events():
+        subscriber = hub.subscribe(channels)
+        try:
+            yield "retry: 5000\n\n"
+            while not await request.is_disconnected():
+                batch = await subscriber.next_batch(HEARTBEAT_SECONDS, COALESCE_SECONDS)
+                if not batch:
+                    yield ": keep-alive\n\n"
+                for event_type, data in batch:
+                    yield f"event: {event_type}\ndata: {json.dumps(data, default=str)}\n\n"
+        finally:
+            hub.unsubscribe(subscriber)
+
+    return StreamingResponse(
+        events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
@@ -0,0 +1,99 @@
+"""Background export jobs: enqueue, poll and download."""
+
+from datetime import datetime
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Response, status
+from fastapi.responses import StreamingResponse
+from sqlmodel import Session
+
+from ..dependencies import get_current_user, get_db, get_read_db
+from ..models import ExportJob, ExportJobRead, ExportJobStatus, ExportRequest
+from ..services.export_jobs import ExportRequestError, get_exports, purge_expired_exports, resume_exports, submit_export
+from ..services.exports import MEDIA_TYPES, check_format
+from ..services.storage import get_storage, parse_range
+
+router = APIRouter(prefix="/api/v1/exports", tags=["exports"])
+
+
+def job_read(job: ExportJob) -> ExportJobRead:
+    url = f"{router.prefix}/{job.id}"
+    download_url = f"{url}/download" if job.status == ExportJobStatus.done else None
+    return ExportJobRead(**job.dict(), url=url, download_url=download_url)
+
+
+def _get_job(session: Session, job_id: int) -> ExportJob:
+    job = session.get(ExportJob, job_id)
+    if not job:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Export not found")
+    if job.expires_at < datetime.utcnow() and job.status in (ExportJobStatus.done, ExportJobStatus.failed):
+        raise HTTPException(status_code=status.HTTP_410_GONE, detail="Export has expired; request it again")
+    return job
+
+
+@router.post("/", status_code=status.HTTP_202_ACCEPTED, response_model=ExportJobRead)
+def create_export(
+    request: ExportRequest,
+    response: Response,
+    session: Session = Depends(get_db),
+    user=Depends(get_current_user),
+) -> ExportJobRead:
+    """Queue an export, or return the identical one already pending or running; poll its ``url``."""
+
+    del user
+    check_format(request.format)
+    resume_exports(session.info.get("tenant"))
+    purge_expired_exports(session)
+    try:
+        job, created = submit_export(session, request)
+    except ExportRequestError as exc:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=str(exc)) from exc
+    result = job_read(job)
+    session.commit()
+    if created:
+        get_exports().submit(job.id, session.info.get("tenant"))
+    response.headers["Location"] = result.url
+    return result
+
+
+@router.get("/{job_id}", response_model=ExportJobRead)
+def get_export(job_id: int, session: Session = Depends(get_read_db), user=Depends(get_current_user)) -> ExportJobRead:
+    del user
+    resume_exports(session.info.get("tenant"))
+    return job_read(_get_job(session, job_id))
+
+
+@router.get("/{job_id}/download", response_model=None)
+def download_export(
+    job_id: int,
+    range: str | None = Header(default=None),
+    session: Session = Depends(get_read_db),
+    user=Depends(get_current_user),
+) -> Response:
+    """Serve a finished export, with single-range ``Range`` requests for resuming."""
+
+    del user
+    job = _get_job(session, job_id)
+    if job.status != ExportJobStatus.done or job.storage_key is None or job.size is None:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f"Export is {job.status.value}")
+    headers = {
+        "ETag": f'"{job.fingerprint}-{job.id}"',
+        "Accept-Ranges": "bytes",
+        "Content-Disposition": f'attachment; filename="{job.kind.value}-export-{job.id}.{job.format}"',
+    }
+    try:
+        byte_range = parse_range(range, job.size)
+    except ValueError:
+        return Response(
+            status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+            headers={**headers, "Content-Range": f"bytes */{job.size}"},
+        )
+    start, end = byte_range or (0, job.size - 1)
+    headers["Content-Length"] = str(end - start + 1)
+    if byte_range:
+        headers["Content-Range"] = f"bytes {start}-{end}/{job.size}"
+    return StreamingResponse(
+        get_storage().read(job.storage_key, start, end),
+        status_code=status.HTTP_206_PARTIAL_CONTENT if byte_range else status.HTTP_200_OK,
+        media_type=MEDIA_TYPES[job.format],
+        headers=headers,
+    )
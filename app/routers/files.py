@@ -0,0 +1,173 @@
+"""File upload and download endpoints for attachments, submissions and photos."""
+
+import asyncio
+import importlib.util
+import re
+import unicodedata
+from urllib.parse import quote
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request, Response, status
+from fastapi.responses import FileResponse, StreamingResponse
+from sqlmodel import Session
+from starlette.concurrency import run_in_threadpool
+
+from ..config import get_settings
+from ..dependencies import get_current_user, get_db, get_read_db
+from ..models import StoredFile, StoredFileRead
+from ..services.storage import (
+    LocalStorage,
+    S3Storage,
+    SpooledUpload,
+    UploadRejected,
+    get_storage,
+    parse_range,
+    save_upload,
+    spool_upload,
+)
+from ..services.thumbnails import THUMBNAIL_SIZES, get_thumbnails
+
+router = APIRouter(prefix="/api/v1/files", tags=["files"])
+
+
+def file_read(stored: StoredFile) -> StoredFileRead:
+    return StoredFileRead(**stored.dict(), url=f"{router.prefix}/{stored.id}")
+
+
+def content_disposition(disposition: str, filename: str) -> str:
+    """Build a header with an ASCII ``filename`` fallback and the exact name as RFC 5987 ``filename*``."""
+
+    fallback = unicodedata.normalize("NFKD", filename).encode("ascii", "ignore").decode()
+    fallback = re.sub(r'[^\x20-\x7e]|["\\]', "_", fallback).strip() or "download"
+    return f"{disposition}; filename=\"{fallback}\"; filename*=UTF-8''{quote(filename, safe='')}"
+
+
+@router.post("/", status_code=status.HTTP_201_CREATED, response_model=StoredFileRead)
+async def upload_file(
+    request: Request,
+    filename: str | None = Query(default=None, max_length=255),
+    content_length: int | None = Header(default=None),
+    session: Session = Depends(get_db),
+    user=Depends(get_current_user),
+) -> StoredFileRead:
+    """Store the raw request body; use the returned ``url`` as an ``attachment_url``, ``file_url`` or ``photo_url``."""
+
+    del user
+    settings = get_settings()
+    max_bytes = settings.file_upload_limit_mb * 1024 * 1024
+    if content_length is not None and content_length > max_bytes:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"File exceeds the {settings.file_upload_limit_mb} MB upload limit",
+        )
+    storage = get_storage()
+    try:
+        upload = await spool_upload(request.stream(), max_bytes, settings.allowed_file_types, storage.spool_dir)
+    except UploadRejected as exc:
+        raise HTTPException(status_code=exc.status_code, detail=exc.detail) from exc
+    stored = await run_in_threadpool(_save_and_commit, session, storage, upload, filename)
+    if stored.content_type.startswith("image/") and importlib.util.find_spec("PIL") is not None:
+        await run_in_threadpool(get_thumbnails().ensure, stored, storage)  # pre-warm in the background
+    return file_read(stored)
+
+
+def _save_and_commit(
+    session: Session, storage: LocalStorage | S3Storage, upload: SpooledUpload, filename: str | None
+) -> StoredFile:
+    """Record the upload and commit it in one threadpool call, keeping database I/O off the event loop."""
+
+    stored = save_upload(session, storage, upload, filename)
+    session.commit()
+    return stored
+
+
+@router.get("/{file_id}/meta", response_model=StoredFileRead)
+def get_file_meta(file_id: int, session: Session = Depends(get_read_db), user=Depends(get_current_user)) -> StoredFileRead:
+    del user
+    stored = session.get(StoredFile, file_id)
+    if not stored:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="File not found")
+    return file_read(stored)
+
+
+@router.get("/{file_id}", response_model=None)
+def download_file(
+    file_id: int,
+    range: str | None = Header(default=None),
+    if_none_match: str | None = Header(default=None),
+    session: Session = Depends(get_read_db),
+    user=Depends(get_current_user),
+) -> Response:
+    """Serve a file with ``ETag`` revalidation and single-range ``Range`` requests."""
+
+    del user
+    stored = session.get(StoredFile, file_id)
+    if not stored:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="File not found")
+    etag = f'"{stored.sha256}"'
+    headers = {
+        "ETag": etag,
+        "Accept-Ranges": "bytes",
+        "Cache-Control": "private, max-age=31536000, immutable",
+    }
+    if if_none_match and etag in {tag.strip() for tag in if_none_match.split(",")}:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    try:
+        byte_range = parse_range(range, stored.size)
+    except ValueError:
+        return Response(
+            status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+            headers={**headers, "Content-Range": f"bytes */{stored.size}"},
+        )
+    start, end = byte_range or (0, stored.size - 1)
+    headers["Content-Length"] = str(end - start + 1)
+    if stored.filename:
+        headers["Content-Disposition"] = content_disposition("inline", stored.filename)
+    if byte_range:
+        headers["Content-Range"] = f"bytes {start}-{end}/{stored.size}"
+    return StreamingResponse(
+        get_storage().read(stored.storage_key, start, end),
+        status_code=status.HTTP_206_PARTIAL_CONTENT if byte_range else status.HTTP_200_OK,
+        media_type=stored.content_type,
+        headers=headers,
+    )
+
+
+@router.get("/{file_id}/thumbnail", response_model=None)
+async def get_thumbnail(
+    file_id: int,
+    size: int = Query(default=128, description=f"One of {', '.join(map(str, THUMBNAIL_SIZES))}"),
+    if_none_match: str | None = Header(default=None),
+    session: Session = Depends(get_read_db),
+    user=Depends(get_current_user),
+) -> Response:
+    """Serve a square WebP variant of an uploaded image, rendering it on first request."""
+
+    del user
+    if size not in THUMBNAIL_SIZES:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=f"size must be one of {', '.join(map(str, THUMBNAIL_SIZES))}",
+        )
+    stored = await run_in_threadpool(session.get, StoredFile, file_id)
+    if not stored:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="File not found")
+    if not stored.content_type.startswith("image/"):
+        raise HTTPException(status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE, detail="File is not an image")
+    if importlib.util.find_spec("PIL") is None:
+        raise HTTPException(status_code=status.HTTP_501_NOT_IMPLEMENTED, detail="Thumbnails require the 'Pillow' package")
+    etag = f'"{stored.sha256}-{size}"'
+    headers = {"ETag": etag, "Cache-Control": "private, max-age=31536000, immutable"}
+    if if_none_match and etag in {tag.strip() for tag in if_none_match.split(",")}:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    thumbnails = get_thumbnails()
+    key = thumbnails.cache.key(stored.sha256, size)
+    path = thumbnails.cache.get(key)
+    if path is None:
+        try:
+            await asyncio.wrap_future(await run_in_threadpool(thumbnails.ensure, stored, get_storage()))
+        except Exception as exc:
+            raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="Image could not be decoded") from exc
+        path = thumbnails.cache.get(key)
+    if path is None:  # evicted straight away by a tiny cache
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Thumbnail cache is full")
+    return FileResponse(path, media_type="image/webp", headers=headers)
@@ -0,0 +1,30 @@
+"""Analytical reports computed over whole classes or the school."""
+
+from datetime import date, timedelta
+
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from sqlmodel import Session
+
+from ..dependencies import get_current_user, get_read_db
+from ..services.attendance_analytics import CHRONIC_ABSENCE_THRESHOLD, ROLLING_WINDOWS, attendance_report
+
+router = APIRouter(prefix="/api/v1/reports", tags=["reports"])
+
+
+@router.get("/attendance")
+def attendance_analytics(
+    class_id: int | None = Query(default=None, description="Limit to one class; omit for the whole school"),
+    start_date: date | None = None,
+    end_date: date | None = None,
+    threshold: float = Query(default=CHRONIC_ABSENCE_THRESHOLD, gt=0, le=1),
+    session: Session = Depends(get_read_db),
+    user=Depends(get_current_user),
+) -> dict[str, object]:
+    """Per-student rolling attendance rates, streaks and chronic-absence flags."""
+
+    del user
+    end_date = end_date or date.today()
+    start_date = start_date or end_date - timedelta(days=max(ROLLING_WINDOWS) - 1)
+    if start_date > end_date:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="start_date must not be after end_date")
+    return attendance_report(session, start_date, end_date, class_id, threshold)
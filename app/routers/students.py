@@ -3,25 +3,72 @@
 import csv
 import io
 from datetime import date
+from itertools import islice
 
-from fastapi import APIRouter, Depends, File, HTTPException, Query, UploadFile, status
+from fastapi import APIRouter, Depends, File, HTTPException, Query, Response, UploadFile, status
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from sqlalchemy import delete
 from sqlmodel import Session, select
 
-from ..dependencies import get_current_user, get_db
-from ..models import ClassStudent, Student, StudentCreate, StudentRead, StudentUpdate
+from ..dependencies import get_current_user, get_db, get_read_db
+from ..models import (
+    ClassStudent,
+    DuplicatePair,
+    Student,
+    StudentCreate,
+    StudentProgressRead,
+    StudentRead,
+    StudentUpdate,
+)
+from ..services.changes import record_deletes
+from ..services.dedup import (
+    DUPLICATES_DESCRIPTION,
+    MATCH_THRESHOLD,
+    DuplicatePolicy,
+    duplicate_pairs,
+    find_matches,
+    index_students,
+    match_keys,
+    match_score,
+)
+from ..services.packed_attendance import drop_students
+from ..services.progress import refresh_student_progress, student_progress
+from ..services.projection import FIELDS_DESCRIPTION, columns, parse_fields, projected_response
 
 router = APIRouter(prefix="/api/v1/students", tags=["students"])
 
+IMPORT_CHUNK_SIZE = 500
+IMPORT_REQUIRED = {"first_name", "last_name", "date_of_birth", "guardian_name", "guardian_contact"}
+MATCH_FIELDS = {"first_name", "last_name", "date_of_birth", "guardian_contact"}
+
 
 @router.post("/", status_code=status.HTTP_201_CREATED, response_model=StudentRead)
-def create_student(payload: StudentCreate, session: Session = Depends(get_db), user=Depends(get_current_user)) -> Student:
+def create_student(
+    payload: StudentCreate,
+    response: Response,
+    on_duplicate: DuplicatePolicy = Query(default="reject", description=DUPLICATES_DESCRIPTION),
+    session: Session = Depends(get_db),
+    user=Depends(get_current_user),
+) -> Student:
     del user
     if payload.date_of_birth >= date.today():
         raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="DOB must be in the past")
     student = Student(**payload.dict())
+    if on_duplicate != "create":
+        (matches,) = find_matches(session, [student])
+        if matches and on_duplicate == "reuse":
+            response.status_code = status.HTTP_200_OK  # nothing was created
+            return session.get(Student, matches[0].student_id)
+        if matches:
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail={"message": "Student may already exist", "matches": jsonable_encoder(matches)},
+            )
     session.add(student)
+    session.flush()
+    index_students(session, [student])
     session.commit()
-    session.refresh(student)
     return student
 
 
@@ -29,17 +76,22 @@ def create_student(payload: StudentCreate, session: Session = Depends(get_db), u
 def list_students(
     search: str | None = Query(default=None, description="Search across first/last name"),
     active: bool | None = Query(default=None),
-    session: Session = Depends(get_db),
+    fields: str | None = Query(default=None, description=FIELDS_DESCRIPTION),
+    session: Session = Depends(get_read_db),
     user=Depends(get_current_user),
-) -> list[Student]:
+) -> list[Student] | JSONResponse:
     del user
-    statement = select(Student)
+    names = parse_fields(fields, StudentRead)
+    statement = select(*columns(Student, names)) if names else select(Student)
     if search:
         like = f"%{search.lower()}%"
         statement = statement.where((Student.first_name.ilike(like)) | (Student.last_name.ilike(like)))
     if active is not None:
         statement = statement.where(Student.active == active)
-    return session.exec(statement.order_by(Student.last_name, Student.first_name)).all()
+    statement = statement.order_by(Student.last_name, Student.first_name)
+    if names:
+        return projected_response(names, session.execute(statement))
+    return session.exec(statement).all()
 
 
 @router.post("/{student_id}/enroll", response_model=StudentRead)
@@ -60,56 +112,122 @@ def enroll_student(
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Student already enrolled")
     enrollment = ClassStudent(class_id=class_id, student_id=student_id)
     session.add(enrollment)
+    session.flush()
+    refresh_student_progress(session, [student_id])
     session.commit()
-    session.refresh(student)
     return student
 
 
 @router.post("/import", response_model=list[StudentRead])
 def import_students(
     class_id: int | None = None,
+    on_duplicate: DuplicatePolicy = Query(default="reject", description=DUPLICATES_DESCRIPTION),
     file: UploadFile = File(...),
     session: Session = Depends(get_db),
     user=Depends(get_current_user),
 ) -> list[Student]:
+    """Import a CSV roster in chunks, checking each chunk for duplicates with one indexed lookup."""
+
     del user
-    contents = file.file.read().decode("utf-8")
-    reader = csv.DictReader(io.StringIO(contents))
-    required = {"first_name", "last_name", "date_of_birth", "guardian_name", "guardian_contact"}
-    students: list[Student] = []
-    for row in reader:
-        if not required.issubset(row):
-            raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="Missing required columns")
-        try:
-            dob = date.fromisoformat(row["date_of_birth"])
-        except ValueError as exc:
-            raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="Invalid DOB format") from exc
-        if dob >= date.today():
-            raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="DOB must be in the past")
-        student = Student(
-            first_name=row["first_name"],
-            last_name=row["last_name"],
-            date_of_birth=dob,
-            guardian_name=row["guardian_name"],
-            guardian_contact=row["guardian_contact"],
-            photo_url=row.get("photo_url"),
-            address=row.get("address"),
-            notes=row.get("notes"),
-            active=row.get("active", "true").lower() in {"true", "1", "yes"},
+    reader = csv.DictReader(io.TextIOWrapper(file.file, encoding="utf-8"))
+    imported: list[Student] = []
+    in_file: dict[str, list[Student]] = {}
+    conflicts: list[dict[str, object]] = []
+    line = 1
+    while chunk := list(islice(reader, IMPORT_CHUNK_SIZE)):
+        parsed = [_student_from_row(row) for row in chunk]
+        matches = find_matches(session, parsed) if on_duplicate != "create" else [[] for _ in parsed]
+        created = []
+        for student, found in zip(parsed, matches):
+            line += 1
+            keys = match_keys(student)
+            earlier = [
+                other
+                for other in {id(other): other for key in keys for other in in_file.get(key, ())}.values()
+                if on_duplicate != "create" and match_score(student, other) >= MATCH_THRESHOLD
+            ]
+            if on_duplicate == "reuse" and (found or earlier):
+                imported.append(session.get(Student, found[0].student_id) if found else earlier[0])
+                continue
+            if on_duplicate == "reject" and (found or earlier):
+                conflicts.append({"line": line, "matches": jsonable_encoder(found), "duplicates_earlier_row": bool(earlier)})
+                continue
+            for key in keys:
+                in_file.setdefault(key, []).append(student)
+            created.append(student)
+            imported.append(student)
+        session.add_all(created)
+        session.flush()  # one batched INSERT ... RETURNING per chunk
+        index_students(session, created)
+    if conflicts:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail={"message": "Some rows may duplicate existing students", "rows": conflicts},
+        )
+    if class_id:
+        student_ids = list({student.id: None for student in imported})
+        enrolled = set(
+            session.exec(
+                select(ClassStudent.student_id).where(
+                    ClassStudent.class_id == class_id, ClassStudent.student_id.in_(student_ids)
+                )
+            ).all()
+        )
+        session.add_all(
+            [ClassStudent(class_id=class_id, student_id=student_id) for student_id in student_ids if student_id not in enrolled]
         )
-        session.add(student)
         session.flush()
-        if class_id:
-            session.add(ClassStudent(class_id=class_id, student_id=student.id))
-        students.append(student)
+        refresh_student_progress(session, student_ids)
     session.commit()
-    for student in students:
-        session.refresh(student)
-    return students
+    return imported
+
+
+def _student_from_row(row: dict[str, str]) -> Student:
+    if not IMPORT_REQUIRED.issubset(row):
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="Missing required columns")
+    try:
+        dob = date.fromisoformat(row["date_of_birth"])
+    except ValueError as exc:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="Invalid DOB format") from exc
+    if dob >= date.today():
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="DOB must be in the past")
+    return Student(
+        first_name=row["first_name"],
+        last_name=row["last_name"],
+        date_of_birth=dob,
+        guardian_name=row["guardian_name"],
+        guardian_contact=row["guardian_contact"],
+        photo_url=row.get("photo_url"),
+        address=row.get("address"),
+        notes=row.get("notes"),
+        active=(row.get("active") or "true").lower() in {"true", "1", "yes"},
+    )
+
+
+@router.get("/duplicates", response_model=list[DuplicatePair])
+def list_duplicates(
+    threshold: float = Query(default=MATCH_THRESHOLD, gt=0, le=1),
+    limit: int = Query(default=100, ge=1, le=1000),
+    session: Session = Depends(get_read_db),
+    user=Depends(get_current_user),
+) -> list[DuplicatePair]:
+    """Pairs of students that probably describe the same child, for review before merging."""
+
+    del user
+    return list(islice(duplicate_pairs(session, threshold), limit))
+
+
+@router.get("/{student_id}/progress", response_model=StudentProgressRead)
+def get_student_progress(student_id: int, session: Session = Depends(get_read_db), user=Depends(get_current_user)) -> dict[str, object]:
+    del user
+    progress = student_progress(session, student_id)
+    if progress is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Student not found")
+    return progress
 
 
 @router.get("/{student_id}", response_model=StudentRead)
-def get_student(student_id: int, session: Session = Depends(get_db), user=Depends(get_current_user)) -> Student:
+def get_student(student_id: int, session: Session = Depends(get_read_db), user=Depends(get_current_user)) -> Student:
     del user
     student = session.get(Student, student_id)
     if not student:
@@ -125,11 +243,13 @@ def update_student(
     student = session.get(Student, student_id)
     if not student:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Student not found")
-    for key, value in payload.dict(exclude_unset=True).items():
+    changes = payload.dict(exclude_unset=True)
+    for key, value in changes.items():
         setattr(student, key, value)
     session.add(student)
+    if MATCH_FIELDS & changes.keys():
+        index_students(session, [student])
     session.commit()
-    session.refresh(student)
     return student
 
 
@@ -151,8 +271,9 @@ def transfer_student(
         enrollment.archived = True
         session.add(enrollment)
     session.add(ClassStudent(class_id=new_class_id, student_id=student_id))
+    session.flush()
+    refresh_student_progress(session, [student_id])
     session.commit()
-    session.refresh(student)
     return student
 
 @router.post("/{student_id}/archive", response_model=StudentRead)
@@ -171,15 +292,17 @@ def archive_student(
         enrollment.archived = True
         session.add(enrollment)
     session.add(student)
+    session.flush()
+    refresh_student_progress(session, [student_id])
     session.commit()
-    session.refresh(student)
     return student
 
 @router.delete("/{student_id}", status_code=status.HTTP_204_NO_CONTENT)
 def delete_student(student_id: int, session: Session = Depends(get_db), user=Depends(get_current_user)) -> None:
     del user
-    student = session.get(Student, student_id)
-    if not student:
+    record_deletes(session, Student.__table__, Student.id == student_id)
+    if not session.execute(delete(Student).where(Student.id == student_id)).rowcount:
+        session.rollback()
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Student not found")
-    session.delete(student)
+    drop_students(session, [student_id])
     session.commit()
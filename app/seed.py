@@ -7,6 +7,7 @@ from sqlmodel import Session, select
 from .database import get_session
 from .models import Assignment, Classroom, Student, User
 from .security import hash_password
+from .services.dedup import index_students
 
 
 def seed() -> None:
@@ -54,6 +55,7 @@ def ensure_sample_data(session: Session) -> None:
     ]
     session.add_all(students)
     session.flush()
+    index_students(session, students)
     assignment = Assignment(
         class_id=classroom.id,
         title="Reading Log",
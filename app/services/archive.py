@@ -0,0 +1,224 @@
+"""Cold storage for the attendance, submissions and email jobs of closed academic years.
+
+Run after year-end promotion with ``python -m app.services.archive <year>``.
+Rows are moved into the ``*_archive`` tables in batches. Each batch copies
+and deletes its rows in its own transaction, so an interrupted run can simply
+be started again. Archiving is not a logical delete and is not written to the
+change log. Once a year is marked archived its attendance and submissions are
+read-only: writes raise ``ArchivedYearError`` rather than creating a live row
+next to the archived one.
+"""
+
+import argparse
+import json
+import logging
+from datetime import date, datetime, timedelta
+from typing import Any, Iterable
+
+from sqlalchemy import delete, func, insert, union_all
+from sqlalchemy.orm import aliased
+from sqlalchemy.sql import ColumnElement
+from sqlmodel import Session, SQLModel, select
+
+from ..cache import bump_cache_generation
+from ..database import get_session
+from ..models import (
+    Assignment,
+    Attendance,
+    AttendanceArchive,
+    Classroom,
+    ClassStudent,
+    EmailJob,
+    EmailJobArchive,
+    Setting,
+    Submission,
+    SubmissionArchive,
+)
+from .progress import refresh_student_progress
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_BATCH_SIZE = 5_000
+ARCHIVED_YEARS_KEY = "archive.academic_years"
+ATTENDANCE_THROUGH_KEY = "archive.attendance_through"
+
+
+class ArchiveError(Exception):
+    """Raised when an academic year cannot be archived."""
+
+
+class ArchivedYearError(ArchiveError):
+    """Raised when a write targets a class of an archived academic year."""
+
+
+def _setting(session: Session, key: str) -> Setting | None:
+    return session.exec(select(Setting).where(Setting.key == key)).first()
+
+
+def _store_setting(session: Session, key: str, value: str) -> None:
+    setting = _setting(session, key) or Setting(key=key, value=value)
+    setting.value = value
+    setting.updated_at = datetime.utcnow()
+    session.add(setting)
+
+
+def archived_years(session: Session) -> set[str]:
+    setting = _setting(session, ARCHIVED_YEARS_KEY)
+    return set(json.loads(setting.value)) if setting else set()
+
+
+def attendance_archived_through(session: Session) -> date | None:
+    """Latest attendance date that may live in the archive, or ``None`` if nothing was archived."""
+
+    setting = _setting(session, ATTENDANCE_THROUGH_KEY)
+    return date.fromisoformat(setting.value) if setting else None
+
+
+def reaches(through: date | None, start_date: date | None, end_date: date | None, include_archived: bool) -> bool:
+    """Whether a read of ``start_date``..``end_date`` reaches history stored up to ``through``."""
+
+    bounds = [day for day in (start_date, end_date) if day is not None]
+    return through is not None and (include_archived or bool(bounds and min(bounds) <= through))
+
+
+def attendance_source(
+    session: Session,
+    start_date: date | None = None,
+    end_date: date | None = None,
+    include_archived: bool = False,
+) -> Any:
+    """Return ``Attendance``, or an alias of it over live and archived rows for historical ranges."""
+
+    if not reaches(attendance_archived_through(session), start_date, end_date, include_archived):
+        return Attendance
+    return aliased(Attendance, _union(Attendance, AttendanceArchive), name="attendance_all")
+
+
+def submission_source(session: Session, include_archived: bool = False) -> Any:
+    """Return ``Submission``, or an alias of it over live and archived rows."""
+
+    if not include_archived:
+        return Submission
+    return aliased(Submission, _union(Submission, SubmissionArchive), name="submissions_all")
+
+
+def assignment_is_archived(session: Session, assignment_id: int) -> bool:
+    return bool(archived_assignments(session, [assignment_id]))
+
+
+def archived_classes(session: Session, class_ids: Iterable[int]) -> set[int]:
+    """Return the ids among ``class_ids`` whose academic year has been archived."""
+
+    years = archived_years(session)
+    class_ids = set(class_ids)
+    if not years or not class_ids:
+        return set()
+    return set(
+        session.exec(select(Classroom.id).where(Classroom.id.in_(class_ids), Classroom.academic_year.in_(years))).all()
+    )
+
+
+def archived_assignments(session: Session, assignment_ids: Iterable[int]) -> set[int]:
+    """Return the ids among ``assignment_ids`` that belong to a class of an archived year."""
+
+    years = archived_years(session)
+    assignment_ids = set(assignment_ids)
+    if not years or not assignment_ids:
+        return set()
+    return set(
+        session.exec(
+            select(Assignment.id)
+            .join(Classroom, Assignment.class_id == Classroom.id)
+            .where(Assignment.id.in_(assignment_ids), Classroom.academic_year.in_(years))
+        ).all()
+    )
+
+
+def _union(live: type[SQLModel], archive: type[SQLModel]) -> Any:
+    names = [column.name for column in live.__table__.columns]
+    return union_all(
+        select(*[live.__table__.c[name] for name in names]),
+        select(*[archive.__table__.c[name] for name in names]),
+    ).subquery()
+
+
+def _move_batch(
+    session: Session, live: type[SQLModel], archive: type[SQLModel], condition: ColumnElement[bool], batch_size: int
+) -> list[int]:
+    ids = session.exec(select(live.id).where(condition).order_by(live.id).limit(batch_size)).all()
+    if ids:
+        names = [column.name for column in live.__table__.columns]
+        session.execute(
+            insert(archive).from_select(names, select(*[live.__table__.c[name] for name in names]).where(live.id.in_(ids)))
+        )
+        session.execute(delete(live).where(live.id.in_(ids)))
+    return ids
+
+
+def run_archive(year: str, tenant: str | None = None, batch_size: int = ARCHIVE_BATCH_SIZE) -> dict[str, Any]:
+    """Move every row belonging to ``year`` into the archive tables.
+
+    Only a year older than the latest academic year can be archived. Email jobs
+    that have already been sent or failed are archived when they were scheduled
+    before the end of the year (its last attendance day or due date).
+    """
+
+    with get_session(tenant) as session:
+        latest_year = session.exec(select(func.max(Classroom.academic_year))).one()
+        if latest_year is None or year >= latest_year:
+            raise ArchiveError(f"{year} is not a closed academic year")
+        class_ids = select(Classroom.id).where(Classroom.academic_year == year)
+        assignment_ids = select(Assignment.id).where(Assignment.class_id.in_(class_ids))
+        last_attendance = session.exec(select(func.max(Attendance.date)).where(Attendance.class_id.in_(class_ids))).one()
+        last_due = session.exec(select(func.max(Assignment.due_date)).where(Assignment.class_id.in_(class_ids))).one()
+        # Mark the year first so reads union in the archive while rows move.
+        _store_setting(session, ARCHIVED_YEARS_KEY, json.dumps(sorted(archived_years(session) | {year})))
+    year_end = max(filter(None, [last_attendance, last_due]), default=None)
+    sent_before_year_end = None
+    if year_end is not None:
+        cutoff = datetime.combine(year_end + timedelta(days=1), datetime.min.time())
+        sent_before_year_end = (EmailJob.status != "pending") & (EmailJob.scheduled_for < cutoff)
+
+    plans: list[tuple[str, type[SQLModel], type[SQLModel], ColumnElement[bool]]] = [
+        ("attendance", Attendance, AttendanceArchive, Attendance.class_id.in_(class_ids)),
+        ("submissions", Submission, SubmissionArchive, Submission.assignment_id.in_(assignment_ids)),
+    ]
+    if sent_before_year_end is not None:
+        plans.append(("email_jobs", EmailJob, EmailJobArchive, sent_before_year_end))
+
+    moved: dict[str, Any] = {"academic_year": year}
+    for name, live, archive, condition in plans:
+        moved[name] = 0
+        while True:
+            with get_session(tenant) as session:
+                if live is Attendance:
+                    # Widen the read watermark before rows leave the hot table,
+                    # so concurrent historical reads never miss them.
+                    through = attendance_archived_through(session)
+                    if last_attendance and (through is None or through < last_attendance):
+                        _store_setting(session, ATTENDANCE_THROUGH_KEY, last_attendance.isoformat())
+                ids = _move_batch(session, live, archive, condition, batch_size)
+            moved[name] += len(ids)
+            if len(ids) < batch_size:
+                break
+            logger.info("Archived %s %s rows of %s", moved[name], name, year)
+
+    with get_session(tenant) as session:
+        refresh_student_progress(session, select(ClassStudent.student_id).where(ClassStudent.class_id.in_(class_ids)))
+        bump_cache_generation(session)
+    return moved
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Move a closed academic year into the archive tables")
+    parser.add_argument("academic_year")
+    parser.add_argument("--tenant", action="append", default=[], help="archive this school (repeatable)")
+    parser.add_argument("--batch-size", type=int, default=ARCHIVE_BATCH_SIZE)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    for tenant in args.tenant or [None]:
+        print(run_archive(args.academic_year, tenant, args.batch_size))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""Set-based attendance upserts and exports shared by the endpoints, batch sync and export jobs."""
+
+from datetime import date, datetime
+from itertools import chain
+from typing import Any, Iterable, Iterator
+
+from sqlmodel import Session, select
+
+from ..database import upsert_insert
+from ..models import Attendance, AttendanceBase, AttendanceStatus, ChangeOperation, Classroom, Student
+from .archive import ArchivedYearError, archived_classes, attendance_source
+from .changes import record_changes
+from .events import publish_after_commit
+from .exports import EXPORT_BATCH_SIZE, Column, iter_batches
+from .packed_attendance import load_packed, reads_packed
+from .progress import refresh_student_progress
+
+KEY_FIELDS = frozenset({"class_id", "date", "student_id"})
+ATTENDANCE_EXPORT_COLUMNS: list[Column] = [
+    ("class", "string"),
+    ("student", "string"),
+    ("date", "date"),
+    ("status", "string"),
+    ("note", "string"),
+]
+
+
+def upsert_attendance(session: Session, records: Iterable[AttendanceBase]) -> list[dict[str, Any]]:
+    """Insert or update one mark per ``(class_id, date, student_id)`` and return the stored rows.
+
+    Records are grouped by the fields the client sent, and each group is a
+    single ``INSERT ... ON CONFLICT DO UPDATE`` that overwrites only those
+    fields. Live subscribers of each affected class are notified on commit.
+    Marks for a class of an archived year raise ``ArchivedYearError``.
+    """
+
+    now = datetime.utcnow()
+    latest = {(record.class_id, record.date, record.student_id): record for record in records}
+    if archived_classes(session, {class_id for class_id, _, _ in latest}):
+        raise ArchivedYearError("Attendance of an archived academic year is read-only")
+    groups: dict[frozenset[str], list[dict[str, Any]]] = {}
+    for record in latest.values():
+        sent = frozenset(record.dict(exclude_unset=True)) - KEY_FIELDS
+        groups.setdefault(sent, []).append({**record.dict(), "created_at": now, "updated_at": now})
+
+    table = Attendance.__table__
+    stored: list[dict[str, Any]] = []
+    for sent, rows in groups.items():
+        statement = upsert_insert(session, table).values(rows)
+        changes = {name: statement.excluded[name] for name in sent}
+        changes["updated_at"] = statement.excluded.updated_at
+        statement = statement.on_conflict_do_update(
+            index_elements=[table.c.class_id, table.c.date, table.c.student_id], set_=changes
+        ).returning(*table.c)
+        stored.extend(dict(row) for row in session.execute(statement).mappings())
+    record_changes(session, Attendance.__tablename__, [row["id"] for row in stored], ChangeOperation.upsert)
+    refresh_student_progress(session, [row["student_id"] for row in stored])
+    for class_id, day in {(row["class_id"], row["date"]) for row in stored}:
+        update, key = {"class_id": class_id, "date": day.isoformat()}, f"{class_id}:{day.isoformat()}"
+        publish_after_commit(session, f"class:{class_id}", "attendance", update, key=key)
+        publish_after_commit(session, "dashboard", "attendance", update, key=key)
+    return stored
+
+
+def attendance_export_batches(
+    session: Session, start_date: date, end_date: date, class_id: int | None = None
+) -> Iterator[list[tuple[Any, ...]]]:
+    """Yield export rows matching ``ATTENDANCE_EXPORT_COLUMNS`` for one class, or the whole school.
+
+    Row-stored marks stream from a server-side cursor. Packed marks are decoded
+    up front, while ``session`` is still open, and follow them.
+    """
+
+    source = attendance_source(session, start_date, end_date)
+    statement = (
+        select(Classroom.name, Student.first_name, Student.last_name, source.date, source.status, source.note)
+        .where(source.date.between(start_date, end_date))
+        .join(Student, source.student_id == Student.id)
+        .join(Classroom, source.class_id == Classroom.id)
+    )
+    if class_id is not None:
+        statement = statement.where(source.class_id == class_id)
+    batches = (
+        [
+            (class_name, f"{first_name} {last_name}", day, AttendanceStatus(state).value, note or "")
+            for class_name, first_name, last_name, day, state, note in batch
+        ]
+        for batch in iter_batches(session, statement)
+    )
+    packed = _packed_export_rows(session, start_date, end_date, class_id)
+    return chain(batches, (packed[start : start + EXPORT_BATCH_SIZE] for start in range(0, len(packed), EXPORT_BATCH_SIZE)))
+
+
+def _packed_export_rows(
+    session: Session, start_date: date, end_date: date, class_id: int | None
+) -> list[tuple[Any, ...]]:
+    if not reads_packed(session, start_date, end_date):
+        return []
+    marks = load_packed(session, start_date, end_date, class_id)
+    if not len(marks):
+        return []
+    classes = dict(
+        session.exec(select(Classroom.id, Classroom.name).where(Classroom.id.in_(set(marks.class_ids.tolist())))).all()
+    )
+    names = {
+        student_id: f"{first_name} {last_name}"
+        for student_id, first_name, last_name in session.exec(
+            select(Student.id, Student.first_name, Student.last_name).where(
+                Student.id.in_(set(marks.student_ids.tolist()))
+            )
+        )
+    }
+    return [
+        (classes[mark["class_id"]], names[mark["student_id"]], mark["date"], mark["status"].value, mark["note"] or "")
+        for mark in marks.rows()
+        if mark["class_id"] in classes and mark["student_id"] in names
+    ]
@@ -0,0 +1,183 @@
+"""Vectorized attendance analytics over a dense student x school-day matrix."""
+
+from dataclasses import dataclass
+from datetime import date
+from typing import Any
+
+import numpy as np
+from sqlmodel import Session, select
+
+from ..cache import cached
+from ..models import AttendanceStatus, Student
+from .archive import attendance_source
+from .packed_attendance import PACKED_STATUSES, load_packed, reads_packed
+
+ROLLING_WINDOWS = (7, 30, 90)
+CHRONIC_ABSENCE_THRESHOLD = 0.9
+
+# Matrix cell codes; 0 means the student was not marked that day.
+UNMARKED = 0
+STATUS_CODES = {
+    AttendanceStatus.present: 1,
+    AttendanceStatus.late: 2,
+    AttendanceStatus.excused: 3,
+    AttendanceStatus.absent: 4,
+}
+PACKED_TO_MATRIX = np.array([STATUS_CODES[state] for state in PACKED_STATUSES], dtype=np.int8)
+ATTENDED_CODES = (STATUS_CODES[AttendanceStatus.present], STATUS_CODES[AttendanceStatus.late])
+
+
+@dataclass
+class AttendanceMatrix:
+    """Attendance marks for ``student_ids`` (rows) over ``days`` (columns, as ordinals)."""
+
+    student_ids: np.ndarray
+    days: np.ndarray
+    codes: np.ndarray
+
+
+def load_attendance_matrix(session: Session, start_date: date, end_date: date, class_id: int | None = None) -> AttendanceMatrix:
+    """Load every mark in the range with a single query and scatter it into a matrix.
+
+    School days are the dates on which any attendance was taken in scope.
+    Archived rows are read when the range reaches an archived year, and packed
+    marks of the range are decoded and scattered alongside.
+    """
+
+    source = attendance_source(session, start_date, end_date)
+    statement = select(source.student_id, source.date, source.status).where(source.date.between(start_date, end_date))
+    if class_id is not None:
+        statement = statement.where(source.class_id == class_id)
+    rows = session.exec(statement).all()
+    packed = load_packed(session, start_date, end_date, class_id) if reads_packed(session, start_date, end_date) else None
+    if not rows and not packed:
+        empty = np.empty(0, dtype=np.int64)
+        return AttendanceMatrix(empty, empty, np.zeros((0, 0), dtype=np.int8))
+    student_column, date_column, status_column = zip(*rows) if rows else ((), (), ())
+    all_students = np.array(student_column, dtype=np.int64)
+    all_days = np.array([day.toordinal() for day in date_column], dtype=np.int64)
+    all_codes = np.array([STATUS_CODES[AttendanceStatus(value)] for value in status_column], dtype=np.int8)
+    if packed:
+        all_students = np.concatenate([all_students, packed.student_ids])
+        all_days = np.concatenate([all_days, packed.days])
+        all_codes = np.concatenate([all_codes, PACKED_TO_MATRIX[packed.codes]])
+    student_ids, student_index = np.unique(all_students, return_inverse=True)
+    days, day_index = np.unique(all_days, return_inverse=True)
+    codes = np.zeros((len(student_ids), len(days)), dtype=np.int8)
+    codes[student_index, day_index] = all_codes
+    return AttendanceMatrix(student_ids, days, codes)
+
+
+def compute_attendance_metrics(
+    matrix: AttendanceMatrix,
+    end_date: date,
+    windows: tuple[int, ...] = ROLLING_WINDOWS,
+    threshold: float = CHRONIC_ABSENCE_THRESHOLD,
+) -> dict[str, np.ndarray]:
+    """Compute per-student rates, streaks and chronic-absence flags.
+
+    Every metric is derived from prefix sums over the day axis, so the cost is a
+    handful of passes over the matrix regardless of how many windows are asked
+    for. Late counts as attended; excused and absent both count as missed.
+    """
+
+    marked = matrix.codes != UNMARKED
+    attended = np.isin(matrix.codes, ATTENDED_CODES)
+    missed = marked & ~attended
+    student_count, day_count = matrix.codes.shape
+
+    marked_cum = np.zeros((student_count, day_count + 1), dtype=np.int32)
+    attended_cum = np.zeros((student_count, day_count + 1), dtype=np.int32)
+    np.cumsum(marked, axis=1, out=marked_cum[:, 1:])
+    np.cumsum(attended, axis=1, out=attended_cum[:, 1:])
+
+    metrics: dict[str, np.ndarray] = {}
+    end_ordinal = end_date.toordinal()
+    for window in windows:
+        start = np.searchsorted(matrix.days, end_ordinal - window + 1)
+        metrics[f"rate_{window}d"] = _rate(
+            attended_cum[:, -1] - attended_cum[:, start], marked_cum[:, -1] - marked_cum[:, start]
+        )
+    metrics["days_marked"] = marked_cum[:, -1]
+    metrics["days_missed"] = marked_cum[:, -1] - attended_cum[:, -1]
+    metrics["attendance_rate"] = _rate(attended_cum[:, -1], marked_cum[:, -1])
+    metrics["chronically_absent"] = metrics["attendance_rate"] < threshold
+
+    # Current streak: attended days after the most recent missed day. ``initial``
+    # keeps an empty range (no day columns) valid, where argmax would raise.
+    last_missed = np.where(missed, np.arange(day_count), -1).max(axis=1, initial=-1)
+    metrics["current_streak"] = attended_cum[:, -1] - attended_cum[np.arange(student_count), last_missed + 1]
+
+    # Longest run of consecutive missed school days, from run boundaries.
+    edges = np.diff(np.pad(missed.astype(np.int8), ((0, 0), (1, 1))), axis=1)
+    run_starts = np.argwhere(edges == 1)
+    run_ends = np.argwhere(edges == -1)
+    longest = np.zeros(student_count, dtype=np.int64)
+    np.maximum.at(longest, run_starts[:, 0], run_ends[:, 1] - run_starts[:, 1])
+    metrics["longest_missed_streak"] = longest
+    return metrics
+
+
+def _rate(attended: np.ndarray, marked: np.ndarray) -> np.ndarray:
+    rate = np.full(attended.shape, np.nan)
+    np.divide(attended, marked, out=rate, where=marked > 0)
+    return rate
+
+
+def attendance_report(
+    session: Session,
+    start_date: date,
+    end_date: date,
+    class_id: int | None = None,
+    threshold: float = CHRONIC_ABSENCE_THRESHOLD,
+) -> dict[str, Any]:
+    """Build the JSON attendance report for a class, or the whole school."""
+
+    return cached(
+        session,
+        f"attendance_report:{class_id}:{start_date}:{end_date}:{threshold}",
+        lambda: _build_report(session, start_date, end_date, class_id, threshold),
+        ["attendance", "attendance_archive", "attendance_days", "students"],
+    )
+
+
+def _build_report(
+    session: Session, start_date: date, end_date: date, class_id: int | None, threshold: float
+) -> dict[str, Any]:
+    matrix = load_attendance_matrix(session, start_date, end_date, class_id)
+    metrics = compute_attendance_metrics(matrix, end_date, threshold=threshold)
+    names: dict[int, str] = {}
+    if len(matrix.student_ids):
+        roster = session.exec(
+            select(Student.id, Student.first_name, Student.last_name).where(Student.id.in_(matrix.student_ids.tolist()))
+        ).all()
+        names = {student_id: f"{first_name} {last_name}" for student_id, first_name, last_name in roster}
+    columns = {key: values.tolist() for key, values in metrics.items()}
+    students = []
+    for index, student_id in enumerate(matrix.student_ids.tolist()):
+        students.append(
+            {
+                "student_id": student_id,
+                "name": names.get(student_id),
+                "rates": {f"{window}d": _round(columns[f"rate_{window}d"][index]) for window in ROLLING_WINDOWS},
+                "attendance_rate": _round(columns["attendance_rate"][index]),
+                "days_marked": columns["days_marked"][index],
+                "days_missed": columns["days_missed"][index],
+                "current_streak": columns["current_streak"][index],
+                "longest_missed_streak": columns["longest_missed_streak"][index],
+                "chronically_absent": columns["chronically_absent"][index],
+            }
+        )
+    return {
+        "class_id": class_id,
+        "start_date": start_date.isoformat(),
+        "end_date": end_date.isoformat(),
+        "school_days": len(matrix.days),
+        "threshold": threshold,
+        "chronic_absence_count": int(metrics["chronically_absent"].sum()),
+        "students": students,
+    }
+
+
+def _round(value: float) -> float | None:
+    return None if np.isnan(value) else round(value, 4)
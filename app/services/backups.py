@@ -0,0 +1,227 @@
+"""Online, compressed database backups uploaded to S3-compatible storage.
+
+Run daily from cron with ``python -m app.services.backups``. SQLite databases
+are copied with the online backup API a few pages at a time so writers are
+never blocked for long; PostgreSQL databases are streamed from ``pg_dump``.
+The dump is compressed and uploaded as a multipart object while it is being
+produced, so memory use is bounded by the part size whatever the database
+size.
+"""
+
+import argparse
+import logging
+import os
+import shutil
+import sqlite3
+import subprocess
+import tempfile
+import time
+import zlib
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from typing import Any, Iterable, Iterator
+from urllib.parse import urlsplit
+
+from sqlalchemy.engine import URL
+
+from ..config import Settings, get_settings
+from ..database import engine_for, tenant_engines
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1024 * 1024
+MIN_PART_SIZE = 5 * 1024 * 1024  # S3 rejects smaller non-final parts
+
+
+def backup_target(settings: Settings) -> tuple[str, str, str]:
+    """Split ``backup_bucket`` into ``(endpoint_url, bucket, key_prefix)``."""
+
+    if settings.backup_bucket is None:
+        raise RuntimeError("BACKUP_BUCKET is not configured")
+    parts = urlsplit(str(settings.backup_bucket))
+    bucket, _, prefix = parts.path.strip("/").partition("/")
+    if not bucket:
+        raise RuntimeError("BACKUP_BUCKET must include a bucket name, e.g. http://minio:9000/backups")
+    return f"{parts.scheme}://{parts.netloc}", bucket, f"{prefix.strip('/')}/" if prefix else ""
+
+
+def s3_client(settings: Settings, endpoint_url: str) -> Any:
+    import boto3
+    from botocore.config import Config
+
+    return boto3.client(
+        "s3",
+        endpoint_url=endpoint_url,
+        aws_access_key_id=settings.backup_access_key,
+        aws_secret_access_key=settings.backup_secret_key,
+        region_name=settings.backup_region,
+        config=Config(s3={"addressing_style": "path"}),
+    )
+
+
+@contextmanager
+def sqlite_snapshot(database: str, pages_per_step: int) -> Iterator[str]:
+    """Copy a live SQLite database into a temporary file, ``pages_per_step`` pages at a time."""
+
+    with tempfile.NamedTemporaryFile(suffix=".db") as snapshot:
+        source = sqlite3.connect(database)
+        target = sqlite3.connect(snapshot.name)
+        try:
+            source.backup(target, pages=pages_per_step, sleep=0.005)
+        finally:
+            target.close()
+            source.close()
+        yield snapshot.name
+
+
+def read_chunks(path: str) -> Iterator[bytes]:
+    with open(path, "rb") as handle:
+        while chunk := handle.read(CHUNK_SIZE):
+            yield chunk
+
+
+def pg_dump_chunks(url: URL, schema: str | None = None) -> Iterator[bytes]:
+    """Stream a plain-SQL ``pg_dump`` of ``url``, or of one ``schema`` in it.
+
+    The password goes to ``pg_dump`` through ``PGPASSWORD`` rather than the
+    command line, where any local user could read it with ``ps``.
+    """
+
+    if shutil.which("pg_dump") is None:
+        raise RuntimeError("pg_dump is required to back up PostgreSQL databases")
+    dsn = URL.create(
+        "postgresql", url.username, None, url.host, url.port, url.database, url.query
+    ).render_as_string(hide_password=False)
+    command = ["pg_dump", "--no-owner", "--dbname", dsn]
+    if schema is not None:
+        command += ["--schema", f'"{schema}"']
+    env = dict(os.environ)
+    if url.password is not None:
+        env["PGPASSWORD"] = str(url.password)
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, env=env)
+    assert process.stdout is not None
+    try:
+        while chunk := process.stdout.read(CHUNK_SIZE):
+            yield chunk
+    finally:
+        process.stdout.close()
+        if process.wait() != 0:
+            raise RuntimeError(f"pg_dump exited with status {process.returncode}")
+
+
+def compress_chunks(chunks: Iterable[bytes], method: str) -> tuple[Iterator[bytes], str]:
+    """Compress ``chunks`` as a stream, returning the iterator and a file extension."""
+
+    if method == "zstd":
+        try:
+            import zstandard
+        except ImportError:
+            logger.warning("zstandard is not installed; falling back to gzip backups")
+        else:
+            return _stream(chunks, zstandard.ZstdCompressor(level=10).compressobj()), "zst"
+    return _stream(chunks, zlib.compressobj(6, zlib.DEFLATED, 31)), "gz"
+
+
+def _stream(chunks: Iterable[bytes], compressor: Any) -> Iterator[bytes]:
+    for chunk in chunks:
+        if data := compressor.compress(chunk):
+            yield data
+    yield compressor.flush()
+
+
+def upload_multipart(client: Any, bucket: str, key: str, chunks: Iterable[bytes], part_size: int) -> tuple[int, int]:
+    """Upload ``chunks`` as a multipart object, returning ``(bytes, parts)``."""
+
+    part_size = max(part_size, MIN_PART_SIZE)
+    upload_id = client.create_multipart_upload(Bucket=bucket, Key=key)["UploadId"]
+    parts: list[dict[str, Any]] = []
+    total = 0
+    buffer = bytearray()
+
+    def flush() -> None:
+        response = client.upload_part(
+            Bucket=bucket, Key=key, UploadId=upload_id, PartNumber=len(parts) + 1, Body=bytes(buffer)
+        )
+        parts.append({"ETag": response["ETag"], "PartNumber": len(parts) + 1})
+        buffer.clear()
+
+    try:
+        for chunk in chunks:
+            buffer.extend(chunk)
+            total += len(chunk)
+            if len(buffer) >= part_size:
+                flush()
+        if buffer or not parts:
+            flush()
+        client.complete_multipart_upload(
+            Bucket=bucket, Key=key, UploadId=upload_id, MultipartUpload={"Parts": parts}
+        )
+    except Exception:
+        client.abort_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id)
+        raise
+    return total, len(parts)
+
+
+def apply_retention(client: Any, bucket: str, prefix: str, days: int) -> int:
+    """Delete backups under ``prefix`` older than ``days``; returns the number removed."""
+
+    cutoff = datetime.now(timezone.utc) - timedelta(days=days)
+    expired = [
+        {"Key": item["Key"]}
+        for page in client.get_paginator("list_objects_v2").paginate(Bucket=bucket, Prefix=prefix)
+        for item in page.get("Contents", [])
+        if item["LastModified"] < cutoff
+    ]
+    for start in range(0, len(expired), 1000):
+        client.delete_objects(Bucket=bucket, Delete={"Objects": expired[start : start + 1000]})
+    return len(expired)
+
+
+def run_backup(tenant: str | None = None, settings: Settings | None = None) -> dict[str, Any]:
+    """Back up the default database (or one school's) and prune old backups."""
+
+    settings = settings or get_settings()
+    endpoint_url, bucket, prefix = backup_target(settings)
+    client = s3_client(settings, endpoint_url)
+    url = engine_for(tenant).url
+    backend = url.get_backend_name()
+    started = time.monotonic()
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    tenant_prefix = f"{prefix}{tenant or 'default'}/"
+    if backend == "sqlite":
+        if not url.database or url.database == ":memory:":
+            raise RuntimeError("In-memory SQLite databases cannot be backed up")
+        with sqlite_snapshot(url.database, settings.backup_pages_per_step) as snapshot:
+            chunks, extension = compress_chunks(read_chunks(snapshot), settings.backup_compression)
+            key = f"{tenant_prefix}{stamp}.db.{extension}"
+            size, parts = upload_multipart(client, bucket, key, chunks, settings.backup_part_size_mb * 1024 * 1024)
+    elif backend == "postgresql":
+        schema = tenant if tenant and tenant_engines is not None and tenant_engines.isolation == "schema" else None
+        chunks, extension = compress_chunks(pg_dump_chunks(url, schema), settings.backup_compression)
+        key = f"{tenant_prefix}{stamp}.sql.{extension}"
+        size, parts = upload_multipart(client, bucket, key, chunks, settings.backup_part_size_mb * 1024 * 1024)
+    else:
+        raise RuntimeError(f"Backups are not supported for {backend} databases")
+    removed = apply_retention(client, bucket, tenant_prefix, settings.backup_retention_days)
+    summary = {
+        "key": key,
+        "bytes": size,
+        "parts": parts,
+        "expired": removed,
+        "seconds": round(time.monotonic() - started, 2),
+    }
+    logger.info("Backup complete: %s", summary)
+    return summary
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Back up the database to BACKUP_BUCKET")
+    parser.add_argument("--tenant", action="append", default=[], help="back up this school (repeatable)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    for tenant in args.tenant or [None]:
+        print(run_backup(tenant))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,260 @@
+"""Apply an ordered log of offline edits in one transaction."""
+
+from datetime import datetime, timezone
+from typing import Any, Callable, Hashable, Sequence
+
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import tuple_, update
+from sqlalchemy.exc import DBAPIError
+from sqlmodel import Session, select
+
+from ..models import (
+    Assignment,
+    Attendance,
+    AttendanceBase,
+    BatchOperation,
+    BatchOperationType,
+    BatchResultStatus,
+    ChangeOperation,
+    Classroom,
+    Student,
+    StudentUpdate,
+    Submission,
+    SubmissionBase,
+    SubmissionCell,
+)
+from .archive import archived_assignments, archived_classes
+from .attendance import upsert_attendance
+from .changes import record_changes
+from .dedup import index_students
+from .submissions import publish_submission_updates, upsert_submissions
+
+Pending = dict[Hashable, tuple[int, datetime, Any]]
+Applier = Callable[[Session, Pending, dict[int, Any], dict[int, Any], dict[int, str]], None]
+
+
+def apply_batch(session: Session, operations: Sequence[BatchOperation]) -> list[dict[str, Any]]:
+    """Apply ``operations`` grouped by type into set-based statements.
+
+    Conflicts are resolved last-writer-wins on ``updated_at``: an edit made on
+    the client before the server row last changed is rejected as a
+    ``conflict`` and the server's version is returned instead. When the log
+    edits the same row more than once, only the last edit is applied and the
+    earlier ones are reported as ``superseded``.
+    """
+
+    results: dict[int, dict[str, Any]] = {}
+    pending: dict[BatchOperationType, Pending] = {kind: {} for kind in BatchOperationType}
+    for index, operation in enumerate(operations):
+        try:
+            key, parsed = PARSERS[operation.type](operation.payload)
+        except (ValueError, TypeError) as exc:
+            results[index] = _result(operation, BatchResultStatus.error, detail=_describe(exc))
+            continue
+        queue = pending[operation.type]
+        if key in queue:
+            results[queue[key][0]] = _result(operations[queue[key][0]], BatchResultStatus.superseded)
+        queue[key] = (index, _as_utc(operation.updated_at), parsed)
+
+    applied: dict[int, Any] = {}
+    conflicts: dict[int, Any] = {}
+    errors: dict[int, str] = {}
+    for kind, apply in APPLIERS.items():
+        _apply_group(session, apply, pending[kind], applied, conflicts, errors)
+    for index, data in applied.items():
+        results[index] = _result(operations[index], BatchResultStatus.applied, data=data)
+    for index, data in conflicts.items():
+        results[index] = _result(operations[index], BatchResultStatus.conflict, data=data)
+    for index, detail in errors.items():
+        results[index] = _result(operations[index], BatchResultStatus.error, detail=detail)
+    return [results[index] for index in range(len(operations))]
+
+
+def _parse_attendance(payload: dict[str, Any]) -> tuple[Hashable, AttendanceBase]:
+    record = AttendanceBase(**payload)
+    return (record.class_id, record.date, record.student_id), record
+
+
+def _parse_submission(payload: dict[str, Any]) -> tuple[Hashable, SubmissionBase]:
+    submission = SubmissionBase(**payload)
+    return (submission.assignment_id, submission.student_id), submission
+
+
+def _parse_student(payload: dict[str, Any]) -> tuple[Hashable, StudentUpdate]:
+    if "id" not in payload:
+        raise ValueError("Student edits need an id")
+    edit = StudentUpdate(**{key: value for key, value in payload.items() if key != "id"})
+    columns = Student.__table__.c
+    required = [key for key, value in edit.dict(exclude_unset=True).items() if value is None and not columns[key].nullable]
+    if required:
+        raise ValueError(f"{', '.join(required)} cannot be null")
+    return int(payload["id"]), edit
+
+
+PARSERS: dict[BatchOperationType, Callable[[dict[str, Any]], tuple[Hashable, Any]]] = {
+    BatchOperationType.attendance: _parse_attendance,
+    BatchOperationType.submission: _parse_submission,
+    BatchOperationType.student: _parse_student,
+}
+
+
+def _apply_group(
+    session: Session,
+    apply: Applier,
+    pending: Pending,
+    applied: dict[int, Any],
+    conflicts: dict[int, Any],
+    errors: dict[int, str],
+) -> None:
+    """Run one group's statements in a savepoint.
+
+    A database error the parsers did not foresee fails that group's edits
+    with an error result instead of the whole batch.
+    """
+
+    try:
+        with session.begin_nested():
+            apply(session, pending, applied, conflicts, errors)
+    except DBAPIError as exc:
+        for index, _, _ in pending.values():
+            applied.pop(index, None)
+            if index not in conflicts:
+                errors[index] = f"Could not be applied: {exc.orig}"
+
+
+def _reject_missing(
+    session: Session, pending: Pending, errors: dict[int, str], position: int, model: type[Any], detail: str
+) -> None:
+    """Fail the edits whose key, at ``position``, names a row of ``model`` that no longer exists."""
+
+    found = set(session.exec(select(model.id).where(model.id.in_({key[position] for key in pending}))).all())
+    for key in [key for key in pending if key[position] not in found]:
+        errors[pending.pop(key)[0]] = detail
+
+
+def _reject_archived(pending: Pending, errors: dict[int, str], position: int, archived: set[int]) -> None:
+    """Fail the edits whose key, at ``position``, belongs to an archived academic year."""
+
+    for key in [key for key in pending if key[position] in archived]:
+        errors[pending.pop(key)[0]] = "Academic year is archived"
+
+
+def _apply_attendance(
+    session: Session, pending: Pending, applied: dict[int, Any], conflicts: dict[int, Any], errors: dict[int, str]
+) -> None:
+    if not pending:
+        return
+    _reject_missing(session, pending, errors, 0, Classroom, "Class not found")
+    _reject_missing(session, pending, errors, 2, Student, "Student not found")
+    _reject_archived(pending, errors, 0, archived_classes(session, {key[0] for key in pending}))
+    if not pending:
+        return
+    key_columns = tuple_(Attendance.class_id, Attendance.date, Attendance.student_id)
+    current = {
+        (row.class_id, row.date, row.student_id): row
+        for row in session.exec(select(Attendance).where(key_columns.in_(list(pending))).with_for_update()).all()
+    }
+    winners = _resolve(pending, current, conflicts)
+    stored = upsert_attendance(session, [pending[key][2] for key in winners])
+    for row in stored:
+        applied[pending[(row["class_id"], row["date"], row["student_id"])][0]] = jsonable_encoder(row)
+
+
+def _apply_submissions(
+    session: Session, pending: Pending, applied: dict[int, Any], conflicts: dict[int, Any], errors: dict[int, str]
+) -> None:
+    if not pending:
+        return
+    assignments = {
+        assignment.id: assignment
+        for assignment in session.exec(
+            select(Assignment).where(Assignment.id.in_({assignment_id for assignment_id, _ in pending}))
+        ).all()
+    }
+    for key in [key for key in pending if key[0] not in assignments]:
+        errors[pending.pop(key)[0]] = "Assignment not found"
+    _reject_missing(session, pending, errors, 1, Student, "Student not found")
+    _reject_archived(pending, errors, 0, archived_assignments(session, {key[0] for key in pending}))
+    if not pending:
+        return
+    key_columns = tuple_(Submission.assignment_id, Submission.student_id)
+    current = {
+        (row.assignment_id, row.student_id): row
+        for row in session.exec(select(Submission).where(key_columns.in_(list(pending))).with_for_update()).all()
+    }
+    by_assignment: dict[int, list[SubmissionCell]] = {}
+    for assignment_id, student_id in _resolve(pending, current, conflicts):
+        payload = pending[(assignment_id, student_id)][2]
+        by_assignment.setdefault(assignment_id, []).append(
+            SubmissionCell(**payload.dict(exclude_unset=True, exclude={"assignment_id"}))
+        )
+    for assignment_id, cells in by_assignment.items():
+        stored = upsert_submissions(session, assignment_id, cells)
+        publish_submission_updates(session, assignments[assignment_id], stored)
+        for row in stored:
+            applied[pending[(assignment_id, row["student_id"])][0]] = jsonable_encoder(row)
+
+
+def _apply_students(
+    session: Session, pending: Pending, applied: dict[int, Any], conflicts: dict[int, Any], errors: dict[int, str]
+) -> None:
+    if not pending:
+        return
+    current = {
+        student.id: student
+        for student in session.exec(select(Student).where(Student.id.in_(list(pending))).with_for_update()).all()
+    }
+    for student_id in [student_id for student_id in pending if student_id not in current]:
+        errors[pending.pop(student_id)[0]] = "Student not found"
+    winners = _resolve(pending, current, conflicts)
+    if not winners:
+        return
+    now = datetime.utcnow()
+    session.execute(
+        update(Student),
+        [{"id": student_id, **pending[student_id][2].dict(exclude_unset=True), "updated_at": now} for student_id in winners],
+    )
+    record_changes(session, Student.__tablename__, winners, ChangeOperation.upsert)
+    students = session.exec(
+        select(Student).where(Student.id.in_(winners)).execution_options(populate_existing=True)
+    ).all()
+    index_students(session, students)
+    for student in students:
+        applied[pending[student.id][0]] = jsonable_encoder(student)
+
+
+APPLIERS: dict[BatchOperationType, Applier] = {
+    BatchOperationType.attendance: _apply_attendance,
+    BatchOperationType.submission: _apply_submissions,
+    BatchOperationType.student: _apply_students,
+}
+
+
+def _resolve(pending: Pending, current: dict[Hashable, Any], conflicts: dict[int, Any]) -> list[Any]:
+    """Split ``pending`` into winning keys and conflicts against ``current`` rows."""
+
+    winners = []
+    for key, (index, edited_at, _) in pending.items():
+        existing = current.get(key)
+        if existing is not None and existing.updated_at > edited_at:
+            conflicts[index] = jsonable_encoder(existing)
+        else:
+            winners.append(key)
+    return winners
+
+
+def _describe(exc: Exception) -> str:
+    errors = getattr(exc, "errors", None)
+    if callable(errors):
+        return "; ".join(f"{'.'.join(str(part) for part in error['loc'])}: {error['msg']}" for error in errors())
+    return str(exc)
+
+
+def _as_utc(moment: datetime) -> datetime:
+    if moment.tzinfo is None:
+        return moment
+    return moment.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def _result(operation: BatchOperation, status: BatchResultStatus, detail: str | None = None, data: Any = None) -> dict[str, Any]:
+    return {"op_id": operation.op_id, "status": status, "detail": detail, "data": data}
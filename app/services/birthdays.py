@@ -7,20 +7,26 @@ from datetime import date, datetime, time
 from sqlalchemy import func
 from sqlmodel import Session, select
 
+from ..cache import cached
 from ..config import get_settings
 from ..models import EmailJob, Setting, Student
+from .events import publish_after_commit
 
 DEFAULT_TEMPLATE_SUBJECT = "Happy Birthday, {{student_name}}! 🎉"
 DEFAULT_TEMPLATE_BODY = """Dear {{student_name}},\nWishing you a wonderful birthday from {{class_name}}!\nHave an amazing year ahead.\n— {{teacher_name}}"""
 
 
 def get_template(session: Session) -> tuple[str, str]:
-    subject = session.exec(select(Setting).where(Setting.key == "birthday_subject")).first()
-    body = session.exec(select(Setting).where(Setting.key == "birthday_body")).first()
-    return (
-        subject.value if subject else DEFAULT_TEMPLATE_SUBJECT,
-        body.value if body else DEFAULT_TEMPLATE_BODY,
-    )
+    def load() -> list[str]:
+        subject = session.exec(select(Setting).where(Setting.key == "birthday_subject")).first()
+        body = session.exec(select(Setting).where(Setting.key == "birthday_body")).first()
+        return [
+            subject.value if subject else DEFAULT_TEMPLATE_SUBJECT,
+            body.value if body else DEFAULT_TEMPLATE_BODY,
+        ]
+
+    subject, body = cached(session, "birthday_template", load, ["settings"])
+    return subject, body
 
 
 def schedule_birthday_emails(session: Session, teacher_name: str) -> list[EmailJob]:
@@ -47,7 +53,8 @@ def schedule_birthday_emails(session: Session, teacher_name: str) -> list[EmailJ
         )
         session.add(job)
         scheduled_jobs.append(job)
+    if scheduled_jobs:
+        update = {"date": today.isoformat(), "student_ids": [job.student_id for job in scheduled_jobs]}
+        publish_after_commit(session, "dashboard", "birthdays", update, key=today.isoformat())
     session.commit()
-    for job in scheduled_jobs:
-        session.refresh(job)
     return scheduled_jobs
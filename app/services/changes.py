@@ -0,0 +1,211 @@
+"""Append-only change log feeding the delta-sync endpoint."""
+
+import time
+from datetime import datetime, timedelta
+from typing import Any, Iterable
+
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import ColumnElement, Table, delete, event, func, insert, literal
+from sqlalchemy.orm import Session as OrmSession
+from sqlmodel import Session, SQLModel, select
+
+from ..database import upsert_insert
+from ..models import (
+    Assignment,
+    Attendance,
+    ChangeLog,
+    ChangeOperation,
+    ClassStudent,
+    Classroom,
+    Setting,
+    Student,
+    Submission,
+    SyncClient,
+)
+
+TRACKED_MODELS: dict[str, type[SQLModel]] = {
+    model.__tablename__: model for model in (Classroom, Student, ClassStudent, Attendance, Assignment, Submission)
+}
+PRUNED_THROUGH_KEY = "change_log.pruned_through"
+PRUNE_INTERVAL_SECONDS = 300
+
+_last_prune = 0.0
+
+
+class ChangeLogExpired(Exception):
+    """Raised when a client asks for changes that have already been pruned."""
+
+
+def record_changes(session: Session, table_name: str, row_ids: Iterable[int], operation: ChangeOperation) -> None:
+    """Log changes made by set-based statements, which bypass flush events."""
+
+    now = datetime.utcnow()
+    entries = [
+        {"table_name": table_name, "row_id": row_id, "operation": operation, "changed_at": now} for row_id in row_ids
+    ]
+    if entries:
+        session.execute(insert(ChangeLog), entries)
+
+
+def record_deletes(session: Session, table: Table, condition: ColumnElement[bool]) -> None:
+    """Log the rows of ``table`` matching ``condition`` as deleted, with the tracked rows its foreign keys cascade to.
+
+    Call it just before the set-based ``DELETE``; the database removes the
+    dependent rows itself, so they are logged here with one ``INSERT ... SELECT``
+    per table rather than by loading them.
+    """
+
+    columns = ChangeLog.__table__.c
+    now = datetime.utcnow()
+    if table.name in TRACKED_MODELS:
+        session.execute(
+            insert(ChangeLog).from_select(
+                ["table_name", "row_id", "operation", "changed_at"],
+                select(
+                    literal(table.name),
+                    table.c.id,
+                    literal(ChangeOperation.delete, columns.operation.type),
+                    literal(now, columns.changed_at.type),
+                ).where(condition),
+            )
+        )
+    for model in TRACKED_MODELS.values():
+        child = model.__table__
+        for key in child.foreign_keys:
+            if key.column.table is table and key.ondelete == "CASCADE" and child is not table:
+                record_deletes(session, child, key.parent.in_(select(key.column).where(condition)))
+
+
+@event.listens_for(OrmSession, "after_flush")
+def _log_flushed_changes(session: OrmSession, flush_context: Any) -> None:
+    now = datetime.utcnow()
+    entries = []
+    for obj in session.new | session.dirty:
+        table_name = getattr(obj, "__tablename__", None)
+        if table_name in TRACKED_MODELS and (obj in session.new or session.is_modified(obj)):
+            entries.append({"table_name": table_name, "row_id": obj.id, "operation": ChangeOperation.upsert, "changed_at": now})
+    for obj in session.deleted:
+        table_name = getattr(obj, "__tablename__", None)
+        if table_name in TRACKED_MODELS:
+            entries.append({"table_name": table_name, "row_id": obj.id, "operation": ChangeOperation.delete, "changed_at": now})
+    if entries:
+        session.connection().execute(insert(ChangeLog), entries)
+
+
+def latest_seq(session: Session) -> int:
+    return session.exec(select(func.max(ChangeLog.seq))).one() or 0
+
+
+def pruned_through(session: Session) -> int:
+    setting = session.exec(select(Setting).where(Setting.key == PRUNED_THROUGH_KEY)).first()
+    return int(setting.value) if setting else 0
+
+
+def changes_since(session: Session, since: int, limit: int, lag_seconds: int = 0) -> dict[str, Any]:
+    """Return the latest change per row after ``since``, with the row's current data.
+
+    Several changes to the same row collapse into one entry, so a client only
+    downloads each changed row once however often it was edited.
+
+    On PostgreSQL, sequence numbers are taken at insert but become visible at
+    commit, so a transaction can commit a lower number after a reader has moved
+    past it. Entries younger than ``lag_seconds`` are therefore held back until
+    any transaction that took an earlier number has committed.
+    """
+
+    if since < pruned_through(session):
+        raise ChangeLogExpired(since)
+    visible = ChangeLog.seq > since
+    if lag_seconds and session.get_bind().dialect.name == "postgresql":
+        visible &= ChangeLog.changed_at <= datetime.utcnow() - timedelta(seconds=lag_seconds)
+    latest = (
+        select(func.max(ChangeLog.seq).label("seq"))
+        .where(visible)
+        .group_by(ChangeLog.table_name, ChangeLog.row_id)
+        .subquery()
+    )
+    entries = session.exec(
+        select(ChangeLog).join(latest, latest.c.seq == ChangeLog.seq).order_by(ChangeLog.seq).limit(limit + 1)
+    ).all()
+    has_more = len(entries) > limit
+    entries = entries[:limit]
+
+    wanted: dict[str, list[int]] = {}
+    for entry in entries:
+        if entry.operation == ChangeOperation.upsert:
+            wanted.setdefault(entry.table_name, []).append(entry.row_id)
+    rows: dict[tuple[str, int], Any] = {}
+    for table_name, row_ids in wanted.items():
+        model = TRACKED_MODELS[table_name]
+        for row in session.exec(select(model).where(model.id.in_(row_ids))).all():
+            rows[(table_name, row.id)] = row
+
+    changes = []
+    for entry in entries:
+        row = rows.get((entry.table_name, entry.row_id))
+        changes.append(
+            {
+                "seq": entry.seq,
+                "table": entry.table_name,
+                "id": entry.row_id,
+                "op": entry.operation.value if row is not None else ChangeOperation.delete.value,
+                "data": jsonable_encoder(row) if row is not None else None,
+            }
+        )
+    return {"changes": changes, "next_since": entries[-1].seq if entries else since, "has_more": has_more}
+
+
+def acknowledge(session: Session, client_id: str, last_seq: int) -> None:
+    """Store ``last_seq`` as the high-water mark ``client_id`` has fully applied."""
+
+    statement = upsert_insert(session, SyncClient.__table__).values(
+        client_id=client_id, last_seq=last_seq, updated_at=datetime.utcnow()
+    )
+    session.execute(
+        statement.on_conflict_do_update(
+            index_elements=[SyncClient.client_id],
+            set_={"last_seq": statement.excluded.last_seq, "updated_at": statement.excluded.updated_at},
+        )
+    )
+
+
+def prune_change_log(session: Session, client_ttl_days: int, retention_days: int) -> int:
+    """Drop log entries every live client has acknowledged; returns the new watermark.
+
+    Entries younger than ``retention_days`` are always kept, so clients that
+    sync without a ``client_id``, or start from a fresh resync, can catch up
+    without being sent back to resync. Clients that have not synced for
+    ``client_ttl_days`` are forgotten and must do a full resync.
+    """
+
+    now = datetime.utcnow()
+    session.execute(delete(SyncClient).where(SyncClient.updated_at < now - timedelta(days=client_ttl_days)))
+    retained = (
+        session.exec(
+            select(func.max(ChangeLog.seq)).where(ChangeLog.changed_at < now - timedelta(days=retention_days))
+        ).one()
+        or 0
+    )
+    acknowledged = session.exec(select(func.min(SyncClient.last_seq))).one()
+    low = retained if acknowledged is None else min(acknowledged, retained)
+    current = pruned_through(session)
+    if low <= current:
+        return current
+    session.execute(delete(ChangeLog).where(ChangeLog.seq <= low))
+    setting = session.exec(select(Setting).where(Setting.key == PRUNED_THROUGH_KEY)).first() or Setting(
+        key=PRUNED_THROUGH_KEY, value="0"
+    )
+    setting.value = str(low)
+    setting.updated_at = datetime.utcnow()
+    session.add(setting)
+    return low
+
+
+def maybe_prune_change_log(session: Session, client_ttl_days: int, retention_days: int) -> None:
+    """Prune at most once every ``PRUNE_INTERVAL_SECONDS`` per process."""
+
+    global _last_prune
+    if time.monotonic() - _last_prune < PRUNE_INTERVAL_SECONDS:
+        return
+    _last_prune = time.monotonic()
+    prune_change_log(session, client_ttl_days, retention_days)
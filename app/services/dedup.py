@@ -0,0 +1,232 @@
+"""Duplicate-student detection with blocking keys.
+
+Every student gets a few blocking keys in ``student_match_keys``: the phonetic
+codes of both names with the date of birth, and the guardian's phone number
+with the date of birth. Only students that share a key are compared, with a
+fuzzy name score, so checking a new student is an index lookup and a sweep of
+the whole school grows with its size rather than with its square. Students
+without keys, such as those created before this module existed, are indexed
+by ``init_db``. Run ``python -m app.services.dedup`` to rebuild every key and
+list likely duplicates.
+"""
+
+import argparse
+import unicodedata
+from collections import defaultdict
+from datetime import date
+from difflib import SequenceMatcher
+from typing import Any, Iterable, Iterator, Literal, Protocol, Sequence
+
+from sqlalchemy import and_, delete, insert
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import aliased
+from sqlmodel import Session, select
+
+from ..cache import bump_cache_generation
+from ..database import get_session
+from ..models import DuplicateMatch, DuplicatePair, Student, StudentMatchKey
+
+DuplicatePolicy = Literal["reject", "reuse", "create"]
+DUPLICATES_DESCRIPTION = (
+    "What to do with a likely duplicate of an existing student: reject it (409), reuse the existing student, "
+    "or create it anyway"
+)
+MATCH_THRESHOLD = 0.9
+LOOKUP_BATCH_SIZE = 500
+REBUILD_BATCH_SIZE = 5_000
+CONTACT_DIGITS = 9  # enough to ignore country and trunk prefixes
+SOUNDEX_CODES = {
+    letter: str(code)
+    for code, letters in enumerate(("aeiouyhw", "bfpv", "cgjkqsxz", "dt", "l", "mn", "r"))
+    for letter in letters
+}
+MATCH_COLUMNS = (Student.id, Student.first_name, Student.last_name, Student.date_of_birth, Student.guardian_contact)
+
+
+class Person(Protocol):
+    first_name: str
+    last_name: str
+    date_of_birth: date
+    guardian_contact: str
+
+
+def _clean(name: str) -> str:
+    decomposed = unicodedata.normalize("NFKD", name.casefold())
+    return "".join(char for char in decomposed if char.isalnum())
+
+
+def soundex(name: str) -> str:
+    """American Soundex of ``name``, or its cleaned form when it has no Latin letters."""
+
+    cleaned = _clean(name)
+    letters = [char for char in cleaned if char in SOUNDEX_CODES]
+    if not letters:
+        return cleaned
+    code, previous = letters[0].upper(), SOUNDEX_CODES[letters[0]]
+    for letter in letters[1:]:
+        digit = SOUNDEX_CODES[letter]
+        if digit != "0" and digit != previous:
+            code += digit
+            if len(code) == 4:
+                break
+        if letter not in "hw":
+            previous = digit
+    return code.ljust(4, "0")
+
+
+def contact_digits(contact: str | None) -> str:
+    return "".join(char for char in contact or "" if char.isdigit())[-CONTACT_DIGITS:]
+
+
+def match_keys(person: Person) -> set[str]:
+    born = person.date_of_birth.isoformat()
+    names = ":".join(sorted((soundex(person.first_name), soundex(person.last_name))))
+    keys = {f"name:{names}:{born}"}
+    digits = contact_digits(person.guardian_contact)
+    if len(digits) >= 6:
+        keys.add(f"contact:{digits}:{born}")
+    return keys
+
+
+def match_score(person: Person, other: Person) -> float:
+    """Name similarity in ``[0, 1]`` of two people born on the same day, tolerating swapped names."""
+
+    if person.date_of_birth != other.date_of_birth:
+        return 0.0
+    first, last = _clean(person.first_name), _clean(person.last_name)
+    other_first, other_last = _clean(other.first_name), _clean(other.last_name)
+
+    def similarity(a: str, b: str) -> float:
+        return SequenceMatcher(None, a, b).ratio() if a or b else 1.0
+
+    straight = (similarity(first, other_first) + similarity(last, other_last)) / 2
+    swapped = (similarity(first, other_last) + similarity(last, other_first)) / 2
+    return round(max(straight, swapped), 3)
+
+
+def index_students(session: Session, students: Iterable[Any]) -> None:
+    """Replace the blocking keys of ``students`` (rows or objects with an ``id``) after they were created or edited."""
+
+    students = list(students)
+    if not students:
+        return
+    session.execute(delete(StudentMatchKey).where(StudentMatchKey.student_id.in_([student.id for student in students])))
+    rows = [{"student_id": student.id, "key": key} for student in students for key in sorted(match_keys(student))]
+    session.execute(insert(StudentMatchKey), rows)
+
+
+def find_matches(
+    session: Session, people: Sequence[Person], threshold: float = MATCH_THRESHOLD
+) -> list[list[DuplicateMatch]]:
+    """Return, for each of ``people``, the stored students it probably duplicates, best first."""
+
+    keys = [match_keys(person) for person in people]
+    wanted = sorted(set().union(*keys))
+    holders: dict[str, list[int]] = defaultdict(list)
+    students: dict[int, Student] = {}
+    for start in range(0, len(wanted), LOOKUP_BATCH_SIZE):
+        rows = session.exec(
+            select(StudentMatchKey.key, Student)
+            .join(Student, Student.id == StudentMatchKey.student_id)
+            .where(StudentMatchKey.key.in_(wanted[start : start + LOOKUP_BATCH_SIZE]))
+        )
+        for key, student in rows:
+            holders[key].append(student.id)
+            students[student.id] = student
+    matches = []
+    for person, person_keys in zip(people, keys):
+        candidates = {student_id for key in person_keys for student_id in holders.get(key, ())}
+        found = []
+        for student_id in candidates:
+            student = students[student_id]
+            score = match_score(person, student)
+            if score >= threshold:
+                found.append(
+                    DuplicateMatch(
+                        student_id=student_id,
+                        name=f"{student.first_name} {student.last_name}",
+                        date_of_birth=student.date_of_birth,
+                        score=score,
+                    )
+                )
+        matches.append(sorted(found, key=lambda match: (-match.score, match.student_id)))
+    return matches
+
+
+def duplicate_pairs(session: Session, threshold: float = MATCH_THRESHOLD) -> Iterator[DuplicatePair]:
+    """Yield every pair of stored students sharing a blocking key and scoring at least ``threshold``."""
+
+    left, right = aliased(StudentMatchKey), aliased(StudentMatchKey)
+    pairs = session.execute(
+        select(left.student_id, right.student_id)
+        .join(right, and_(right.key == left.key, right.student_id > left.student_id))
+        .distinct()
+        .order_by(left.student_id, right.student_id)
+    ).all()
+    for start in range(0, len(pairs), LOOKUP_BATCH_SIZE):
+        batch = pairs[start : start + LOOKUP_BATCH_SIZE]
+        ids = {student_id for pair in batch for student_id in pair}
+        people = {row.id: row for row in session.exec(select(*MATCH_COLUMNS).where(Student.id.in_(ids)))}
+        for student_id, duplicate_id in batch:
+            score = match_score(people[student_id], people[duplicate_id])
+            if score >= threshold:
+                yield DuplicatePair(student_id=student_id, duplicate_id=duplicate_id, score=score)
+
+
+def rebuild_match_keys(tenant: str | None = None, batch_size: int = REBUILD_BATCH_SIZE) -> int:
+    """Recompute every student's blocking keys, one committed batch at a time; returns the student count."""
+
+    with get_session(tenant) as session:
+        session.execute(delete(StudentMatchKey).where(~StudentMatchKey.student_id.in_(select(Student.id))))
+    last_id, total = 0, 0
+    while True:
+        with get_session(tenant) as session:
+            students = session.exec(
+                select(*MATCH_COLUMNS).where(Student.id > last_id).order_by(Student.id).limit(batch_size)
+            ).all()
+            index_students(session, students)
+            if not students:
+                bump_cache_generation(session)
+                return total
+        total += len(students)
+        last_id = students[-1].id
+
+
+def backfill_match_keys(bind: Engine, batch_size: int = REBUILD_BATCH_SIZE) -> int:
+    """Index the students on ``bind`` that have no blocking keys yet; returns how many were indexed."""
+
+    total = 0
+    while True:
+        with get_session(bind=bind) as session:
+            students = session.exec(
+                select(*MATCH_COLUMNS)
+                .where(~Student.id.in_(select(StudentMatchKey.student_id)))
+                .order_by(Student.id)
+                .limit(batch_size)
+            ).all()
+            index_students(session, students)
+        total += len(students)
+        if len(students) < batch_size:
+            return total
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Rebuild duplicate-detection keys and list likely duplicate students")
+    parser.add_argument("--tenant", action="append", default=[], help="check this school (repeatable)")
+    parser.add_argument("--threshold", type=float, default=MATCH_THRESHOLD, help="minimum name similarity (0-1)")
+    parser.add_argument("--skip-rebuild", action="store_true", help="use the stored keys as they are")
+    args = parser.parse_args()
+    for tenant in args.tenant or [None]:
+        name = tenant or "default"
+        if not args.skip_rebuild:
+            print(f"{name}: indexed {rebuild_match_keys(tenant)} students")
+        with get_session(tenant, read_only=True) as session:
+            count = 0
+            for pair in duplicate_pairs(session, args.threshold):
+                count += 1
+                print(f"{name}: student {pair.student_id} may duplicate {pair.duplicate_id} (score {pair.score})")
+        print(f"{name}: {count} candidate merges")
+
+
+if __name__ == "__main__":
+    main()
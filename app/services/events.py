@@ -0,0 +1,115 @@
+"""In-process pub/sub hub pushing live updates to server-sent event streams."""
+
+import asyncio
+import threading
+from collections import OrderedDict
+from typing import Any, Iterable
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session as OrmSession
+
+MAX_PENDING_EVENTS = 256
+RESYNC_EVENT = ("resync", "")
+
+
+class Subscriber:
+    """One SSE stream's mailbox.
+
+    Pending events are keyed by ``(event_type, key)`` so a burst of updates to
+    the same thing collapses into its latest value. If a slow client lets more
+    than ``max_pending`` distinct events pile up, they are dropped in favour of
+    a single ``resync`` event telling it to refetch.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, channels: frozenset[str], max_pending: int) -> None:
+        self.loop = loop
+        self.channels = channels
+        self.max_pending = max_pending
+        self._pending: OrderedDict[tuple[str, str], Any] = OrderedDict()
+        self._lock = threading.Lock()
+        self._ready = asyncio.Event()
+
+    def offer(self, event_type: str, key: str, data: Any) -> None:
+        with self._lock:
+            self._pending[(event_type, key)] = data
+            self._pending.move_to_end((event_type, key))
+            if len(self._pending) > self.max_pending:
+                self._pending.clear()
+                self._pending[RESYNC_EVENT] = {}
+        self.loop.call_soon_threadsafe(self._ready.set)
+
+    async def next_batch(self, timeout: float, coalesce_seconds: float) -> list[tuple[str, Any]]:
+        """Wait up to ``timeout`` for events, then linger briefly to merge a burst."""
+
+        try:
+            await asyncio.wait_for(self._ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            return []
+        await asyncio.sleep(coalesce_seconds)
+        with self._lock:
+            batch = [(event_type, data) for (event_type, _), data in self._pending.items()]
+            self._pending.clear()
+            self._ready.clear()
+        return batch
+
+
+class EventHub:
+    """Fan out published events to the subscribers of each channel."""
+
+    def __init__(self, max_pending: int = MAX_PENDING_EVENTS) -> None:
+        self.max_pending = max_pending
+        self._channels: dict[str, set[Subscriber]] = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, channels: Iterable[str]) -> Subscriber:
+        subscriber = Subscriber(asyncio.get_running_loop(), frozenset(channels), self.max_pending)
+        with self._lock:
+            for channel in subscriber.channels:
+                self._channels.setdefault(channel, set()).add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber) -> None:
+        with self._lock:
+            for channel in subscriber.channels:
+                members = self._channels.get(channel)
+                if members is not None:
+                    members.discard(subscriber)
+                    if not members:
+                        del self._channels[channel]
+
+    def publish(self, channel: str, event_type: str, data: Any, key: str = "") -> None:
+        """Deliver an event to every subscriber of ``channel``; safe from any thread."""
+
+        with self._lock:
+            subscribers = list(self._channels.get(channel, ()))
+        for subscriber in subscribers:
+            subscriber.offer(event_type, key, data)
+
+    def subscriber_count(self) -> int:
+        with self._lock:
+            return len({subscriber for members in self._channels.values() for subscriber in members})
+
+
+hub = EventHub()
+
+
+def channel_name(tenant: str | None, channel: str) -> str:
+    return f"{tenant}:{channel}" if tenant else channel
+
+
+def publish_after_commit(session: OrmSession, channel: str, event_type: str, data: Any, key: str = "") -> None:
+    """Queue an event that is published only once ``session`` commits."""
+
+    name = channel_name(session.info.get("tenant"), channel)
+    session.info.setdefault("pending_events", []).append((name, event_type, data, key))
+
+
+@event.listens_for(OrmSession, "after_commit")
+def _publish_pending(session: OrmSession) -> None:
+    for name, event_type, data, key in session.info.pop("pending_events", []):
+        hub.publish(name, event_type, data, key)
+
+
+@event.listens_for(OrmSession, "after_rollback")
+def _discard_pending(session: OrmSession) -> None:
+    session.info.pop("pending_events", None)
@@ -0,0 +1,237 @@
+"""Export jobs written by a bounded pool of background threads and kept in file storage for a while.
+
+``POST /api/v1/exports`` records a job and returns at once; one of
+``export_workers`` threads then writes the file to the same storage as
+uploads, and the client polls the job and downloads the result, resuming with
+``Range`` if the connection drops. A request identical to a job that is still
+pending or running gets that job back: the fingerprint sits in the unique
+``active_key`` column until the job ends, so this holds across processes.
+Finished and failed jobs expire ``export_ttl_hours`` after they end, and a job
+still running ``export_timeout_minutes`` after it started is given up. Jobs
+only live in a process's queue, so each process queues a school's pending
+jobs again the first time it serves that school's exports; a job already
+claimed elsewhere is skipped.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, timedelta
+from functools import lru_cache
+from typing import Any, Callable, Iterable, Sequence
+
+from sqlalchemy import delete, update
+from sqlmodel import Session, select
+
+from ..config import get_settings
+from ..database import get_session, upsert_insert
+from ..models import Classroom, ExportJob, ExportJobStatus, ExportKind, ExportRequest
+from .attendance import ATTENDANCE_EXPORT_COLUMNS, attendance_export_batches
+from .exports import Column, write_export
+from .gradebook import GRADEBOOKS_EXPORT_COLUMNS, gradebooks_export_batches
+from .storage import get_storage
+
+logger = logging.getLogger(__name__)
+
+PURGE_INTERVAL_SECONDS = 60
+_last_purge: dict[str | None, float] = {}
+_resumed: set[str | None] = set()
+
+Exporter = Callable[[Session, ExportJob], tuple[Iterable[Sequence[Sequence[Any]]], Sequence[Column]]]
+
+
+class ExportRequestError(Exception):
+    """Raised for export parameters that do not describe an export."""
+
+
+def _attendance(session: Session, job: ExportJob) -> tuple[Iterable[Sequence[Sequence[Any]]], Sequence[Column]]:
+    return attendance_export_batches(session, job.start_date, job.end_date, job.class_id), ATTENDANCE_EXPORT_COLUMNS
+
+
+def _gradebooks(session: Session, job: ExportJob) -> tuple[Iterable[Sequence[Sequence[Any]]], Sequence[Column]]:
+    statement = select(Classroom).order_by(Classroom.name, Classroom.id)
+    if job.class_id is not None:
+        statement = statement.where(Classroom.id == job.class_id)
+    if job.academic_year is not None:
+        statement = statement.where(Classroom.academic_year == job.academic_year)
+    return gradebooks_export_batches(session, session.exec(statement).all()), GRADEBOOKS_EXPORT_COLUMNS
+
+
+EXPORTERS: dict[ExportKind, Exporter] = {ExportKind.attendance: _attendance, ExportKind.gradebooks: _gradebooks}
+
+
+def normalize_request(request: ExportRequest) -> ExportRequest:
+    """Validate ``request`` and drop the filters its kind does not use, so equal exports compare equal."""
+
+    if request.kind == ExportKind.attendance:
+        if request.start_date is None or request.end_date is None:
+            raise ExportRequestError("Attendance exports need start_date and end_date")
+        if request.start_date > request.end_date:
+            raise ExportRequestError("start_date must not be after end_date")
+        return request.copy(update={"academic_year": None})
+    if request.class_id is None and request.academic_year is None:
+        raise ExportRequestError("Gradebook exports need academic_year or class_id")
+    return request.copy(update={"start_date": None, "end_date": None})
+
+
+def fingerprint(request: ExportRequest) -> str:
+    return hashlib.sha256(json.dumps(request.dict(), sort_keys=True, default=str).encode()).hexdigest()
+
+
+def submit_export(session: Session, request: ExportRequest) -> tuple[ExportJob, bool]:
+    """Record a pending job for ``request``, or find the identical one in flight.
+
+    Returns the job and whether it was created; the caller queues a created
+    job with :meth:`ExportService.submit` once the session has committed.
+    """
+
+    request = normalize_request(request)
+    key = fingerprint(request)
+    now = datetime.utcnow()
+    # A job past its timeout no longer holds the key, so an identical request starts afresh.
+    _time_out(session, ExportJob.active_key == key)
+    statement = upsert_insert(session, ExportJob.__table__).values(
+        **request.dict(),
+        fingerprint=key,
+        active_key=key,
+        status=ExportJobStatus.pending,
+        created_at=now,
+        expires_at=now + timedelta(hours=get_settings().export_ttl_hours),  # reset when the job ends
+    )
+    created = session.execute(statement.on_conflict_do_nothing(index_elements=["active_key"])).rowcount == 1
+    job = session.exec(select(ExportJob).where(ExportJob.fingerprint == key).order_by(ExportJob.id.desc())).first()
+    return job, created
+
+
+def _time_out(session: Session, *conditions: Any) -> None:
+    """Fail the running jobs matching ``conditions`` that started more than ``export_timeout_minutes`` ago."""
+
+    settings = get_settings()
+    now = datetime.utcnow()
+    session.execute(
+        update(ExportJob)
+        .where(
+            ExportJob.status == ExportJobStatus.running,
+            ExportJob.started_at <= now - timedelta(minutes=settings.export_timeout_minutes),
+            *conditions,
+        )
+        .values(
+            status=ExportJobStatus.failed,
+            error="Timed out",
+            active_key=None,
+            finished_at=now,
+            expires_at=now + timedelta(hours=settings.export_ttl_hours),
+        )
+    )
+
+
+def run_export(job_id: int, tenant: str | None = None) -> None:
+    """Write the export of a pending job to storage and record the outcome."""
+
+    with get_session(tenant) as session:
+        claimed = session.execute(
+            update(ExportJob)
+            .where(ExportJob.id == job_id, ExportJob.status == ExportJobStatus.pending)
+            .values(status=ExportJobStatus.running, started_at=datetime.utcnow())
+        ).rowcount
+        job = session.get(ExportJob, job_id)
+    if not claimed or job is None:
+        return
+    storage = get_storage()
+    key = f"exports/{tenant}/{job_id}.{job.format}" if tenant else f"exports/{job_id}.{job.format}"
+    handle = tempfile.NamedTemporaryFile(dir=storage.spool_dir, suffix=f".{job.format}", delete=False)
+    try:
+        with handle, get_session(tenant, read_only=True) as session:
+            batches, columns = EXPORTERS[job.kind](session, job)
+            for chunk in write_export(batches, columns, job.format):
+                handle.write(chunk)
+        size = os.path.getsize(handle.name)
+        storage.save(key, handle.name)
+    except Exception as exc:
+        logger.exception("Export job %s failed", job_id)
+        if os.path.exists(handle.name):
+            os.remove(handle.name)
+        _finish(tenant, job_id, status=ExportJobStatus.failed, error=str(exc)[:500] or type(exc).__name__)
+        return
+    if not _finish(tenant, job_id, status=ExportJobStatus.done, size=size, storage_key=key):
+        storage.delete(key)  # timed out or purged meanwhile
+
+
+def _finish(tenant: str | None, job_id: int, **values: Any) -> bool:
+    now = datetime.utcnow()
+    with get_session(tenant) as session:
+        return (
+            session.execute(
+                update(ExportJob)
+                .where(ExportJob.id == job_id, ExportJob.status == ExportJobStatus.running)
+                .values(
+                    **values,
+                    active_key=None,
+                    finished_at=now,
+                    expires_at=now + timedelta(hours=get_settings().export_ttl_hours),
+                )
+            ).rowcount
+            == 1
+        )
+
+
+def purge_expired_exports(session: Session) -> None:
+    """Time out stuck jobs and delete expired ones with their files, at most once a minute per school."""
+
+    tenant = session.info.get("tenant")
+    if time.monotonic() - _last_purge.get(tenant, 0.0) < PURGE_INTERVAL_SECONDS:
+        return
+    _last_purge[tenant] = time.monotonic()
+    _time_out(session)
+    expired = session.exec(
+        select(ExportJob.id, ExportJob.storage_key).where(
+            ExportJob.status.in_([ExportJobStatus.done, ExportJobStatus.failed]),
+            ExportJob.expires_at < datetime.utcnow(),
+        )
+    ).all()
+    storage = get_storage()
+    for _, storage_key in expired:
+        if storage_key:
+            try:
+                storage.delete(storage_key)
+            except Exception as exc:
+                logger.warning("Could not delete expired export %s: %s", storage_key, exc)
+    if expired:
+        session.execute(delete(ExportJob).where(ExportJob.id.in_([job_id for job_id, _ in expired])))
+
+
+class ExportService:
+    """Run export jobs on a fixed number of threads, off the request workers."""
+
+    def __init__(self, workers: int) -> None:
+        self._pool = ThreadPoolExecutor(workers, thread_name_prefix="export")
+
+    def submit(self, job_id: int, tenant: str | None = None) -> Future:
+        return self._pool.submit(run_export, job_id, tenant)
+
+
+@lru_cache
+def get_exports() -> ExportService:
+    return ExportService(get_settings().export_workers)
+
+
+def resume_exports(tenant: str | None = None) -> int:
+    """Queue the pending jobs of ``tenant``, once per process, e.g. those left by a restart; returns how many."""
+
+    if tenant in _resumed:
+        return 0
+    _resumed.add(tenant)
+    with get_session(tenant, read_only=True) as session:
+        job_ids = session.exec(
+            select(ExportJob.id).where(ExportJob.status == ExportJobStatus.pending).order_by(ExportJob.id)
+        ).all()
+    exports = get_exports()
+    for job_id in job_ids:
+        exports.submit(job_id, tenant)
+    if job_ids:
+        logger.info("Queued %s pending export jobs", len(job_ids))
+    return len(job_ids)
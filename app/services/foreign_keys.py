@@ -0,0 +1,173 @@
+"""Rebuild SQLite tables created before their foreign keys were declared.
+
+SQLite cannot add a constraint to an existing table, so the app starts without
+the missing keys and logs a warning until this command rebuilds the tables::
+
+    python -m app.services.foreign_keys [--tenant <school>] [--drop-orphans]
+
+The run first takes the database's write lock (``BEGIN IMMEDIATE``), so other
+writers, including a second run, wait for it. It then copies the database to
+``<database>.<timestamp>.bak`` with the online backup API and rebuilds each
+table in the same transaction. Rows that would break a unique index are
+deduplicated first, keeping the most recently updated one. Rows whose parent no
+longer exists are kept and counted, or deleted with ``--drop-orphans``.
+PostgreSQL adds missing keys at startup and needs no rebuild.
+"""
+
+import argparse
+import logging
+import sqlite3
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any
+
+from sqlalchemy import Table, UniqueConstraint
+from sqlalchemy.engine import Dialect
+from sqlalchemy.schema import CreateIndex, CreateTable
+
+from ..cache import bump_cache_generation
+from ..database import engine_for, get_session, missing_foreign_keys
+
+logger = logging.getLogger(__name__)
+
+LOCK_TIMEOUT_MS = 10 * 60 * 1000
+
+
+def rebuild_tables(tenant: str | None = None, drop_orphans: bool = False) -> dict[str, Any]:
+    """Back up the database, then rebuild every table missing a foreign key; returns a per-table report."""
+
+    bind = engine_for(tenant)
+    if bind.dialect.name != "sqlite":
+        raise RuntimeError(f"{bind.dialect.name} databases add foreign keys at startup")
+    database = bind.url.database
+    if not database or database == ":memory:":
+        raise RuntimeError("In-memory SQLite databases cannot be backed up")
+    report: dict[str, Any] = {"backup": None, "tables": {}}
+    tables = list(missing_foreign_keys(bind))
+    if not tables:
+        return report
+
+    raw = bind.raw_connection()
+    connection = raw.driver_connection
+    isolation_level = connection.isolation_level
+    connection.isolation_level = None  # manage the transaction by hand so the DDL is atomic too
+    try:
+        connection.execute(f"PRAGMA busy_timeout={LOCK_TIMEOUT_MS}")
+        connection.execute("PRAGMA foreign_keys=OFF")
+        connection.execute("PRAGMA legacy_alter_table=ON")  # keep other tables' references on the new table
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            # A run that held the lock before us may have rebuilt them already. Pragmas read
+            # the cached schema, so read sqlite_master first to pick up its changes.
+            connection.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+            tables = [table for table in tables if _lacks_foreign_keys(connection, table)]
+            if tables:
+                report["backup"] = str(backup_beside(database))
+            for table in tables:
+                report["tables"][table.name] = _rebuild(connection, table, bind.dialect, drop_orphans)
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+    finally:
+        connection.execute("PRAGMA legacy_alter_table=OFF")
+        connection.execute("PRAGMA foreign_keys=ON")
+        connection.isolation_level = isolation_level
+        raw.close()
+    if report["tables"]:
+        with get_session(tenant) as session:
+            bump_cache_generation(session)
+    return report
+
+
+def _lacks_foreign_keys(connection: sqlite3.Connection, table: Table) -> bool:
+    existing: dict[int, tuple[str, list[str]]] = {}
+    for key_id, _, parent, column, *_ in connection.execute(f'PRAGMA foreign_key_list("{table.name}")'):
+        existing.setdefault(key_id, (parent, []))[1].append(column)
+    declared = {(parent, tuple(columns)) for parent, columns in existing.values()}
+    return any(
+        (constraint.referred_table.name, tuple(constraint.column_keys)) not in declared
+        for constraint in table.foreign_key_constraints
+    )
+
+
+def backup_beside(database: str) -> Path:
+    """Copy ``database`` beside itself through a second connection, which can read under the caller's write lock."""
+
+    path = Path(f"{database}.{datetime.now(timezone.utc):%Y%m%dT%H%M%SZ}.bak")
+    source, target = sqlite3.connect(database), sqlite3.connect(path)
+    try:
+        source.backup(target)
+    finally:
+        target.close()
+        source.close()
+    logger.info("Backed up %s to %s", database, path)
+    return path
+
+
+def _rebuild(connection: sqlite3.Connection, table: Table, dialect: Dialect, drop_orphans: bool) -> dict[str, int]:
+    old = f"{table.name}__old"
+    columns = {row[1] for row in connection.execute(f'PRAGMA table_info("{table.name}")')}
+    names = ", ".join(f'"{column.name}"' for column in table.columns if column.name in columns)
+    orphaned = " OR ".join(
+        f'("{key.parent.name}" IS NOT NULL AND "{key.parent.name}" NOT IN '
+        f'(SELECT "{key.column.name}" FROM "{old if key.column.table is table else key.column.table.name}"))'
+        for key in table.foreign_keys
+        if key.parent.name in columns
+    ) or "0"
+    connection.execute(f'ALTER TABLE "{table.name}" RENAME TO "{old}"')
+    duplicates = _deduplicate(connection, table, old, columns)
+    orphans = connection.execute(f'SELECT COUNT(*) FROM "{old}" WHERE {orphaned}').fetchone()[0]
+    for index in table.indexes:
+        connection.execute(f'DROP INDEX IF EXISTS "{index.name}"')
+    connection.execute(str(CreateTable(table).compile(dialect=dialect)))
+    for index in table.indexes:
+        connection.execute(str(CreateIndex(index).compile(dialect=dialect)))
+    keep = f"WHERE NOT ({orphaned})" if drop_orphans else ""
+    rows = connection.execute(f'INSERT INTO "{table.name}" ({names}) SELECT {names} FROM "{old}" {keep}').rowcount
+    connection.execute(f'DROP TABLE "{old}"')
+    logger.log(
+        logging.WARNING if duplicates or orphans else logging.INFO,
+        "Rebuilt %s with foreign keys: %s rows, %s duplicates removed, %s orphaned rows %s",
+        table.name,
+        rows,
+        duplicates,
+        orphans,
+        "removed" if drop_orphans else "kept",
+    )
+    return {"rows": rows, "duplicates": duplicates, "orphans": orphans}
+
+
+def _deduplicate(connection: sqlite3.Connection, table: Table, old: str, columns: set[str]) -> int:
+    """Delete the rows of ``old`` that would break ``table``'s unique indexes, keeping the newest of each group."""
+
+    newest = '"updated_at" DESC, ' if "updated_at" in columns else ""
+    unique = [index.columns for index in table.indexes if index.unique]
+    unique += [constraint.columns for constraint in table.constraints if isinstance(constraint, UniqueConstraint)]
+    removed = 0
+    for group in unique:
+        keys = [column.name for column in group]
+        if not keys or not set(keys) <= columns:  # expression indexes have no plain columns
+            continue
+        partition = ", ".join(f'"{key}"' for key in keys)
+        present = " AND ".join(f'"{key}" IS NOT NULL' for key in keys)  # NULLs never collide
+        removed += connection.execute(
+            f'DELETE FROM "{old}" WHERE rowid IN (SELECT row_id FROM (SELECT rowid AS row_id, row_number() OVER '
+            f'(PARTITION BY {partition} ORDER BY {newest}rowid DESC) AS rank FROM "{old}" WHERE {present}) '
+            "WHERE rank > 1)"
+        ).rowcount
+    return removed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Back up and rebuild SQLite tables that lack their foreign keys")
+    parser.add_argument("--tenant", action="append", default=[], help="rebuild this school (repeatable)")
+    parser.add_argument("--drop-orphans", action="store_true", help="delete rows whose parent no longer exists")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    for tenant in args.tenant or [None]:
+        print(f"{tenant or 'default'}: {rebuild_tables(tenant, drop_orphans=args.drop_orphans)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""Class-wide gradebook assembly."""
+
+from datetime import date
+from typing import Any, Iterable, Iterator
+
+from sqlmodel import Session, select
+
+from ..cache import cached
+from ..models import Assignment, ClassStudent, Classroom, Student, SubmissionStatus
+from .archive import archived_classes, submission_source
+
+
+def build_gradebook(session: Session, classroom: Classroom) -> dict[str, Any]:
+    """Pivot every submission of a class into a student x assignment matrix.
+
+    The roster, the assignments and all of their submissions are fetched with one
+    query each, so the cost does not grow with the number of assignments. A
+    class of an archived year reads its archived submissions. The result is
+    cached until one of those tables is written.
+    """
+
+    return cached(
+        session,
+        f"gradebook:{classroom.id}",
+        lambda: _load_gradebook(session, classroom),
+        ["classes", "students", "class_students", "assignments", "submissions", "submissions_archive"],
+    )
+
+
+def _load_gradebook(session: Session, classroom: Classroom) -> dict[str, Any]:
+    students = session.exec(
+        select(Student.id, Student.first_name, Student.last_name)
+        .join(ClassStudent, ClassStudent.student_id == Student.id)
+        .where(ClassStudent.class_id == classroom.id)
+        .where(ClassStudent.archived.is_(False))
+        .order_by(Student.last_name, Student.first_name)
+    ).all()
+    assignments = session.exec(
+        select(Assignment.id, Assignment.title, Assignment.due_date)
+        .where(Assignment.class_id == classroom.id)
+        .order_by(Assignment.due_date, Assignment.id)
+    ).all()
+    source = submission_source(session, bool(archived_classes(session, [classroom.id])))
+    submissions = session.exec(
+        select(source.assignment_id, source.student_id, source.status, source.score)
+        .join(Assignment, Assignment.id == source.assignment_id)
+        .where(Assignment.class_id == classroom.id)
+    ).all()
+
+    cells = {(student_id, assignment_id): (state, score) for assignment_id, student_id, state, score in submissions}
+    rows = []
+    for student_id, first_name, last_name in students:
+        grades = []
+        scores = []
+        late_count = 0
+        for assignment_id, _, _ in assignments:
+            state, score = cells.get((student_id, assignment_id), (SubmissionStatus.not_submitted, None))
+            grades.append({"status": SubmissionStatus(state).value, "score": score})
+            if score is not None:
+                scores.append(score)
+            if state == SubmissionStatus.submitted_late:
+                late_count += 1
+        rows.append(
+            {
+                "student_id": student_id,
+                "name": f"{first_name} {last_name}",
+                "grades": grades,
+                "average_score": round(sum(scores) / len(scores), 2) if scores else None,
+                "late_count": late_count,
+            }
+        )
+    return {
+        "class_id": classroom.id,
+        "class_name": classroom.name,
+        "assignments": [
+            {"id": assignment_id, "title": title, "due_date": due_date.isoformat()}
+            for assignment_id, title, due_date in assignments
+        ],
+        "students": rows,
+    }
+
+
+def gradebook_columns(gradebook: dict[str, Any]) -> list[tuple[str, str]]:
+    """Return the flat ``(name, kind)`` columns used by tabular gradebook exports."""
+
+    columns = [("student_id", "int"), ("student", "string")]
+    for assignment in gradebook["assignments"]:
+        columns.extend([(f"{assignment['title']} status", "string"), (f"{assignment['title']} score", "int")])
+    columns.extend([("average_score", "float"), ("late_count", "int")])
+    return columns
+
+
+def gradebook_rows(gradebook: dict[str, Any]) -> Iterator[list[Any]]:
+    """Yield one flat row per student, aligned with :func:`gradebook_columns`."""
+
+    for student in gradebook["students"]:
+        row: list[Any] = [student["student_id"], student["name"]]
+        for grade in student["grades"]:
+            row.extend([grade["status"], grade["score"]])
+        row.extend([student["average_score"], student["late_count"]])
+        yield row
+
+
+GRADEBOOKS_EXPORT_COLUMNS = [
+    ("class", "string"),
+    ("student_id", "int"),
+    ("student", "string"),
+    ("assignment", "string"),
+    ("due_date", "date"),
+    ("status", "string"),
+    ("score", "int"),
+]
+
+
+def gradebooks_export_batches(session: Session, classrooms: Iterable[Classroom]) -> Iterator[list[tuple[Any, ...]]]:
+    """Yield one batch per class of long-format rows (one per student and assignment) for multi-class exports."""
+
+    for classroom in classrooms:
+        gradebook = build_gradebook(session, classroom)
+        due_dates = [date.fromisoformat(assignment["due_date"]) for assignment in gradebook["assignments"]]
+        yield [
+            (classroom.name, student["student_id"], student["name"], assignment["title"], due, grade["status"], grade["score"])
+            for student in gradebook["students"]
+            for assignment, due, grade in zip(gradebook["assignments"], due_dates, student["grades"])
+        ]
@@ -0,0 +1,518 @@
+"""Packed attendance: two bits per student per class-day for closed academic years.
+
+Run ``python -m app.services.packed_attendance <year>`` after year-end promotion
+to move a year's attendance rows, live or archived, into ``attendance_days``.
+Each class-day keeps the statuses of its roster as a bitmap, the original row
+ids (so ``AttendanceRead.id`` stays stable), and points at a sorted list of
+student ids in ``attendance_rosters`` that is shared by every day marking the
+same students. The rare notes go to ``attendance_notes``. Reads decode whole
+ranges at once with NumPy. A row-stored mark for the same class, day and
+student, written after packing, takes precedence over the packed one. Like
+archiving, packing is not a logical delete and is not written to the change log.
+Foreign keys cannot reach into a bitmap, so deleting a student calls
+``drop_students`` to repack the days that marked them. SQL cannot count inside
+one either, so ``count_packed`` keeps per-student totals for the progress
+counters.
+"""
+
+import argparse
+import hashlib
+import time
+import zlib
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import date, datetime
+from typing import Any, Iterable, Sequence
+
+import numpy as np
+from sqlalchemy import bindparam, delete, func, text
+from sqlalchemy.exc import DBAPIError
+from sqlmodel import Session, select
+
+from ..cache import bump_cache_generation
+from ..database import get_session, upsert_insert
+from ..models import (
+    Attendance,
+    AttendanceArchive,
+    AttendanceDay,
+    AttendanceNote,
+    AttendanceRoster,
+    AttendanceStatus,
+    Classroom,
+    ClassStudent,
+    Setting,
+    StudentPackedAttendance,
+)
+from .archive import attendance_source, reaches
+from .progress import ATTENDED_STATUSES, refresh_student_progress
+
+PACKED_THROUGH_KEY = "attendance.packed_through"
+PACKED_STATUSES = tuple(AttendanceStatus)  # bitmap code -> status
+PACKED_CODES = {state: code for code, state in enumerate(PACKED_STATUSES)}
+DELETE_BATCH_SIZE = 5_000
+ROW_TABLES = ("attendance", "attendance_archive")
+PACKED_TABLES = ("attendance_days", "attendance_rosters", "attendance_notes")
+ATTENDED_CODES = np.array([PACKED_CODES[state] for state in ATTENDED_STATUSES], dtype=np.uint8)
+_SHIFTS = np.array([0, 2, 4, 6], dtype=np.uint8)
+
+
+class PackError(Exception):
+    """Raised when an academic year cannot be packed."""
+
+
+@dataclass
+class PackedMarks:
+    """Decoded packed marks as parallel arrays; ``days`` are date ordinals, ``codes`` index ``PACKED_STATUSES``."""
+
+    ids: np.ndarray
+    class_ids: np.ndarray
+    student_ids: np.ndarray
+    days: np.ndarray
+    codes: np.ndarray
+    notes: dict[tuple[int, int, int], str]  # (class_id, day ordinal, student_id) -> note
+
+    @classmethod
+    def empty(cls) -> "PackedMarks":
+        none = np.empty(0, dtype=np.int64)
+        return cls(none, none, none, none, np.empty(0, dtype=np.uint8), {})
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def take(self, selected: np.ndarray) -> "PackedMarks":
+        return PackedMarks(
+            self.ids[selected],
+            self.class_ids[selected],
+            self.student_ids[selected],
+            self.days[selected],
+            self.codes[selected],
+            self.notes,
+        )
+
+    def rows(self) -> list[dict[str, Any]]:
+        """Return the marks as ``AttendanceRead``-shaped dicts."""
+
+        dates = {ordinal: date.fromordinal(ordinal) for ordinal in np.unique(self.days).tolist()}
+        return [
+            {
+                "id": mark_id,
+                "class_id": class_id,
+                "student_id": student_id,
+                "date": dates[ordinal],
+                "status": PACKED_STATUSES[code],
+                "note": self.notes.get((class_id, ordinal, student_id)),
+            }
+            for mark_id, class_id, student_id, ordinal, code in zip(
+                self.ids.tolist(),
+                self.class_ids.tolist(),
+                self.student_ids.tolist(),
+                self.days.tolist(),
+                self.codes.tolist(),
+            )
+        ]
+
+
+def encode_ids(ids: np.ndarray) -> bytes:
+    """Compress integer ids; ids close to each other cost about a byte each."""
+
+    return zlib.compress(np.diff(ids.astype("<i8"), prepend=0).tobytes())
+
+
+def decode_ids(blob: bytes) -> np.ndarray:
+    return np.cumsum(np.frombuffer(zlib.decompress(blob), dtype="<i8"))
+
+
+def pack_statuses(codes: np.ndarray) -> bytes:
+    """Pack 2-bit status codes four to a byte, lowest bits first."""
+
+    padded = np.zeros(-(-len(codes) // 4) * 4, dtype=np.uint8)
+    padded[: len(codes)] = codes
+    return np.bitwise_or.reduce(padded.reshape(-1, 4) << _SHIFTS, axis=1).astype(np.uint8).tobytes()
+
+
+def unpack_statuses(bitmaps: Sequence[bytes], counts: np.ndarray) -> np.ndarray:
+    """Decode many bitmaps at once into one array holding the first ``counts[i]`` codes of each."""
+
+    if not len(bitmaps):
+        return np.empty(0, dtype=np.uint8)
+    data = np.frombuffer(b"".join(bitmaps), dtype=np.uint8)
+    codes = ((data[:, None] >> _SHIFTS) & 3).reshape(-1)
+    padded = -(-counts // 4) * 4
+    total = int(counts.sum())
+    starts = np.repeat(np.cumsum(padded) - padded - (np.cumsum(counts) - counts), counts)
+    return codes[starts + np.arange(total)]
+
+
+def packed_through(session: Session) -> date | None:
+    """Latest attendance date that may be packed, or ``None`` if nothing was packed."""
+
+    setting = session.exec(select(Setting).where(Setting.key == PACKED_THROUGH_KEY)).first()
+    return date.fromisoformat(setting.value) if setting else None
+
+
+def reads_packed(
+    session: Session, start_date: date | None = None, end_date: date | None = None, include_archived: bool = False
+) -> bool:
+    """Whether a read of the range must include packed marks, by the same rule as the archive."""
+
+    return reaches(packed_through(session), start_date, end_date, include_archived)
+
+
+def load_packed(
+    session: Session,
+    start_date: date | None = None,
+    end_date: date | None = None,
+    class_id: int | None = None,
+    latest_days: int | None = None,
+) -> PackedMarks:
+    """Decode the packed marks in range, or of the ``latest_days`` most recent class-days.
+
+    Marks shadowed by a row-stored mark of the same class, day and student are
+    left out, so callers can simply add these to their row-stored results.
+    """
+
+    marks = _load_days(session, start_date, end_date, class_id, latest_days)
+    if not len(marks):
+        return marks
+    source = attendance_source(session, include_archived=True)
+    statement = select(source.class_id, source.date, source.student_id).where(
+        source.date.between(date.fromordinal(int(marks.days.min())), date.fromordinal(int(marks.days.max())))
+    )
+    if class_id is not None:
+        statement = statement.where(source.class_id == class_id)
+    shadowed = {(row_class, day.toordinal(), student_id) for row_class, day, student_id in session.exec(statement)}
+    if not shadowed:
+        return marks
+    keys = zip(marks.class_ids.tolist(), marks.days.tolist(), marks.student_ids.tolist())
+    return marks.take(np.fromiter((key not in shadowed for key in keys), dtype=bool, count=len(marks)))
+
+
+def _load_days(
+    session: Session,
+    start_date: date | None,
+    end_date: date | None,
+    class_id: int | None,
+    latest_days: int | None = None,
+) -> PackedMarks:
+    statement = select(
+        AttendanceDay.class_id, AttendanceDay.date, AttendanceDay.roster_id, AttendanceDay.statuses, AttendanceDay.ids
+    )
+    if class_id is not None:
+        statement = statement.where(AttendanceDay.class_id == class_id)
+    if start_date is not None:
+        statement = statement.where(AttendanceDay.date >= start_date)
+    if end_date is not None:
+        statement = statement.where(AttendanceDay.date <= end_date)
+    if latest_days is not None:
+        statement = statement.order_by(AttendanceDay.date.desc()).limit(latest_days)
+    days = session.exec(statement).all()
+    if not days:
+        return PackedMarks.empty()
+    class_column, date_column, roster_column, status_column, id_column = zip(*days)
+
+    rosters = {
+        roster_id: decode_ids(blob)
+        for roster_id, blob in session.exec(
+            select(AttendanceRoster.id, AttendanceRoster.student_ids).where(AttendanceRoster.id.in_(set(roster_column)))
+        )
+    }
+    counts = np.array([len(rosters[roster_id]) for roster_id in roster_column], dtype=np.int64)
+    ordinals = np.array([day.toordinal() for day in date_column], dtype=np.int64)
+
+    notes_statement = select(AttendanceNote).where(
+        AttendanceNote.date.between(date.fromordinal(int(ordinals.min())), date.fromordinal(int(ordinals.max())))
+    )
+    if class_id is not None:
+        notes_statement = notes_statement.where(AttendanceNote.class_id == class_id)
+    notes = {
+        (note.class_id, note.date.toordinal(), note.student_id): note.note for note in session.exec(notes_statement)
+    }
+    return PackedMarks(
+        ids=np.concatenate([decode_ids(blob) for blob in id_column]),
+        class_ids=np.repeat(np.array(class_column, dtype=np.int64), counts),
+        student_ids=np.concatenate([rosters[roster_id] for roster_id in roster_column]),
+        days=np.repeat(ordinals, counts),
+        codes=unpack_statuses(status_column, counts),
+        notes=notes,
+    )
+
+
+def drop_students(session: Session, student_ids: Iterable[int]) -> int:
+    """Repack every day that marked one of ``student_ids`` without them; returns the days rewritten.
+
+    Days left with no marks are deleted, and so are rosters no day uses any more.
+    """
+
+    dropped = np.array(sorted(set(student_ids)), dtype=np.int64)
+    affected = {}
+    for roster_id, blob in session.exec(select(AttendanceRoster.id, AttendanceRoster.student_ids)):
+        roster = decode_ids(blob)
+        keep = ~np.isin(roster, dropped)
+        if not keep.all():
+            affected[roster_id] = (roster, keep)
+    if not affected:
+        return 0
+    remaining = {
+        roster_id: encode_ids(roster[keep]) for roster_id, (roster, keep) in affected.items() if keep.any()
+    }
+    digests = {roster_id: hashlib.sha256(blob).hexdigest() for roster_id, blob in remaining.items()}
+    if remaining:
+        session.execute(
+            upsert_insert(session, AttendanceRoster.__table__)
+            .values([{"digest": digests[roster_id], "student_ids": blob} for roster_id, blob in remaining.items()])
+            .on_conflict_do_nothing(index_elements=["digest"])
+        )
+    stored = dict(
+        session.exec(
+            select(AttendanceRoster.digest, AttendanceRoster.id).where(AttendanceRoster.digest.in_(digests.values()))
+        ).all()
+    )
+    days = session.exec(select(AttendanceDay).where(AttendanceDay.roster_id.in_(affected))).all()
+    for day in days:
+        roster, keep = affected[day.roster_id]
+        if day.roster_id not in remaining:
+            session.delete(day)
+            continue
+        day.statuses = pack_statuses(unpack_statuses([day.statuses], np.array([len(roster)]))[keep])
+        day.ids = encode_ids(decode_ids(day.ids)[keep])
+        day.roster_id = stored[digests[day.roster_id]]
+        session.add(day)
+    session.flush()
+    collect_rosters(session)
+    return len(days)
+
+
+def count_packed(session: Session, student_ids: Iterable[int]) -> None:
+    """Store how many packed marks of ``student_ids`` there are, and how many of them attended.
+
+    Call it before refreshing their progress whenever packed days were added,
+    rewritten or deleted.
+    """
+
+    students = np.array(sorted(set(student_ids)), dtype=np.int64)
+    if not len(students):
+        return
+    rosters = {}
+    for roster_id, blob in session.exec(select(AttendanceRoster.id, AttendanceRoster.student_ids)):
+        roster = decode_ids(blob)
+        if np.isin(roster, students).any():
+            rosters[roster_id] = roster
+    marked = attended = np.zeros(len(students), dtype=np.int64)
+    days = []
+    if rosters:
+        statement = select(AttendanceDay.roster_id, AttendanceDay.statuses).where(AttendanceDay.roster_id.in_(rosters))
+        days = session.exec(statement).all()
+    if days:
+        roster_column, status_column = zip(*days)
+        counts = np.array([len(rosters[roster_id]) for roster_id in roster_column], dtype=np.int64)
+        codes = unpack_statuses(status_column, counts)
+        marks = np.concatenate([rosters[roster_id] for roster_id in roster_column])
+        selected = np.isin(marks, students)
+        positions = np.searchsorted(students, marks[selected])
+        marked = np.bincount(positions, minlength=len(students))
+        attended = np.bincount(positions[np.isin(codes[selected], ATTENDED_CODES)], minlength=len(students))
+    statement = upsert_insert(session, StudentPackedAttendance.__table__).values(
+        [
+            {"student_id": student_id, "marked": total, "attended": present}
+            for student_id, total, present in zip(students.tolist(), marked.tolist(), attended.tolist())
+        ]
+    )
+    session.execute(
+        statement.on_conflict_do_update(
+            index_elements=["student_id"],
+            set_={"marked": statement.excluded.marked, "attended": statement.excluded.attended},
+        )
+    )
+
+
+def collect_rosters(session: Session) -> None:
+    """Delete the rosters no packed day points at, e.g. after their class was deleted."""
+
+    session.execute(delete(AttendanceRoster).where(~AttendanceRoster.id.in_(select(AttendanceDay.roster_id))))
+
+
+def _store_packed_through(session: Session, day: date) -> None:
+    setting = session.exec(select(Setting).where(Setting.key == PACKED_THROUGH_KEY)).first() or Setting(
+        key=PACKED_THROUGH_KEY, value=day.isoformat()
+    )
+    setting.value = day.isoformat()
+    setting.updated_at = datetime.utcnow()
+    session.add(setting)
+
+
+def _pack_class(session: Session, class_id: int) -> tuple[int, int]:
+    """Pack every row-stored mark of a class, merging into days packed before; returns (days, marks)."""
+
+    source = attendance_source(session, include_archived=True)
+    rows = session.exec(
+        select(
+            source.id, source.student_id, source.date, source.status, source.note, source.created_at, source.updated_at
+        ).where(source.class_id == class_id)
+    ).all()
+    if not rows:
+        return 0, 0
+    dates = {row[2] for row in rows}
+    marks: dict[date, dict[int, tuple[int, int, str | None]]] = defaultdict(dict)
+    stamps: dict[date, list[datetime]] = defaultdict(list)
+
+    packed = _load_days(session, min(dates), max(dates), class_id)
+    for mark in packed.rows():
+        if mark["date"] in dates:
+            marks[mark["date"]][mark["student_id"]] = (mark["id"], PACKED_CODES[mark["status"]], mark["note"])
+    for day, created_at, updated_at in session.exec(
+        select(AttendanceDay.date, AttendanceDay.created_at, AttendanceDay.updated_at).where(
+            AttendanceDay.class_id == class_id, AttendanceDay.date.in_(dates)
+        )
+    ):
+        stamps[day].extend([created_at, updated_at])
+    for mark_id, student_id, day, state, note, created_at, updated_at in rows:
+        marks[day][student_id] = (mark_id, PACKED_CODES[AttendanceStatus(state)], note)
+        stamps[day].extend([created_at, updated_at])
+
+    rosters: dict[str, bytes] = {}
+    days: list[dict[str, Any]] = []
+    notes: list[dict[str, Any]] = []
+    for day, students in marks.items():
+        student_ids = sorted(students)
+        roster = encode_ids(np.array(student_ids, dtype=np.int64))
+        digest = hashlib.sha256(roster).hexdigest()
+        rosters[digest] = roster
+        days.append(
+            {
+                "class_id": class_id,
+                "date": day,
+                "digest": digest,
+                "statuses": pack_statuses(np.array([students[student][1] for student in student_ids], dtype=np.uint8)),
+                "ids": encode_ids(np.array([students[student][0] for student in student_ids], dtype=np.int64)),
+                "created_at": min(stamps[day]),
+                "updated_at": max(stamps[day]),
+            }
+        )
+        notes.extend(
+            {"class_id": class_id, "date": day, "student_id": student, "note": students[student][2]}
+            for student in student_ids
+            if students[student][2] is not None
+        )
+
+    session.execute(
+        upsert_insert(session, AttendanceRoster.__table__)
+        .values([{"digest": digest, "student_ids": roster} for digest, roster in rosters.items()])
+        .on_conflict_do_nothing(index_elements=["digest"])
+    )
+    roster_ids = dict(
+        session.exec(
+            select(AttendanceRoster.digest, AttendanceRoster.id).where(AttendanceRoster.digest.in_(rosters))
+        ).all()
+    )
+    for day in days:
+        day["roster_id"] = roster_ids[day.pop("digest")]
+    session.execute(delete(AttendanceDay).where(AttendanceDay.class_id == class_id, AttendanceDay.date.in_(dates)))
+    session.execute(delete(AttendanceNote).where(AttendanceNote.class_id == class_id, AttendanceNote.date.in_(dates)))
+    session.execute(AttendanceDay.__table__.insert(), days)
+    if notes:
+        session.execute(AttendanceNote.__table__.insert(), notes)
+    ids = [row[0] for row in rows]
+    for start in range(0, len(ids), DELETE_BATCH_SIZE):
+        batch = ids[start : start + DELETE_BATCH_SIZE]
+        session.execute(delete(Attendance).where(Attendance.id.in_(batch)))
+        session.execute(delete(AttendanceArchive).where(AttendanceArchive.id.in_(batch)))
+    return len(days), len(rows)
+
+
+def table_bytes(session: Session, tables: Sequence[str]) -> int | None:
+    """On-disk size of ``tables`` with their indexes, or ``None`` when the database cannot tell."""
+
+    dialect = session.get_bind().dialect.name
+    if dialect == "sqlite":
+        statement = text(
+            "SELECT SUM(pgsize) FROM dbstat WHERE name IN (SELECT name FROM sqlite_master WHERE tbl_name IN :tables)"
+        ).bindparams(bindparam("tables", expanding=True))
+    elif dialect == "postgresql":
+        statement = text("SELECT SUM(pg_total_relation_size(to_regclass(name))) FROM unnest(:tables) AS name")
+    else:
+        return None
+    try:
+        size = session.execute(statement, {"tables": list(tables)}).scalar()
+    except DBAPIError:  # SQLite built without the dbstat table
+        session.rollback()
+        return None
+    return int(size or 0)
+
+
+def _scan_seconds(scan: Any) -> float:
+    started = time.perf_counter()
+    scan()
+    return round(time.perf_counter() - started, 4)
+
+
+def pack_year(year: str, tenant: str | None = None) -> dict[str, Any]:
+    """Pack the attendance of every class of ``year`` and report the storage and scan-time savings.
+
+    Each class is packed in its own transaction, so an interrupted run can
+    simply be started again. Only a year older than the latest academic year
+    can be packed.
+    """
+
+    with get_session(tenant) as session:
+        latest_year = session.exec(select(func.max(Classroom.academic_year))).one()
+        if latest_year is None or year >= latest_year:
+            raise PackError(f"{year} is not a closed academic year")
+        class_ids = session.exec(select(Classroom.id).where(Classroom.academic_year == year).order_by(Classroom.id)).all()
+        source = attendance_source(session, include_archived=True)
+        first_day, last_day = session.exec(
+            select(func.min(source.date), func.max(source.date)).where(source.class_id.in_(class_ids))
+        ).one()
+        report: dict[str, Any] = {"academic_year": year, "classes": len(class_ids), "class_days": 0, "marks": 0}
+        if last_day is None:
+            return report
+        # Widen the read watermark before rows leave their tables, so
+        # concurrent historical reads never miss them.
+        through = packed_through(session)
+        if through is None or through < last_day:
+            _store_packed_through(session, last_day)
+
+    with get_session(tenant, read_only=True) as session:
+        row_bytes, packed_bytes = table_bytes(session, ROW_TABLES), table_bytes(session, PACKED_TABLES)
+        source = attendance_source(session, include_archived=True)
+
+        def scan_rows() -> None:
+            rows = session.exec(
+                select(source.student_id, source.date, source.status).where(
+                    source.class_id.in_(class_ids), source.date.between(first_day, last_day)
+                )
+            ).all()
+            np.array([PACKED_CODES[AttendanceStatus(state)] for _, _, state in rows], dtype=np.uint8)
+
+        report["row_scan_seconds"] = _scan_seconds(scan_rows)
+
+    for class_id in class_ids:
+        with get_session(tenant) as session:
+            days, marks = _pack_class(session, class_id)
+        report["class_days"] += days
+        report["marks"] += marks
+
+    with get_session(tenant) as session:
+        collect_rosters(session)
+        enrolled = session.exec(select(ClassStudent.student_id).where(ClassStudent.class_id.in_(class_ids))).all()
+        count_packed(session, enrolled)
+        refresh_student_progress(session, enrolled)
+        bump_cache_generation(session)
+    with get_session(tenant, read_only=True) as session:
+        report["packed_scan_seconds"] = _scan_seconds(lambda: load_packed(session, first_day, last_day))
+        if row_bytes is not None and packed_bytes is not None:
+            report["row_bytes_freed"] = row_bytes - (table_bytes(session, ROW_TABLES) or 0)
+            report["packed_bytes_added"] = (table_bytes(session, PACKED_TABLES) or 0) - packed_bytes
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Pack a closed academic year's attendance into per-day bitmaps")
+    parser.add_argument("academic_year")
+    parser.add_argument("--tenant", action="append", default=[], help="pack this school (repeatable)")
+    args = parser.parse_args()
+    for tenant in args.tenant or [None]:
+        print(pack_year(args.academic_year, tenant))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+"""Per-student progress counters, refreshed in the transactions that change them.
+
+Writes call :func:`refresh_student_progress` with the students they touched,
+which recomputes just those rows with one ``INSERT ... SELECT`` upsert. Run
+``python -m app.services.progress`` to rebuild every row from scratch.
+"""
+
+import argparse
+from datetime import datetime
+from typing import Any, Iterable
+
+from sqlalchemy import Float, case, cast, delete, exists, func, literal, union_all
+from sqlalchemy.sql import Select
+from sqlmodel import Session, select
+
+from ..cache import bump_cache_generation
+from ..database import get_session, upsert_insert
+from ..models import (
+    Assignment,
+    Attendance,
+    AttendanceArchive,
+    AttendanceDay,
+    AttendanceStatus,
+    ClassStudent,
+    Student,
+    StudentPackedAttendance,
+    StudentProgress,
+    Submission,
+    SubmissionArchive,
+    SubmissionStatus,
+)
+
+REBUILD_BATCH_SIZE = 1_000
+ATTENDED_STATUSES = (AttendanceStatus.present, AttendanceStatus.late)
+DONE_STATUSES = (SubmissionStatus.submitted, SubmissionStatus.submitted_late, SubmissionStatus.exempt)
+COUNTER_COLUMNS = (
+    "submissions_outstanding",
+    "late_count",
+    "graded_count",
+    "average_score",
+    "attendance_marked",
+    "attendance_attended",
+    "attendance_rate",
+    "updated_at",
+)
+
+
+def progress_query(student_ids: Iterable[int] | Select) -> Select:
+    """Select freshly computed counters for ``student_ids`` (a list or an id subquery).
+
+    Each source is aggregated once with ``GROUP BY student_id`` over the
+    selected students' rows, found through the ``student_id`` indexes, instead
+    of with correlated subqueries per student. Archived attendance and
+    submissions count, and so do packed marks, through the per-student totals
+    in ``student_packed_attendance`` that packing keeps. A mark written to a
+    packed day after packing still counts with its packed status until the
+    year is packed again.
+    """
+
+    if not isinstance(student_ids, Select):
+        student_ids = list(student_ids)
+    done = exists().where(
+        Submission.assignment_id == Assignment.id,
+        Submission.student_id == ClassStudent.student_id,
+        Submission.status.in_(DONE_STATUSES),
+    )
+    outstanding = (
+        select(ClassStudent.student_id, func.count(func.distinct(Assignment.id)).label("count"))
+        .join(Assignment, Assignment.class_id == ClassStudent.class_id)
+        .where(ClassStudent.student_id.in_(student_ids), ClassStudent.archived.is_(False), ~done)
+        .group_by(ClassStudent.student_id)
+        .subquery()
+    )
+    scored = union_all(
+        *(
+            select(table.student_id, table.status, table.score).where(table.student_id.in_(student_ids))
+            for table in (Submission, SubmissionArchive)
+        )
+    ).subquery()
+    submissions = (
+        select(
+            scored.c.student_id,
+            func.count(case((scored.c.status == SubmissionStatus.submitted_late, 1))).label("late"),
+            func.count(scored.c.score).label("graded"),
+            func.avg(scored.c.score).label("average"),
+        )
+        .group_by(scored.c.student_id)
+        .subquery()
+    )
+    marks = union_all(
+        *(
+            select(table.student_id, table.status).where(
+                table.student_id.in_(student_ids),
+                ~exists().where(AttendanceDay.class_id == table.class_id, AttendanceDay.date == table.date),
+            )
+            for table in (Attendance, AttendanceArchive)
+        )
+    ).subquery()
+    attendance = (
+        select(
+            marks.c.student_id,
+            func.count().label("marked"),
+            func.count(case((marks.c.status.in_(ATTENDED_STATUSES), 1))).label("attended"),
+        )
+        .group_by(marks.c.student_id)
+        .subquery()
+    )
+    marked = func.coalesce(attendance.c.marked, 0) + func.coalesce(StudentPackedAttendance.marked, 0)
+    attended = func.coalesce(attendance.c.attended, 0) + func.coalesce(StudentPackedAttendance.attended, 0)
+    return (
+        select(
+            Student.id.label("student_id"),
+            func.coalesce(outstanding.c.count, 0).label("submissions_outstanding"),
+            func.coalesce(submissions.c.late, 0).label("late_count"),
+            func.coalesce(submissions.c.graded, 0).label("graded_count"),
+            submissions.c.average.label("average_score"),
+            marked.label("attendance_marked"),
+            attended.label("attendance_attended"),
+            (cast(attended, Float) / func.nullif(marked, 0)).label("attendance_rate"),
+            literal(datetime.utcnow()).label("updated_at"),
+        )
+        .outerjoin(outstanding, outstanding.c.student_id == Student.id)
+        .outerjoin(submissions, submissions.c.student_id == Student.id)
+        .outerjoin(attendance, attendance.c.student_id == Student.id)
+        .outerjoin(StudentPackedAttendance, StudentPackedAttendance.student_id == Student.id)
+        .where(Student.id.in_(student_ids))  # also lets SQLite parse INSERT ... SELECT ... ON CONFLICT
+    )
+
+
+def refresh_student_progress(session: Session, student_ids: Iterable[int] | Select) -> None:
+    """Recompute the progress rows of ``student_ids`` inside the caller's transaction."""
+
+    if not isinstance(student_ids, Select):
+        student_ids = sorted(set(student_ids))
+        if not student_ids:
+            return
+    table = StudentProgress.__table__
+    statement = upsert_insert(session, table).from_select(["student_id", *COUNTER_COLUMNS], progress_query(student_ids))
+    session.execute(
+        statement.on_conflict_do_update(
+            index_elements=[table.c.student_id],
+            set_={name: statement.excluded[name] for name in COUNTER_COLUMNS},
+        )
+    )
+
+
+def class_roster_ids(class_id: int) -> Select:
+    return select(ClassStudent.student_id).where(ClassStudent.class_id == class_id, ClassStudent.archived.is_(False))
+
+
+def student_progress(session: Session, student_id: int) -> dict[str, Any] | None:
+    """Read the stored row, computing it on the fly for a student never refreshed."""
+
+    stored = session.get(StudentProgress, student_id)
+    if stored is not None:
+        return stored.dict()
+    row = session.execute(progress_query([student_id])).mappings().first()
+    return dict(row) if row is not None else None
+
+
+def rebuild_student_progress(tenant: str | None = None, batch_size: int = REBUILD_BATCH_SIZE) -> int:
+    """Recompute every student's row, one committed batch at a time; returns the student count."""
+
+    with get_session(tenant) as session:
+        session.execute(delete(StudentProgress).where(~StudentProgress.student_id.in_(select(Student.id))))
+    last_id, total = 0, 0
+    while True:
+        with get_session(tenant) as session:
+            ids = session.exec(select(Student.id).where(Student.id > last_id).order_by(Student.id).limit(batch_size)).all()
+            refresh_student_progress(session, ids)
+            if not ids:
+                bump_cache_generation(session)
+                return total
+        total += len(ids)
+        last_id = ids[-1]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Rebuild the student_progress summary table")
+    parser.add_argument("--tenant", action="append", default=[], help="rebuild this school (repeatable)")
+    args = parser.parse_args()
+    for tenant in args.tenant or [None]:
+        print(f"{tenant or 'default'}: rebuilt progress for {rebuild_student_progress(tenant)} students")
+
+
+if __name__ == "__main__":
+    main()
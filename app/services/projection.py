@@ -0,0 +1,35 @@
+"""``?fields=`` projections that narrow the SELECT list of list endpoints."""
+
+from typing import Any, Iterable, Sequence
+
+from fastapi import HTTPException, status
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from sqlmodel import SQLModel
+
+FIELDS_DESCRIPTION = "Comma-separated fields to return, e.g. id,first_name,last_name; selects only those columns"
+
+
+def parse_fields(fields: str | None, schema: type[SQLModel]) -> list[str] | None:
+    """Validate a ``fields`` parameter against ``schema``; ``None`` means every field."""
+
+    if not fields:
+        return None
+    names = list(dict.fromkeys(name.strip() for name in fields.split(",") if name.strip()))
+    unknown = [name for name in names if name not in schema.__fields__]
+    if not names or unknown:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=f"Unknown fields: {', '.join(unknown)}; choose from {', '.join(schema.__fields__)}",
+        )
+    return names
+
+
+def columns(source: Any, names: Iterable[str]) -> list[Any]:
+    return [getattr(source, name) for name in names]
+
+
+def projected_response(names: Sequence[str], rows: Iterable[Sequence[Any]]) -> JSONResponse:
+    """Serialize plain column tuples without hydrating ORM objects or response models."""
+
+    return JSONResponse(jsonable_encoder([dict(zip(names, row)) for row in rows]))
@@ -0,0 +1,182 @@
+"""Set-based year-end promotion of whole classes into the next academic year."""
+
+import re
+from datetime import date, datetime
+from typing import Iterable
+
+from sqlalchemy import case, insert, literal, update
+from sqlmodel import Session, select
+
+from ..config import get_settings
+from ..models import ChangeOperation, ClassPromotion, ClassStudent, Classroom, PromotionSummary, Student
+from .changes import record_changes
+from .progress import refresh_student_progress
+
+
+class PromotionError(Exception):
+    """Raised when a promotion request cannot be mapped onto target classes."""
+
+
+def next_label(value: str) -> str | None:
+    """Increment every number in ``value``: ``2024-25`` becomes ``2025-26``, ``Grade 3`` becomes ``Grade 4``."""
+
+    if not re.search(r"\d", value):
+        return None
+    return re.sub(r"\d+", lambda match: str(int(match.group()) + 1).zfill(len(match.group())), value)
+
+
+def promote_classes(
+    session: Session,
+    sources: Iterable[Classroom],
+    target_year: str | None = None,
+    class_map: dict[int, int] | None = None,
+    grade_map: dict[str, str] | None = None,
+    promotion_date: date | None = None,
+    highest_grade: str | None = None,
+) -> PromotionSummary:
+    """Archive every active enrollment of ``sources`` and re-enroll it in the next year's class.
+
+    Target classes come from ``class_map``, then from an existing class with the
+    next grade and the same section in the target year, and are otherwise
+    created. Classes of ``highest_grade`` (``HIGHEST_GRADE`` by default) that
+    neither map names graduate instead: their enrollments are archived and
+    their students marked inactive. Enrollments move with one
+    ``INSERT ... SELECT`` and one ``UPDATE`` whatever the number of classes, so
+    the caller commits once for the school.
+    """
+
+    sources = list(sources)
+    class_map = dict(class_map or {})
+    grade_map = grade_map or {}
+    promotion_date = promotion_date or date.today()
+    highest_grade = (highest_grade or get_settings().highest_grade).strip()
+    if not sources:
+        raise PromotionError("No classes to promote")
+    years = {source.academic_year for source in sources}
+    target_year = target_year or (next_label(years.pop()) if len(years) == 1 else None)
+    if not target_year:
+        raise PromotionError("target_academic_year is required for these classes")
+    if target_year in {source.academic_year for source in sources}:
+        raise PromotionError("target_academic_year must differ from the source academic year")
+
+    source_ids = {source.id for source in sources}
+    graduating = {
+        source.id
+        for source in sources
+        if source.id not in class_map and source.grade not in grade_map and source.grade.strip() == highest_grade
+    }
+    if source_ids & set(class_map.values()):
+        raise PromotionError("A class cannot be promoted into a class that is itself being promoted")
+    if class_map:
+        known = set(session.exec(select(Classroom.id).where(Classroom.id.in_(class_map.values()))).all())
+        missing = sorted(set(class_map.values()) - known)
+        if missing:
+            raise PromotionError(f"Unknown target classes: {missing}")
+
+    existing = {
+        (grade, section): class_id
+        for class_id, grade, section in session.exec(
+            select(Classroom.id, Classroom.grade, Classroom.section).where(Classroom.academic_year == target_year)
+        ).all()
+    }
+    now = datetime.utcnow()
+    to_create: dict[tuple[str, str | None], dict[str, object]] = {}
+    for source in sources:
+        if source.id in class_map or source.id in graduating:
+            continue
+        grade = grade_map.get(source.grade) or next_label(source.grade) or source.grade
+        key = (grade, source.section)
+        if key not in existing and key not in to_create:
+            name = source.name.replace(source.grade, grade, 1) if source.grade in source.name else source.name
+            to_create[key] = {
+                "name": name,
+                "grade": grade,
+                "section": source.section,
+                "academic_year": target_year,
+                "created_at": now,
+                "updated_at": now,
+            }
+    created_ids: set[int] = set()
+    if to_create:
+        for class_id, grade, section in session.execute(
+            insert(Classroom).returning(Classroom.id, Classroom.grade, Classroom.section), list(to_create.values())
+        ):
+            existing[(grade, section)] = class_id
+            created_ids.add(class_id)
+        record_changes(session, Classroom.__tablename__, created_ids, ChangeOperation.upsert)
+    for source in sources:
+        if source.id not in class_map and source.id not in graduating:
+            grade = grade_map.get(source.grade) or next_label(source.grade) or source.grade
+            class_map[source.id] = existing[(grade, source.section)]
+
+    enrolled = []
+    if class_map.keys() & source_ids:
+        target_class = case(
+            {source_id: class_map[source_id] for source_id in source_ids - graduating}, value=ClassStudent.class_id
+        )
+        already_enrolled = select(ClassStudent.student_id).where(
+            ClassStudent.class_id.in_({class_map[source_id] for source_id in source_ids - graduating}),
+            ClassStudent.archived.is_(False),
+        )
+        active = select(
+            target_class,
+            ClassStudent.student_id,
+            literal(promotion_date),
+            literal(False),
+            literal(now),
+            literal(now),
+        ).where(
+            ClassStudent.class_id.in_(source_ids - graduating),
+            ClassStudent.archived.is_(False),
+            ClassStudent.student_id.not_in(already_enrolled),
+        )
+        enrolled = session.execute(
+            insert(ClassStudent)
+            .from_select(["class_id", "student_id", "start_date", "archived", "created_at", "updated_at"], active)
+            .returning(ClassStudent.id, ClassStudent.student_id)
+        ).all()
+    archived = session.execute(
+        update(ClassStudent)
+        .where(ClassStudent.class_id.in_(source_ids), ClassStudent.archived.is_(False))
+        .values(archived=True, end_date=promotion_date, updated_at=now)
+        .returning(ClassStudent.id, ClassStudent.class_id, ClassStudent.student_id)
+        .execution_options(synchronize_session=False)
+    ).all()
+    record_changes(
+        session, ClassStudent.__tablename__, [row.id for row in enrolled] + [row.id for row in archived], ChangeOperation.upsert
+    )
+    graduates = [row.student_id for row in archived if row.class_id in graduating]
+    if graduates:
+        session.execute(
+            update(Student)
+            .where(Student.id.in_(graduates))
+            .values(active=False, updated_at=now)
+            .execution_options(synchronize_session=False)
+        )
+        record_changes(session, Student.__tablename__, graduates, ChangeOperation.upsert)
+    refresh_student_progress(session, [row.student_id for row in archived])
+
+    source_of = {row.student_id: row.class_id for row in archived}
+    promoted: dict[int, int] = {}
+    for row in enrolled:
+        promoted[source_of[row.student_id]] = promoted.get(source_of[row.student_id], 0) + 1
+    graduated: dict[int, int] = {}
+    for student_id in graduates:
+        graduated[source_of[student_id]] = graduated.get(source_of[student_id], 0) + 1
+    classes = [
+        ClassPromotion(
+            source_class_id=source.id,
+            target_class_id=class_map.get(source.id),
+            created=class_map.get(source.id) in created_ids,
+            promoted=promoted.get(source.id, 0),
+            graduated=graduated.get(source.id, 0),
+        )
+        for source in sources
+    ]
+    return PromotionSummary(
+        academic_year=target_year,
+        classes_created=len(created_ids),
+        students_promoted=sum(promoted.values()),
+        students_graduated=len(graduates),
+        classes=classes,
+    )
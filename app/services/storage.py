@@ -0,0 +1,272 @@
+"""Content-addressed file storage on local disk or S3-compatible object storage.
+
+Uploads are spooled to a temporary file while their size, type and SHA-256
+are checked, then stored once under their hash, so identical files share one
+blob however many times they are uploaded.
+"""
+
+import hashlib
+import os
+import re
+import tempfile
+import zipfile
+from dataclasses import dataclass
+from datetime import datetime
+from functools import lru_cache
+from typing import Any, AsyncIterator, Iterable, Iterator
+from urllib.parse import urlsplit
+
+from sqlmodel import Session, select
+
+from ..config import get_settings
+from ..database import upsert_insert
+from ..models import StoredFile
+
+CHUNK_SIZE = 64 * 1024
+SNIFF_BYTES = 16
+# (offset, magic bytes, extension, content type)
+SIGNATURES = (
+    (0, b"%PDF-", "pdf", "application/pdf"),
+    (0, b"\x89PNG\r\n\x1a\n", "png", "image/png"),
+    (0, b"\xff\xd8\xff", "jpg", "image/jpeg"),
+    (0, b"GIF87a", "gif", "image/gif"),
+    (0, b"GIF89a", "gif", "image/gif"),
+    (8, b"WEBP", "webp", "image/webp"),
+    (4, b"ftyp", "mp4", "video/mp4"),
+    (0, b"PK\x03\x04", "docx", "application/vnd.openxmlformats-officedocument.wordprocessingml.document"),
+)
+EXTENSION_ALIASES = {"jpeg": "jpg"}
+# ``ftyp`` major brands of MP4 video; QuickTime, HEIF and 3GP share the box but not the format.
+MP4_BRANDS = frozenset(
+    {b"isom", b"iso2", b"iso4", b"iso5", b"iso6", b"mp41", b"mp42", b"avc1", b"dash", b"mmp4", b"M4V ", b"MSNV"}
+)
+
+
+class UploadRejected(Exception):
+    """Raised while streaming an upload that breaks the size or type limits."""
+
+    def __init__(self, status_code: int, detail: str) -> None:
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+@dataclass
+class SpooledUpload:
+    path: str
+    sha256: str
+    size: int
+    extension: str
+    content_type: str
+
+
+def sniff(head: bytes) -> tuple[str, str] | None:
+    """Identify a file from its leading bytes, returning ``(extension, content_type)``."""
+
+    for offset, magic, extension, content_type in SIGNATURES:
+        if head[offset : offset + len(magic)] == magic:
+            if extension == "mp4" and head[8:12] not in MP4_BRANDS:
+                return None
+            return extension, content_type
+    return None
+
+
+def is_docx(path: str) -> bool:
+    """Whether the ZIP at ``path`` is a Word document rather than any other archive."""
+
+    try:
+        with zipfile.ZipFile(path) as archive:
+            return any(name.startswith("word/") for name in archive.namelist())
+    except zipfile.BadZipFile:
+        return False
+
+
+async def spool_upload(
+    chunks: AsyncIterator[bytes], max_bytes: int, allowed_types: Iterable[str], directory: str | None = None
+) -> SpooledUpload:
+    """Write ``chunks`` to a temporary file, hashing as it goes.
+
+    The type is sniffed from the first bytes and the size checked on every
+    chunk, so an oversized or disallowed upload is rejected without reading the
+    rest of it. A ZIP is only accepted as ``docx`` once its directory, at the
+    end of the file, shows a ``word/`` part.
+    """
+
+    allowed = {EXTENSION_ALIASES.get(kind.lower(), kind.lower()) for kind in allowed_types}
+    digest = hashlib.sha256()
+    head = b""
+    detected: tuple[str, str] | None = None
+    size = 0
+    handle = tempfile.NamedTemporaryFile(dir=directory, delete=False)
+    try:
+        with handle:
+            async for chunk in chunks:
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadRejected(413, f"File exceeds the {max_bytes // (1024 * 1024)} MB upload limit")
+                if detected is None:
+                    head += chunk[:SNIFF_BYTES]
+                    if len(head) >= SNIFF_BYTES:
+                        detected = _check_type(head, allowed)
+                digest.update(chunk)
+                handle.write(chunk)
+        if size == 0:
+            raise UploadRejected(400, "Empty upload")
+        detected = detected or _check_type(head, allowed)
+        if detected[0] == "docx" and not is_docx(handle.name):
+            raise UploadRejected(415, f"Unsupported file type; allowed: {', '.join(sorted(allowed))}")
+    except BaseException:
+        os.remove(handle.name)
+        raise
+    extension, content_type = detected
+    return SpooledUpload(handle.name, digest.hexdigest(), size, extension, content_type)
+
+
+def _check_type(head: bytes, allowed: set[str]) -> tuple[str, str]:
+    detected = sniff(head)
+    if detected is None or detected[0] not in allowed:
+        raise UploadRejected(415, f"Unsupported file type; allowed: {', '.join(sorted(allowed))}")
+    return detected
+
+
+class LocalStorage:
+    def __init__(self, root: str) -> None:
+        self.root = root
+        self.spool_dir = os.path.join(root, ".incoming")
+        os.makedirs(self.spool_dir, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, key)
+
+    def exists(self, key: str) -> bool:
+        return os.path.exists(self._path(key))
+
+    def save(self, key: str, path: str) -> None:
+        target = self._path(key)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.replace(path, target)
+
+    def delete(self, key: str) -> None:
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def read(self, key: str, start: int, end: int) -> Iterator[bytes]:
+        """Yield bytes ``start`` to ``end`` inclusive."""
+
+        remaining = end - start + 1
+        with open(self._path(key), "rb") as handle:
+            handle.seek(start)
+            while remaining > 0 and (chunk := handle.read(min(CHUNK_SIZE, remaining))):
+                remaining -= len(chunk)
+                yield chunk
+
+
+class S3Storage:
+    spool_dir = None
+
+    def __init__(self, client: Any, bucket: str, prefix: str) -> None:
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def exists(self, key: str) -> bool:
+        from botocore.exceptions import ClientError
+
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self.prefix + key)
+        except ClientError as exc:
+            if exc.response["Error"]["Code"] in {"404", "NoSuchKey", "NotFound"}:
+                return False
+            raise
+        return True
+
+    def save(self, key: str, path: str) -> None:
+        try:
+            self.client.upload_file(path, self.bucket, self.prefix + key)  # multipart for large files
+        finally:
+            os.remove(path)
+
+    def delete(self, key: str) -> None:
+        self.client.delete_object(Bucket=self.bucket, Key=self.prefix + key)
+
+    def read(self, key: str, start: int, end: int) -> Iterator[bytes]:
+        response = self.client.get_object(Bucket=self.bucket, Key=self.prefix + key, Range=f"bytes={start}-{end}")
+        yield from response["Body"].iter_chunks(CHUNK_SIZE)
+
+
+@lru_cache
+def get_storage() -> LocalStorage | S3Storage:
+    """Build the backend for ``file_storage_url``: a directory, or ``http(s)://host/bucket/prefix``."""
+
+    settings = get_settings()
+    if not settings.file_storage_url.startswith(("http://", "https://")):
+        return LocalStorage(settings.file_storage_url)
+    import boto3
+    from botocore.config import Config
+
+    parts = urlsplit(settings.file_storage_url)
+    bucket, _, prefix = parts.path.strip("/").partition("/")
+    client = boto3.client(
+        "s3",
+        endpoint_url=f"{parts.scheme}://{parts.netloc}",
+        aws_access_key_id=settings.file_storage_access_key,
+        aws_secret_access_key=settings.file_storage_secret_key,
+        region_name=settings.file_storage_region,
+        config=Config(s3={"addressing_style": "path"}),
+    )
+    return S3Storage(client, bucket, f"{prefix.strip('/')}/" if prefix else "")
+
+
+def storage_key(tenant: str | None, sha256: str, extension: str) -> str:
+    key = f"{sha256[:2]}/{sha256}.{extension}"
+    return f"{tenant}/{key}" if tenant else key
+
+
+def save_upload(session: Session, storage: LocalStorage | S3Storage, upload: SpooledUpload, filename: str | None) -> StoredFile:
+    """Record ``upload``, reusing the existing blob and row when the content was seen before."""
+
+    existing = session.exec(select(StoredFile).where(StoredFile.sha256 == upload.sha256)).first()
+    if existing is not None:
+        os.remove(upload.path)
+        return existing
+    key = storage_key(session.info.get("tenant"), upload.sha256, upload.extension)
+    if storage.exists(key):
+        os.remove(upload.path)
+    else:
+        storage.save(key, upload.path)
+    now = datetime.utcnow()
+    statement = upsert_insert(session, StoredFile.__table__).values(
+        sha256=upload.sha256,
+        size=upload.size,
+        content_type=upload.content_type,
+        filename=filename,
+        storage_key=key,
+        created_at=now,
+        updated_at=now,
+    )
+    session.execute(statement.on_conflict_do_nothing(index_elements=["sha256"]))
+    return session.exec(select(StoredFile).where(StoredFile.sha256 == upload.sha256)).one()
+
+
+def parse_range(header: str | None, size: int) -> tuple[int, int] | None:
+    """Parse a single ``bytes=`` range into inclusive offsets.
+
+    Returns ``None`` to serve the whole file (no header, or several ranges) and
+    raises ``ValueError`` for a range that cannot be satisfied.
+    """
+
+    match = re.fullmatch(r"bytes=(\d*)-(\d*)", (header or "").strip())
+    if match is None:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        raise ValueError(header)
+    if not first:
+        start, end = max(size - int(last), 0), size - 1
+    else:
+        start, end = int(first), min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise ValueError(header)
+    return start, end
@@ -0,0 +1,65 @@
+"""Set-based submission upserts shared by the single-cell and grid endpoints."""
+
+from datetime import datetime
+from typing import Any, Iterable
+
+from sqlalchemy import func
+from sqlmodel import Session
+
+from ..database import upsert_insert
+from ..models import Assignment, ChangeOperation, Submission, SubmissionCell, SubmissionStatus
+from .archive import ArchivedYearError, assignment_is_archived
+from .changes import record_changes
+from .events import publish_after_commit
+from .progress import refresh_student_progress
+
+SUBMITTED_STATUSES = {SubmissionStatus.submitted, SubmissionStatus.submitted_late}
+
+
+def upsert_submissions(session: Session, assignment_id: int, cells: Iterable[SubmissionCell]) -> list[dict[str, Any]]:
+    """Insert or update one submission per cell and return the stored rows.
+
+    Cells are grouped by the fields the client actually sent so each group is a
+    single ``INSERT ... ON CONFLICT DO UPDATE`` on ``(assignment_id, student_id)``
+    that only overwrites those fields. ``submitted_at`` is stamped when a cell is
+    marked submitted and no earlier timestamp exists. Assignments of an archived
+    year raise ``ArchivedYearError``.
+    """
+
+    if assignment_is_archived(session, assignment_id):
+        raise ArchivedYearError("Submissions of an archived academic year are read-only")
+    now = datetime.utcnow()
+    latest = {cell.student_id: cell for cell in cells}
+    groups: dict[tuple[frozenset[str], bool], list[dict[str, Any]]] = {}
+    for cell in latest.values():
+        sent = frozenset(cell.dict(exclude_unset=True)) - {"student_id"}
+        stamp = cell.status in SUBMITTED_STATUSES
+        row = cell.dict()
+        if stamp:
+            row["submitted_at"] = row["submitted_at"] or now
+        row.update(assignment_id=assignment_id, created_at=now, updated_at=now)
+        groups.setdefault((sent, stamp), []).append(row)
+
+    table = Submission.__table__
+    stored: list[dict[str, Any]] = []
+    for (sent, stamp), rows in groups.items():
+        statement = upsert_insert(session, table).values(rows)
+        excluded = statement.excluded
+        changes: dict[str, Any] = {name: excluded[name] for name in sent}
+        if stamp and "submitted_at" not in sent:
+            changes["submitted_at"] = func.coalesce(table.c.submitted_at, excluded.submitted_at)
+        changes["updated_at"] = excluded.updated_at
+        statement = statement.on_conflict_do_update(
+            index_elements=[table.c.assignment_id, table.c.student_id], set_=changes
+        ).returning(*table.c)
+        stored.extend(dict(row) for row in session.execute(statement).mappings())
+    record_changes(session, Submission.__tablename__, [row["id"] for row in stored], ChangeOperation.upsert)
+    refresh_student_progress(session, [row["student_id"] for row in stored])
+    return stored
+
+
+def publish_submission_updates(session: Session, assignment: Assignment, rows: Iterable[dict[str, Any]]) -> None:
+    """Notify live subscribers of the assignment's class once the session commits."""
+
+    update = {"assignment_id": assignment.id, "student_ids": sorted(row["student_id"] for row in rows)}
+    publish_after_commit(session, f"class:{assignment.class_id}", "submissions", update, key=str(assignment.id))
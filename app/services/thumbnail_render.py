@@ -0,0 +1,27 @@
+"""Thumbnail rendering for the worker processes of ``thumbnails.ThumbnailService``.
+
+Spawned workers import this module to unpickle the task, so it imports only
+Pillow: nothing here may pull in the settings, the database or the app.
+"""
+
+import io
+
+
+def render_thumbnails(data: bytes, sizes: tuple[int, ...]) -> dict[int, bytes]:
+    """Decode ``data`` once and return a square, centre-cropped WebP per size.
+
+    Runs in a worker process, so it only takes and returns plain bytes.
+    """
+
+    from PIL import Image, ImageOps
+
+    with Image.open(io.BytesIO(data)) as image:
+        image.draft("RGB", (max(sizes), max(sizes)))  # lets JPEG decode at reduced scale
+        image = ImageOps.exif_transpose(image)
+        image = image.convert("RGBA" if image.mode in ("RGBA", "LA", "P") else "RGB")
+        rendered = {}
+        for size in sizes:
+            output = io.BytesIO()
+            ImageOps.fit(image, (size, size), Image.LANCZOS).save(output, "WEBP", quality=80, method=4)
+            rendered[size] = output.getvalue()
+    return rendered
@@ -0,0 +1,151 @@
+"""WebP thumbnails of uploaded images, rendered in a process pool and cached on disk.
+
+Variants are cached under the source file's SHA-256, so they never go stale
+and can be served with immutable cache headers. The cache is bounded by
+``thumbnail_cache_mb`` and evicts the least recently used variants.
+"""
+
+import logging
+import multiprocessing
+import os
+import re
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
+from functools import lru_cache
+
+from ..config import get_settings
+from ..models import StoredFile
+from .storage import LocalStorage, S3Storage
+from .thumbnail_render import render_thumbnails
+
+logger = logging.getLogger(__name__)
+
+THUMBNAIL_SIZES = (64, 128, 256)
+ROSTER_THUMBNAIL_SIZE = 128
+FILE_URL = re.compile(r"^/api/v1/files/(\d+)$")
+
+
+class ThumbnailCache:
+    """Content-addressed variant files with least-recently-used eviction."""
+
+    def __init__(self, directory: str, max_bytes: int) -> None:
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict[str, int] = OrderedDict()
+        self._total = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        existing = []
+        for name in os.listdir(directory):
+            if name.endswith(".webp"):
+                stat = os.stat(os.path.join(directory, name))
+                existing.append((stat.st_mtime, name, stat.st_size))
+        for _, name, size in sorted(existing):
+            self._entries[name] = size
+            self._total += size
+
+    @staticmethod
+    def key(sha256: str, size: int) -> str:
+        return f"{sha256}-{size}.webp"
+
+    def get(self, key: str) -> str | None:
+        with self._lock:
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+        path = os.path.join(self.directory, key)
+        try:
+            os.utime(path)  # keeps recency across restarts
+        except FileNotFoundError:
+            with self._lock:
+                self._total -= self._entries.pop(key, 0)
+            return None
+        return path
+
+    def put(self, key: str, data: bytes) -> None:
+        handle = tempfile.NamedTemporaryFile(dir=self.directory, suffix=".tmp", delete=False)
+        with handle:
+            handle.write(data)
+        os.replace(handle.name, os.path.join(self.directory, key))
+        evicted = []
+        with self._lock:
+            self._total += len(data) - self._entries.pop(key, 0)
+            self._entries[key] = len(data)
+            while self._total > self.max_bytes and len(self._entries) > 1:
+                name, size = self._entries.popitem(last=False)
+                self._total -= size
+                evicted.append(name)
+        for name in evicted:
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+
+
+class ThumbnailService:
+    """Render each image's variants at most once at a time, off the request threads."""
+
+    def __init__(self, cache: ThumbnailCache, workers: int) -> None:
+        self.cache = cache
+        self.workers = workers
+        self._pool: ProcessPoolExecutor | None = None
+        self._in_flight: dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    def _executor(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+        return self._pool
+
+    def ensure(self, stored: StoredFile, storage: LocalStorage | S3Storage) -> Future:
+        """Return a future that resolves once every variant of ``stored`` is cached."""
+
+        sha256, storage_key, size = stored.sha256, stored.storage_key, stored.size
+        with self._lock:
+            pending = self._in_flight.get(sha256)
+            if pending is not None:
+                return pending
+            result: Future = Future()
+            missing = [s for s in THUMBNAIL_SIZES if self.cache.get(self.cache.key(sha256, s)) is None]
+            if not missing:
+                result.set_result(None)
+                return result
+            self._in_flight[sha256] = result
+
+        def finish(job: Future) -> None:
+            try:
+                for variant, data in job.result().items():
+                    self.cache.put(self.cache.key(sha256, variant), data)
+            except BaseException as exc:
+                logger.warning("Could not render thumbnails for %s: %s", sha256, exc)
+                result.set_exception(exc)
+            else:
+                result.set_result(None)
+            finally:
+                with self._lock:
+                    self._in_flight.pop(sha256, None)
+
+        try:
+            data = b"".join(storage.read(storage_key, 0, size - 1))
+            self._executor().submit(render_thumbnails, data, tuple(missing)).add_done_callback(finish)
+        except BaseException as exc:
+            with self._lock:
+                self._in_flight.pop(sha256, None)
+            result.set_exception(exc)
+        return result
+
+
+@lru_cache
+def get_thumbnails() -> ThumbnailService:
+    settings = get_settings()
+    cache = ThumbnailCache(settings.thumbnail_cache_dir, settings.thumbnail_cache_mb * 1024 * 1024)
+    return ThumbnailService(cache, settings.thumbnail_workers)
+
+
+def thumbnail_url(photo_url: str | None, size: int = ROSTER_THUMBNAIL_SIZE) -> str | None:
+    """Map an uploaded photo's ``/api/v1/files/<id>`` URL to its thumbnail URL."""
+
+    match = FILE_URL.match(photo_url or "")
+    return f"{photo_url}/thumbnail?size={size}" if match else None
@@ -0,0 +1,119 @@
+"""Add the unique indexes that duplicate rows kept startup from creating.
+
+Tables created before a unique index was declared may hold duplicates, e.g.
+two submissions of one student for one assignment. Startup leaves such an index
+out with a warning; this command deduplicates and adds it::
+
+    python -m app.services.unique_indexes [--tenant <school>]
+
+The run takes a lock first, so concurrent runs wait for it: the write lock
+(``BEGIN IMMEDIATE``) on SQLite, a transaction-level advisory lock on
+PostgreSQL. If any duplicates exist, it then backs up the database: to
+``<database>.<timestamp>.bak`` on SQLite, or with the backup job on PostgreSQL.
+Each group of duplicates keeps its latest row, by the column named in the
+index's ``keep_latest`` info, then by id. The deletes and the new indexes are
+committed together.
+"""
+
+import argparse
+import logging
+from typing import Any
+
+from sqlalchemy import Index, delete, func, select
+from sqlalchemy.engine import Connection
+from sqlalchemy.schema import CreateIndex
+from sqlmodel import SQLModel
+
+from ..cache import bump_cache_generation
+from ..database import engine_for, get_session
+from .backups import run_backup
+from .foreign_keys import LOCK_TIMEOUT_MS, backup_beside
+
+logger = logging.getLogger(__name__)
+
+ADVISORY_LOCK_KEY = 0x756E6971  # "uniq"
+
+
+def add_unique_indexes(tenant: str | None = None) -> dict[str, Any]:
+    """Deduplicate and index every ``keep_latest`` unique index; returns the rows removed per index."""
+
+    bind = engine_for(tenant)
+    indexes = [
+        index for table in SQLModel.metadata.sorted_tables for index in table.indexes if index.info.get("keep_latest")
+    ]
+    report: dict[str, Any] = {"backup": None, "indexes": {}}
+    with bind.connect() as connection:
+        driver = connection.connection.driver_connection
+        if bind.dialect.name == "sqlite":
+            database = bind.url.database
+            if not database or database == ":memory:":
+                raise RuntimeError("In-memory SQLite databases cannot be backed up")
+            isolation_level = driver.isolation_level
+            driver.isolation_level = None  # so the transaction starts with our BEGIN IMMEDIATE
+            connection.exec_driver_sql(f"PRAGMA busy_timeout={LOCK_TIMEOUT_MS}")
+            connection.exec_driver_sql("BEGIN IMMEDIATE")
+        elif bind.dialect.name == "postgresql":
+            connection.execute(select(func.pg_advisory_xact_lock(ADVISORY_LOCK_KEY)))
+        else:
+            raise RuntimeError(f"Unique indexes cannot be added to {bind.dialect.name} databases")
+        try:
+            duplicates = {index.name: _count_duplicates(connection, index) for index in indexes}
+            if any(duplicates.values()):
+                if bind.dialect.name == "sqlite":
+                    report["backup"] = str(backup_beside(database))
+                else:
+                    report["backup"] = run_backup(tenant)["key"]
+            for index in indexes:
+                report["indexes"][index.name] = _drop_duplicates(connection, index) if duplicates[index.name] else 0
+                connection.execute(CreateIndex(index, if_not_exists=True))
+            connection.commit()
+        except BaseException:
+            connection.rollback()
+            raise
+        finally:
+            if bind.dialect.name == "sqlite":
+                driver.isolation_level = isolation_level
+    if report["backup"]:
+        with get_session(tenant) as session:
+            bump_cache_generation(session)
+    return report
+
+
+def _ranked(index: Index) -> Any:
+    table = index.table
+    newest = table.c[index.info["keep_latest"]]
+    return select(
+        table.c.id,
+        func.row_number()
+        .over(partition_by=list(index.columns), order_by=(newest.desc(), table.c.id.desc()))
+        .label("rank"),
+    ).subquery()
+
+
+def _count_duplicates(connection: Connection, index: Index) -> int:
+    ranked = _ranked(index)
+    return connection.execute(select(func.count()).select_from(ranked).where(ranked.c.rank > 1)).scalar_one()
+
+
+def _drop_duplicates(connection: Connection, index: Index) -> int:
+    """Delete the rows that would break unique ``index``, keeping the latest of each group."""
+
+    table, ranked = index.table, _ranked(index)
+    dropped = connection.execute(
+        delete(table).where(table.c.id.in_(select(ranked.c.id).where(ranked.c.rank > 1)))
+    ).rowcount
+    logger.warning("Deleted %s duplicate rows from %s before adding %s", dropped, table.name, index.name)
+    return dropped
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Back up, deduplicate and add the missing unique indexes")
+    parser.add_argument("--tenant", action="append", default=[], help="index this school (repeatable)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    for tenant in args.tenant or [None]:
+        print(f"{tenant or 'default'}: {add_unique_indexes(tenant)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""Class workspace: the roster, one day's attendance and the open assignments together."""
+
+from datetime import date
+
+from sqlmodel import Session, select
+
+from ..models import (
+    Assignment,
+    Attendance,
+    AttendanceRead,
+    ClassStudent,
+    ClassWorkspace,
+    Classroom,
+    Student,
+    SubmissionStatus,
+    WorkspaceStudent,
+)
+from .archive import attendance_source, submission_source
+from .packed_attendance import load_packed, reads_packed
+from .thumbnails import thumbnail_url
+
+
+def build_workspace(session: Session, class_id: int, day: date) -> ClassWorkspace | None:
+    """Assemble the workspace of ``class_id`` for ``day``, or ``None`` if the class does not exist.
+
+    The class, its active roster, its assignments due on or after ``day``, the
+    day's attendance and the submissions for those assignments are read with a
+    fixed number of queries, however large the roster.
+    """
+
+    classroom = session.get(Classroom, class_id)
+    if classroom is None:
+        return None
+    students = session.exec(
+        select(Student)
+        .join(ClassStudent, ClassStudent.student_id == Student.id)
+        .where(ClassStudent.class_id == class_id, ClassStudent.archived.is_(False))
+        .order_by(Student.last_name, Student.first_name)
+    ).all()
+    assignments = session.exec(
+        select(Assignment)
+        .where(Assignment.class_id == class_id, Assignment.due_date >= day)
+        .order_by(Assignment.due_date, Assignment.id)
+    ).all()
+
+    attendance = attendance_source(session, day, day)
+    marks = {
+        mark.student_id: AttendanceRead(**mark.dict())
+        for mark in session.exec(select(attendance).where(attendance.class_id == class_id, attendance.date == day))
+    }
+    if reads_packed(session, day, day):
+        marks.update((mark["student_id"], AttendanceRead(**mark)) for mark in load_packed(session, day, day, class_id).rows())
+    states: dict[tuple[int, int], SubmissionStatus] = {}
+    if assignments:
+        # A day in an archived year may also have its submissions in the archive.
+        submissions = submission_source(session, include_archived=attendance is not Attendance)
+        rows = session.exec(
+            select(submissions.assignment_id, submissions.student_id, submissions.status).where(
+                submissions.assignment_id.in_([assignment.id for assignment in assignments])
+            )
+        )
+        states = {(assignment_id, student_id): state for assignment_id, student_id, state in rows}
+
+    return ClassWorkspace(
+        classroom=classroom,
+        attendance_date=day,
+        assignments=assignments,
+        students=[
+            WorkspaceStudent(
+                **student.dict(),
+                photo_thumbnail_url=thumbnail_url(student.photo_url),
+                attendance=marks.get(student.id),
+                submissions=[
+                    states.get((assignment.id, student.id), SubmissionStatus.not_submitted) for assignment in assignments
+                ],
+            )
+            for student in students
+        ],
+    )
@@ -0,0 +1,78 @@
+"""Fixtures shared by the test suite: the app on a scratch SQLite database and a statement counter."""
+
+import os
+import tempfile
+from dataclasses import dataclass, field
+from typing import Iterator
+
+import pytest
+
+# The engine and settings are built on import, so point them at scratch storage first.
+SCRATCH_DIR = tempfile.mkdtemp(prefix="classroom-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{SCRATCH_DIR}/test.db"
+os.environ["FILE_STORAGE_URL"] = os.path.join(SCRATCH_DIR, "uploads")
+os.environ["THUMBNAIL_CACHE_DIR"] = os.path.join(SCRATCH_DIR, "thumbnails")
+
+from fastapi.testclient import TestClient  # noqa: E402
+from sqlalchemy import event  # noqa: E402
+
+from app.cache import get_cache  # noqa: E402
+from app.database import engine  # noqa: E402
+from app.main import app  # noqa: E402
+from app.security import create_access_token  # noqa: E402
+
+
+@dataclass
+class Statements:
+    """Statements sent and transactions committed while the fixture is active."""
+
+    executed: list[str] = field(default_factory=list)
+    commits: int = 0
+
+    def clear(self) -> None:
+        self.executed.clear()
+        self.commits = 0
+
+    def kinds(self) -> list[str]:
+        return [statement.split(None, 1)[0].upper() for statement in self.executed]
+
+
+@pytest.fixture(scope="session")
+def client() -> TestClient:
+    return TestClient(app)
+
+
+@pytest.fixture(scope="session")
+def auth_headers() -> dict[str, str]:
+    return {"Authorization": f"Bearer {create_access_token({'sub': '1'})}"}
+
+
+@pytest.fixture
+def statements() -> Iterator[Statements]:
+    """Record every statement sent to the database, starting from an empty cache."""
+
+    recorded = Statements()
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+        recorded.executed.append(statement)
+
+    def commit(conn) -> None:
+        recorded.commits += 1
+
+    get_cache.cache_clear()
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    event.listen(engine, "commit", commit)
+    try:
+        yield recorded
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
+        event.remove(engine, "commit", commit)
+
+
+def pytest_addoption(parser: pytest.Parser) -> None:
+    parser.addoption("--update-query-plans", action="store_true", help="rewrite tests/query_plans.json with this run's plans")
+    parser.addoption(
+        "--query-plans-database-url",
+        default=None,
+        help="empty scratch database for the query-plan checks, e.g. a PostgreSQL URL (default: a temporary SQLite file)",
+    )
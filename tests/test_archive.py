@@ -0,0 +1,86 @@
+"""Reads over an archived academic year still see its attendance and submissions."""
+
+from datetime import date, timedelta
+from typing import Iterator
+
+import pytest
+from sqlalchemy import delete
+from sqlmodel import Session
+
+from app.database import engine
+from app.models import Setting
+from app.services.archive import ARCHIVED_YEARS_KEY, ATTENDANCE_THROUGH_KEY, run_archive
+
+ARCHIVED_YEAR = "2023-2024"
+MARKED_DAY = "2023-09-04"
+
+
+@pytest.fixture(scope="module")
+def archived_class(client, auth_headers) -> Iterator[dict[str, int]]:
+    """A class of a closed year with one mark and one graded submission, archived.
+
+    The class and the archive markers are removed afterwards, so the other
+    modules' statement budgets do not pay for archive lookups.
+    """
+
+    classroom = client.post(
+        "/api/v1/classes/",
+        json={"name": "Grade 3 Archive", "grade": "3", "section": "Z", "academic_year": ARCHIVED_YEAR},
+        headers=auth_headers,
+    ).json()
+    student = client.post(
+        "/api/v1/students/?on_duplicate=create",
+        json={
+            "first_name": "Archana",
+            "last_name": "Velu",
+            "date_of_birth": "2014-05-06",
+            "guardian_name": "Velu",
+            "guardian_contact": "0771199999",
+        },
+        headers=auth_headers,
+    ).json()
+    client.post(f"/api/v1/students/{student['id']}/enroll?class_id={classroom['id']}", headers=auth_headers)
+    client.post(
+        "/api/v1/attendance/bulk",
+        json=[{"class_id": classroom["id"], "student_id": student["id"], "date": MARKED_DAY, "status": "present"}],
+        headers=auth_headers,
+    )
+    assignment = client.post(
+        "/api/v1/assignments/",
+        json={"class_id": classroom["id"], "title": "Essay", "due_date": (date.today() + timedelta(days=7)).isoformat()},
+        headers=auth_headers,
+    ).json()
+    client.post(
+        f"/api/v1/assignments/{assignment['id']}/submissions",
+        json={"assignment_id": assignment["id"], "student_id": student["id"], "status": "submitted", "score": 8},
+        headers=auth_headers,
+    )
+    report = run_archive(ARCHIVED_YEAR)
+    assert report["attendance"] == 1 and report["submissions"] == 1
+    yield {"class_id": classroom["id"], "student_id": student["id"]}
+    client.delete(f"/api/v1/classes/{classroom['id']}", headers=auth_headers)
+    client.delete(f"/api/v1/students/{student['id']}", headers=auth_headers)
+    with Session(engine) as session:
+        session.execute(delete(Setting).where(Setting.key.in_([ARCHIVED_YEARS_KEY, ATTENDANCE_THROUGH_KEY])))
+        session.commit()
+
+
+def test_attendance_report_reads_archived_year(client, auth_headers, archived_class):
+    response = client.get(
+        f"/api/v1/reports/attendance?class_id={archived_class['class_id']}&start_date={MARKED_DAY}&end_date={MARKED_DAY}",
+        headers=auth_headers,
+    )
+
+    assert response.status_code == 200, response.text
+    students = response.json()["students"]
+    assert [row["student_id"] for row in students] == [archived_class["student_id"]]
+    assert students[0]["days_marked"] == 1
+
+
+def test_gradebook_reads_archived_submissions(client, auth_headers, archived_class):
+    response = client.get(f"/api/v1/classes/{archived_class['class_id']}/gradebook", headers=auth_headers)
+
+    assert response.status_code == 200, response.text
+    row = next(row for row in response.json()["students"] if row["student_id"] == archived_class["student_id"])
+    assert row["grades"] == [{"status": "submitted", "score": 8}]
+    assert row["average_score"] == 8
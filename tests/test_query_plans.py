@@ -0,0 +1,367 @@
+"""Query-plan checks for the routers' hot paths.
+
+The suite fills a scratch database with a school-sized dataset, replays a fixed
+set of requests through the app while capturing every statement they send, and
+runs ``EXPLAIN QUERY PLAN`` (SQLite) or ``EXPLAIN`` (PostgreSQL) on each one.
+It fails when a hot path scans one of the tables it is expected to search by
+index, or when a plan differs from the reviewed snapshot in
+``query_plans.json``; rewrite the snapshot with ``--update-query-plans``.
+``--query-plans-database-url`` runs it against an empty scratch PostgreSQL.
+"""
+
+import json
+import os
+import random
+import re
+import tempfile
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from datetime import date, datetime, timedelta
+from typing import Any, Iterator
+
+import pytest
+from fastapi import Request
+from fastapi.testclient import TestClient
+from sqlalchemy import event, insert
+from sqlalchemy.engine import Engine
+from sqlmodel import Session, create_engine, select
+
+from app.database import get_session, init_db
+from app.dependencies import get_db, get_read_db, get_tenant
+from app.models import (
+    Assignment,
+    Attendance,
+    AttendanceStatus,
+    ClassStudent,
+    Classroom,
+    Setting,
+    Student,
+    Submission,
+    SubmissionStatus,
+    User,
+)
+from app.main import app
+from app.security import create_access_token, hash_password
+from app.services.progress import refresh_student_progress
+
+SNAPSHOT_PATH = os.path.join(os.path.dirname(__file__), "query_plans.json")
+STUDENTS_PER_CLASS = 30
+ASSIGNMENTS_PER_CLASS = 8
+SCHOOL_DAYS = 20
+STUDENT_COUNT = 3_000
+TEACHER_PASSWORD = "query-plans"
+EXPLAINED = re.compile(r"^\s*(SELECT|INSERT|UPDATE|DELETE|WITH)\b", re.IGNORECASE)
+SQLITE_SCAN = re.compile(r"^SCAN (\w+)")
+POSTGRES_SCAN = re.compile(r"Seq Scan on (\w+)")
+
+
+@dataclass(frozen=True)
+class Probe:
+    """A request to replay; ``guarded`` tables must be searched, never scanned."""
+
+    name: str
+    method: str
+    path: str
+    guarded: tuple[str, ...] = ()
+    body: str | None = None  # name of a JSON body built from the dataset
+    form: dict[str, str] | None = None
+
+
+@dataclass
+class Dataset:
+    class_id: int
+    assignment_id: int
+    student_ids: list[int]
+    day: date
+    teacher_email: str
+
+
+@dataclass
+class Finding:
+    statement: str
+    plan: list[str]
+    scanned: list[str] = field(default_factory=list)
+
+
+PROBES = (
+    Probe("user by email", "POST", "/api/v1/auth/token", ("users",), form={"username": "{teacher_email}"}),
+    Probe("user by id", "GET", "/api/v1/classes/{class_id}", ("users", "classes")),
+    Probe("attendance by class and date", "GET", "/api/v1/attendance/?class_id={class_id}&start_date={day}&end_date={day}", ("attendance",)),
+    Probe("attendance and birthdays today", "GET", "/api/v1/dashboard/today", ("attendance", "assignments", "students")),
+    Probe("roster by class", "GET", "/api/v1/classes/{class_id}/students", ("class_students", "students")),
+    Probe(
+        "class workspace",
+        "GET",
+        "/api/v1/classes/{class_id}/workspace?date={day}",
+        ("class_students", "attendance", "assignments", "submissions"),
+    ),
+    Probe("submissions by assignment", "GET", "/api/v1/assignments/{assignment_id}/submissions", ("submissions",)),
+    Probe("birthdays by day", "POST", "/api/v1/birthdays/run", ("students", "settings")),
+    Probe("settings by key", "GET", "/api/v1/birthdays/settings/template", ("settings",)),
+    # Every write refreshes its students' progress rows through per-student subqueries.
+    Probe(
+        "mark attendance",
+        "POST",
+        "/api/v1/attendance/bulk",
+        ("attendance", "submissions", "class_students", "assignments"),
+        body="attendance",
+    ),
+    # Snapshot only: reviewed when their plans change, but allowed to scan.
+    Probe("student search", "GET", "/api/v1/students/?search=an"),
+    Probe("gradebook", "GET", "/api/v1/classes/{class_id}/gradebook"),
+    Probe("class progress", "GET", "/api/v1/classes/{class_id}/progress?sort=attendance_rate"),
+    Probe("attendance report", "GET", "/api/v1/reports/attendance?class_id={class_id}"),
+)
+
+
+def build_dataset(bind: Engine, student_count: int, seed: int = 7) -> Dataset:
+    """Create the schema on ``bind`` and fill it with ``student_count`` students' worth of rows."""
+
+    init_db(bind)
+    rng = random.Random(seed)
+    today = date.today()
+    now = datetime.utcnow()
+    stamps = {"created_at": now, "updated_at": now}
+    class_count = max(student_count // STUDENTS_PER_CLASS, 1)
+    days = [today - timedelta(days=offset) for offset in range(SCHOOL_DAYS * 2) if (today - timedelta(days=offset)).weekday() < 5]
+    days = days[:SCHOOL_DAYS]
+    password = hash_password(TEACHER_PASSWORD)
+    with bind.begin() as connection:
+        connection.execute(
+            insert(User),
+            [
+                {"email": f"teacher{index}@example.com", "full_name": f"Teacher {index}", "hashed_password": password, **stamps}
+                for index in range(class_count)
+            ],
+        )
+        connection.execute(
+            insert(Classroom),
+            [
+                {"name": f"Grade {index % 6 + 1}{chr(65 + index // 6 % 26)}", "grade": str(index % 6 + 1), "academic_year": "2024", **stamps}
+                for index in range(class_count)
+            ],
+        )
+        connection.execute(
+            insert(Student),
+            [
+                {
+                    "first_name": f"Student{index}",
+                    "last_name": rng.choice(("Perera", "Fernando", "Silva", "Bandara", "Jayasuriya")),
+                    "date_of_birth": date(2014 + index % 5, 1, 1) + timedelta(days=rng.randrange(365)),
+                    "guardian_name": f"Guardian {index}",
+                    "guardian_contact": f"077{index:07d}",
+                    "active": True,
+                    **stamps,
+                }
+                for index in range(student_count)
+            ],
+        )
+        class_ids = connection.execute(select(Classroom.id).order_by(Classroom.id)).scalars().all()
+        student_ids = connection.execute(select(Student.id).order_by(Student.id)).scalars().all()
+        roster = {class_id: student_ids[offset::class_count] for offset, class_id in enumerate(class_ids)}
+        connection.execute(
+            insert(ClassStudent),
+            [
+                {"class_id": class_id, "student_id": student_id, "start_date": days[-1], "archived": False, **stamps}
+                for class_id, members in roster.items()
+                for student_id in members
+            ],
+        )
+        connection.execute(
+            insert(Attendance),
+            [
+                {
+                    "class_id": class_id,
+                    "student_id": student_id,
+                    "date": day,
+                    "status": rng.choices(list(AttendanceStatus), weights=(85, 8, 5, 2))[0],
+                    **stamps,
+                }
+                for class_id, members in roster.items()
+                for student_id in members
+                for day in days
+            ],
+        )
+        connection.execute(
+            insert(Assignment),
+            [
+                {"class_id": class_id, "title": f"Homework {index}", "due_date": today + timedelta(days=index - 4), **stamps}
+                for class_id in class_ids
+                for index in range(ASSIGNMENTS_PER_CLASS)
+            ],
+        )
+        assignments = connection.execute(select(Assignment.id, Assignment.class_id).order_by(Assignment.id)).all()
+        connection.execute(
+            insert(Submission),
+            [
+                {
+                    "assignment_id": assignment_id,
+                    "student_id": student_id,
+                    "status": rng.choice((SubmissionStatus.submitted, SubmissionStatus.submitted_late)),
+                    "score": rng.randint(40, 100),
+                    **stamps,
+                }
+                for assignment_id, class_id in assignments
+                for student_id in roster[class_id]
+                if rng.random() < 0.8
+            ],
+        )
+        connection.execute(
+            insert(Setting),
+            [{"key": f"setting_{index}", "value": str(index), **stamps} for index in range(200)],
+        )
+    with Session(bind) as session:
+        refresh_student_progress(session, select(Student.id))
+        session.commit()
+    with bind.begin() as connection:
+        connection.exec_driver_sql("ANALYZE")  # plans should reflect this data, not an empty schema
+    return Dataset(class_ids[0], assignments[0][0], roster[class_ids[0]], days[0], "teacher0@example.com")
+
+
+@contextmanager
+def capture(bind: Engine) -> Iterator[list[tuple[str, Any]]]:
+    """Collect ``(statement, parameters)`` for everything executed on ``bind``."""
+
+    statements: list[tuple[str, Any]] = []
+
+    def record(conn: Any, cursor: Any, statement: str, parameters: Any, context: Any, executemany: bool) -> None:
+        if EXPLAINED.match(statement):
+            if parameters and isinstance(parameters, (list, tuple)) and isinstance(parameters[0], (list, tuple, dict)):
+                parameters = parameters[0]  # one set of an executemany is enough to plan it
+            statements.append((statement, tuple(parameters) if isinstance(parameters, list) else parameters))
+
+    event.listen(bind, "before_cursor_execute", record)
+    try:
+        yield statements
+    finally:
+        event.remove(bind, "before_cursor_execute", record)
+
+
+def explain(bind: Engine, statement: str, parameters: Any, guarded: tuple[str, ...]) -> Finding:
+    dialect = bind.dialect.name
+    with bind.connect() as connection:
+        if dialect == "postgresql":
+            rows = connection.exec_driver_sql(f"EXPLAIN {statement}", parameters).all()
+            plan = [row[0] for row in rows]
+            scans = [match.group(1) for line in plan if (match := POSTGRES_SCAN.search(line))]
+        else:
+            rows = connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters).all()
+            plan = [row[-1] for row in rows]
+            scans = [match.group(1) for line in plan if (match := SQLITE_SCAN.match(line))]
+        connection.rollback()
+    scanned = sorted({re.sub(r"_\d+$", "", name) for name in scans} & set(guarded))
+    return Finding(" ".join(statement.split()), plan, scanned)
+
+
+def run_probes(bind: Engine, dataset: Dataset) -> dict[str, list[Finding]]:
+    """Replay every probe through the app against ``bind`` and explain what it ran."""
+
+    def scratch_db(request: Request) -> Iterator[Session]:
+        with get_session(bind=bind) as session:
+            session.info["use_cache"] = False  # a cached read would hide its queries
+            request.state.session = session  # where get_current_user looks for it
+            yield session
+
+    def scratch_read_db(request: Request) -> Iterator[Session]:
+        with get_session(bind=bind, read_only=True) as session:
+            session.info["use_cache"] = False
+            request.state.session = session
+            yield session
+
+    app.dependency_overrides[get_tenant] = lambda: None
+    app.dependency_overrides[get_db] = scratch_db
+    app.dependency_overrides[get_read_db] = scratch_read_db
+    values = {
+        "class_id": dataset.class_id,
+        "assignment_id": dataset.assignment_id,
+        "day": dataset.day.isoformat(),
+        "teacher_email": dataset.teacher_email,
+    }
+    bodies = {
+        "attendance": [
+            {"class_id": dataset.class_id, "student_id": student_id, "date": dataset.day.isoformat(), "status": "present"}
+            for student_id in dataset.student_ids
+        ]
+    }
+    headers = {"Authorization": "Bearer " + create_access_token({"sub": "1"})}
+    results: dict[str, list[Finding]] = {}
+    try:
+        with TestClient(app) as client:
+            for probe in PROBES:
+                form = {key: value.format(**values) for key, value in (probe.form or {}).items()}
+                if form:
+                    form.setdefault("password", TEACHER_PASSWORD)
+                with capture(bind) as statements:
+                    response = client.request(
+                        probe.method,
+                        probe.path.format(**values),
+                        headers=headers,
+                        json=bodies[probe.body] if probe.body else None,
+                        data=form or None,
+                    )
+                if response.status_code >= 400:
+                    raise RuntimeError(f"{probe.name}: {probe.method} {probe.path} returned {response.status_code}: {response.text}")
+                results[probe.name] = [explain(bind, statement, parameters, probe.guarded) for statement, parameters in statements]
+    finally:
+        app.dependency_overrides.clear()
+    return results
+
+
+def load_snapshot(path: str = SNAPSHOT_PATH) -> dict[str, Any]:
+    try:
+        with open(path, encoding="utf-8") as handle:
+            return json.load(handle)
+    except FileNotFoundError:
+        return {}
+
+
+def snapshot_entry(findings: list[Finding]) -> list[dict[str, Any]]:
+    return [{"statement": finding.statement, "plan": finding.plan} for finding in findings]
+
+
+@pytest.fixture(scope="module")
+def findings(pytestconfig: pytest.Config) -> Iterator[tuple[str, dict[str, list[Finding]]]]:
+    """Run every probe once against a freshly filled scratch database."""
+
+    directory = None
+    url = pytestconfig.getoption("query_plans_database_url")
+    if url is None:
+        directory = tempfile.TemporaryDirectory()
+        url = f"sqlite:///{directory.name}/query_plans.db"
+    bind = create_engine(url)
+    try:
+        results = run_probes(bind, build_dataset(bind, STUDENT_COUNT))
+    finally:
+        bind.dispose()
+        if directory is not None:
+            directory.cleanup()
+    yield bind.dialect.name, results
+    if pytestconfig.getoption("update_query_plans"):
+        snapshot = load_snapshot()
+        snapshot[bind.dialect.name] = {probe.name: snapshot_entry(results[probe.name]) for probe in PROBES}
+        with open(SNAPSHOT_PATH, "w", encoding="utf-8") as handle:
+            json.dump(snapshot, handle, indent=2, sort_keys=True)
+            handle.write("\n")
+
+
+@pytest.mark.parametrize("probe", [probe for probe in PROBES if probe.guarded], ids=lambda probe: probe.name)
+def test_hot_path_uses_indexes(findings, probe):
+    _, results = findings
+    scans = [
+        f"{', '.join(finding.scanned)}: {finding.statement}\n    " + "\n    ".join(finding.plan)
+        for finding in results[probe.name]
+        if finding.scanned
+    ]
+    assert not scans, "full scans on a hot path:\n" + "\n".join(scans)
+
+
+@pytest.mark.parametrize("probe", PROBES, ids=lambda probe: probe.name)
+def test_plans_match_snapshot(findings, probe, pytestconfig):
+    if pytestconfig.getoption("update_query_plans"):
+        pytest.skip("rewriting the snapshot")
+    dialect, results = findings
+    reviewed = load_snapshot().get(dialect, {})
+    assert probe.name in reviewed, "no snapshot yet; review the plans and rerun with --update-query-plans"
+    assert snapshot_entry(results[probe.name]) == reviewed[probe.name], (
+        "plans differ from the snapshot; review them and rerun with --update-query-plans"
+    )